@@ -0,0 +1,258 @@
+"""
+Offline stand-in for the Sefaria v3 texts API, used by the benchmark suite.
+
+Serves GET /api/v3/texts/<ref> with the same `versions[0].text` shape that
+talmud_booklet.py reads:
+    Berakhot_2a                -> ["segment", ...]
+    Berakhot.2a-3b             -> [["segment", ...], ...]   (one list per daf)
+    Rashi_on_Berakhot.2a       -> [["comment", ...], ...]   (one list per segment)
+    Rashi_on_Berakhot.2a.3     -> ["comment", ...]
+
+and GET /api/shape/<title> with the per-amud lengths read by the tractate index.
+
+Payloads are either synthetic (deterministic per ref) or recorded: with
+--recorded DIR, responses are read from a data/ directory written by
+talmud_booklet.py, and refs that are not recorded return 404.
+
+Latency and error rates can be injected to simulate a slow or flaky API.
+
+Usage:
+    python benchmarks/mock_sefaria.py --port 8765 --latency-ms 50 --error-rate 0.02
+    python talmud_booklet.py Berakhot_2a --api-base-url http://127.0.0.1:8765/api/v3/texts/
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from talmud_booklet import (  # noqa: E402
+    BAVLI_TRACTATES, FileResponseStore, amud_index, generate_talmud_refs, load_cache_file, parse_talmud_page,
+)
+
+API_PREFIX = "/api/v3/texts/"
+SHAPE_PREFIX = "/api/shape/"
+HEBREW_WORDS = ["אמר", "רבי", "יוחנן", "מאימתי", "קורין", "את", "שמע", "בערבית", "משעה",
+                "שהכהנים", "נכנסים", "לאכול", "בתרומתן", "עד", "סוף", "האשמורה", "הראשונה"]
+
+def synthetic_words(rng, min_words, max_words):
+    return " ".join(rng.choice(HEBREW_WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+class SyntheticCorpus:
+    """Deterministic fake tractate text. Every Bavli tractate runs from 2a to
+    {last_daf}a; every daf has between min_segments and max_segments segments;
+    commentaries cover about comment_ratio of the segments."""
+
+    def __init__(self, min_segments=6, max_segments=14, comment_ratio=0.6, seed=0, last_daf=64):
+        self.min_segments = min_segments
+        self.max_segments = max_segments
+        self.comment_ratio = comment_ratio
+        self.seed = seed
+        self.last_amud = amud_index(last_daf, "a")
+
+    def has_daf(self, tractate, daf):
+        try:
+            _, page, side = parse_talmud_page(f"{tractate}_{daf}")
+        except ValueError:
+            return False
+        return tractate in BAVLI_TRACTATES and 2 <= amud_index(page, side) <= self.last_amud
+
+    def _rng(self, key):
+        return random.Random(zlib.crc32(f"{self.seed}:{key}".encode("utf-8")))
+
+    def segment_count(self, tractate, daf):
+        return self._rng(f"{tractate}.{daf}").randint(self.min_segments, self.max_segments)
+
+    def daf_text(self, tractate, daf):
+        rng = self._rng(f"{tractate}.{daf}")
+        count = rng.randint(self.min_segments, self.max_segments)
+        return [synthetic_words(rng, 8, 60) for _ in range(count)]
+
+    def segment_comments(self, commentary, tractate, daf, segment):
+        rng = self._rng(f"{commentary}.{daf}.{segment}")
+        if rng.random() > self.comment_ratio:
+            return []
+        return [synthetic_words(rng, 5, 40) for _ in range(rng.randint(1, 3))]
+
+    def response(self, ref):
+        """Return the API payload for ref, or None if the ref does not exist."""
+        if "_on_" in ref:
+            commentary, _, rest = ref.partition("_on_")
+            tractate, _, location = rest.partition(".")
+            parts = location.split(".")
+            daf = parts[0]
+            if not self.has_daf(tractate, daf):
+                return None
+            segments = self.segment_count(tractate, daf)
+            if len(parts) == 1:
+                text = [self.segment_comments(commentary, tractate, daf, i) for i in range(1, segments + 1)]
+            else:
+                segment = int(parts[1])
+                if segment > segments:
+                    return None
+                text = self.segment_comments(commentary, tractate, daf, segment)
+                if not text:
+                    return None
+            title = f"{commentary} on {tractate}"
+        elif "-" in ref:
+            tractate, _, span = ref.partition(".")
+            start, _, end = span.partition("-")
+            if not (self.has_daf(tractate, start) and self.has_daf(tractate, end)):
+                return None
+            try:
+                refs = generate_talmud_refs(f"{tractate}_{start}", f"{tractate}_{end}")
+            except ValueError:
+                return None
+            text = [self.daf_text(tractate, daf_ref.split("_")[1]) for daf_ref in refs]
+            title = tractate
+        else:
+            try:
+                tractate, page, side = parse_talmud_page(ref)
+            except ValueError:
+                return None
+            if not self.has_daf(tractate, f"{page}{side}"):
+                return None
+            text = self.daf_text(tractate, f"{page}{side}")
+            title = tractate
+        return {"ref": ref, "title": title, "versions": [{"text": text, "language": "he"}]}
+
+    def shape(self, title):
+        """Per-amud 'chapters' of the shape API for title, or None if it does not exist."""
+        commentary, _, tractate = title.rpartition("_on_")
+        if tractate not in BAVLI_TRACTATES:
+            return None
+        chapters = []
+        for position in range(self.last_amud + 1):
+            daf = f"{position // 2 + 1}{'ab'[position % 2]}"
+            segments = self.segment_count(tractate, daf) if position >= 2 else 0
+            if commentary:
+                chapters.append([len(self.segment_comments(commentary, tractate, daf, i))
+                                 for i in range(1, segments + 1)])
+            else:
+                chapters.append(segments)
+        return chapters
+
+class RecordedCorpus:
+    """Serves responses recorded in a data/ directory (one cache file per ref).
+    Files are only read, never migrated."""
+
+    def __init__(self, data_dir):
+        self.store = FileResponseStore(data_dir)
+
+    def response(self, ref):
+        for path in self.store.candidate_paths(ref):
+            if os.path.exists(path):
+                return load_cache_file(path)[0]
+        return None
+
+class MockSefariaServer:
+    """Threaded HTTP server with injectable latency and error rate.
+
+        with MockSefariaServer(latency_ms=20) as server:
+            configure_http(api_base_url=server.base_url)
+    """
+
+    def __init__(self, corpus=None, host="127.0.0.1", port=0, latency_ms=0.0, latency_jitter_ms=0.0,
+                 error_rate=0.0, seed=0):
+        self.corpus = corpus or SyntheticCorpus(seed=seed)
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                with server._lock:
+                    server.requests += 1
+                    delay = server.latency_ms + server._rng.uniform(0, server.latency_jitter_ms)
+                    fail = server._rng.random() < server.error_rate
+                    if fail:
+                        server.errors += 1
+                if delay:
+                    time.sleep(delay / 1000)
+                if fail:
+                    return self._send(503, {"error": "Injected failure"})
+                if path.startswith(SHAPE_PREFIX) and hasattr(server.corpus, "shape"):
+                    title = unquote(path[len(SHAPE_PREFIX):])
+                    chapters = server.corpus.shape(title)
+                    if chapters is None:
+                        return self._send(200, {"error": f"No index for {title}"})
+                    return self._send(200, [{"title": title, "chapters": chapters, "length": len(chapters)}])
+                if not path.startswith(API_PREFIX):
+                    return self._send(404, {"error": f"Unknown path {path}"})
+                ref = unquote(path[len(API_PREFIX):])
+                data = server.corpus.response(ref)
+                if data is None:
+                    return self._send(404, {"error": f"No text for {ref}"})
+                self._send(200, data)
+
+            def _send(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-sefaria", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline mock of the Sefaria v3 texts API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Fixed latency added to every response")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0, help="Random extra latency (uniform)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--recorded", metavar="DIR", help="Serve responses recorded in a data/ directory")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus and injected errors")
+    args = parser.parse_args()
+
+    corpus = RecordedCorpus(args.recorded) if args.recorded else SyntheticCorpus(seed=args.seed)
+    server = MockSefariaServer(corpus, args.host, args.port, args.latency_ms, args.latency_jitter_ms,
+                               args.error_rate, args.seed)
+    print(f"Mock Sefaria API at {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
@@ -0,0 +1,207 @@
+"""
+Reproducible offline benchmarks for the talmud_booklet.py pipeline.
+
+Each scenario runs in its own scratch working directory against the local mock
+Sefaria server (benchmarks/mock_sefaria.py), and times the phases of a build:
+
+    content  - assembling all_content: API fetches (cold), data/ reads (warm)
+               or the whole-range content cache (content_cache)
+    html     - generating the HTML document, including the embedded font subset
+    render   - Chromium PDF rendering (skipped with --no-render)
+
+Scenarios cover cold cache, warm data/ cache and the content-cache hit path,
+for both --text_format modes and every range size in --sizes. Results are
+written as JSON so runs can be compared for regressions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 1 10 100 --latency-ms 30 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import talmud_booklet as tb  # noqa: E402
+from mock_sefaria import MockSefariaServer, SyntheticCorpus  # noqa: E402
+
+CACHE_SCENARIOS = ["cold", "warm", "content_cache"]
+TEXT_FORMATS = ["optimize", "text-commentaries"]
+DEFAULT_COMMENTARIES = ["Rashi_on_Berakhot:8:#0000FF", "Tosafot_on_Berakhot:8:#008000"]
+
+def range_for_size(tractate, num_dafs):
+    """Range spec covering num_dafs sides starting at 2a, e.g. 3 -> Berakhot_2a-Berakhot_3a."""
+    last = num_dafs - 1
+    end = f"{tractate}_{2 + last // 2}{'a' if last % 2 == 0 else 'b'}"
+    return f"{tractate}_2a-{end}"
+
+@contextmanager
+def scratch_workdir():
+    """Run inside a fresh directory so data/ and content_cache/ start empty, with a
+    fresh response store, in-memory response memo and tractate index, so nothing
+    fetched by an earlier run is reused."""
+    previous = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="talmud_bench_")
+    os.chdir(workdir)
+    tb.configure_response_store("files")
+    tb.configure_response_memo(tb.DEFAULT_MEMO_SIZE)
+    tb.configure_tractate_index(tb.TractateIndex())
+    try:
+        yield workdir
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def build_content(refs, commentary_prefixes, max_concurrency, commentary_fetch):
+    return {'cover': None, 'pages': tb.assemble_pages(refs, commentary_prefixes, max_concurrency, commentary_fetch)}
+
+def run_scenario(server, ref_range, scenario, text_format, args):
+    """Run one build and return its phase timings in seconds."""
+    commentary_prefixes = []
+    commentary_styles = {}
+    for spec in args.commentaries:
+        name, size, color = tb.parse_commentary_spec(spec)
+        commentary_prefixes.append(name)
+        commentary_styles[name] = {'font_size': size or args.font_size - 2, 'color': color or '#000000'}
+    refs = tb.generate_talmud_refs(*tb.parse_range(ref_range))
+    cache_filename = tb.generate_content_cache_filename(ref_range, args.commentaries, False)
+    font_path = os.path.abspath(args.font)
+
+    with scratch_workdir():
+        # Prime the caches the scenario expects to be warm
+        if scenario != "cold":
+            all_content = build_content(refs, commentary_prefixes, args.max_concurrency, args.commentary_fetch)
+            shutil.rmtree(tb.PAGE_CACHE_DIR, ignore_errors=True)
+            if scenario == "content_cache":
+                tb.save_content_cache(all_content, cache_filename)
+            # Warm runs read data/, not responses the priming build left in memory
+            tb.configure_response_memo(tb.DEFAULT_MEMO_SIZE)
+
+        phases = {}
+        requests_before = server.requests
+        http_before = tb.get_http_stats()
+        start = time.perf_counter()
+        if scenario == "content_cache":
+            all_content = tb.load_content_cache(cache_filename)
+        else:
+            all_content = build_content(refs, commentary_prefixes, args.max_concurrency, args.commentary_fetch)
+        phases['content'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        html_path = "bench.html"
+        characters = tb.content_characters(all_content, ref_range)
+        tb.write_html(tb.iter_html(all_content, ref_range, font_path, args.font_size, commentary_styles,
+                                   commentary_prefixes, text_format,
+                                   font_url=tb.font_data_url(font_path, characters)), html_path)
+        phases['html'] = time.perf_counter() - start
+        html_bytes = os.path.getsize(html_path)
+
+        if args.render:
+            start = time.perf_counter()
+            html = tb.iter_html(all_content, ref_range, font_path, args.font_size, commentary_styles,
+                                commentary_prefixes, text_format, font_url=tb.RENDER_FONT_URL)
+            pdf_bytes = tb.render_pdf(html, args.page_format, resources=tb.render_resources(font_path, characters))
+            phases['render'] = time.perf_counter() - start
+        else:
+            pdf_bytes = None
+
+        http_after = tb.get_http_stats()
+        return {
+            'phases': phases,
+            'total': sum(phases.values()),
+            'api_requests': server.requests - requests_before,
+            'http_retries': http_after['retries'] - http_before['retries'],
+            'html_bytes': html_bytes,
+            'pdf_bytes': len(pdf_bytes) if pdf_bytes is not None else None,
+        }
+
+def summarize(runs):
+    """Median and min of each timing over repeated runs."""
+    keys = list(runs[0]['phases']) + ['total']
+    values = {key: [run['phases'][key] if key in run['phases'] else run['total'] for run in runs] for key in keys}
+    return {key: {'median': statistics.median(v), 'min': min(v)} for key, v in values.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for talmud_booklet.py")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="Range sizes in dafs (sides)")
+    parser.add_argument("--scenarios", nargs="+", default=CACHE_SCENARIOS, choices=CACHE_SCENARIOS)
+    parser.add_argument("--text-formats", nargs="+", default=TEXT_FORMATS, choices=TEXT_FORMATS)
+    parser.add_argument("--commentaries", nargs="*", default=DEFAULT_COMMENTARIES)
+    parser.add_argument("--tractate", default="Berakhot")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; median and min are reported")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Mock API latency per request")
+    parser.add_argument("--latency-jitter-ms", type=float, default=10.0, help="Random extra mock latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests failing with 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-concurrency", type=int, default=tb.DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--commentary-fetch", default="bulk", choices=["bulk", "segment"])
+    parser.add_argument("--font", default=os.path.join(os.path.dirname(os.path.abspath(tb.__file__)), tb.DEFAULT_FONT))
+    parser.add_argument("--font_size", type=int, default=tb.DEFAULT_FONT_SIZE)
+    parser.add_argument("--page_format", default=tb.DEFAULT_PAGE_FORMAT)
+    parser.add_argument("--no-render", dest="render", action="store_false", help="Skip the Chromium render phase")
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    server = MockSefariaServer(SyntheticCorpus(seed=args.seed), latency_ms=args.latency_ms,
+                               latency_jitter_ms=args.latency_jitter_ms, error_rate=args.error_rate,
+                               seed=args.seed).start()
+    tb.configure_http(api_base_url=server.base_url, pool_size=args.max_concurrency,
+                      backoff_base=0.01, backoff_max=0.1)
+    results = []
+    try:
+        for size in args.sizes:
+            ref_range = range_for_size(args.tractate, size)
+            for scenario in args.scenarios:
+                for text_format in args.text_formats:
+                    runs = [run_scenario(server, ref_range, scenario, text_format, args) for _ in range(args.repeat)]
+                    result = {
+                        'scenario': scenario,
+                        'text_format': text_format,
+                        'dafs': size,
+                        'ref_range': ref_range,
+                        'timings': summarize(runs),
+                        'api_requests': sum(run['api_requests'] for run in runs),
+                        'http_retries': sum(run['http_retries'] for run in runs),
+                        'html_bytes': runs[-1]['html_bytes'],
+                        'pdf_bytes': runs[-1]['pdf_bytes'],
+                    }
+                    results.append(result)
+                    print(f"{scenario:>13} {text_format:>17} {size:>4} dafs: "
+                          f"{result['timings']['total']['median']:.3f}s", file=sys.stderr)
+    finally:
+        server.stop()
+
+    report = {
+        'config': {
+            'latency_ms': args.latency_ms,
+            'latency_jitter_ms': args.latency_jitter_ms,
+            'error_rate': args.error_rate,
+            'max_concurrency': args.max_concurrency,
+            'commentary_fetch': args.commentary_fetch,
+            'commentaries': args.commentaries,
+            'repeat': args.repeat,
+            'render': args.render,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,55 @@
 import requests
+from requests.adapters import HTTPAdapter
 from playwright.sync_api import sync_playwright
+try:
+    import pypdf  # Optional: needed only for chunked rendering (--chunk-size)
+except ImportError:
+    pypdf = None
+try:
+    import fcntl  # POSIX only; without it, concurrent builds may fetch the same ref twice
+except ImportError:
+    fcntl = None
+try:
+    import yaml  # Optional: YAML batch manifests (JSON manifests need nothing extra)
+except ImportError:
+    yaml = None
+try:
+    import zstandard  # Optional: smaller and faster cache compression than gzip
+except ImportError:
+    zstandard = None
+try:
+    from fontTools import subset as font_subset  # Optional: subset the font to the glyphs a booklet uses
+except ImportError:
+    font_subset = None
+try:
+    import brotli  # Optional: lets fontTools write font subsets as WOFF2 (plain TTF subsets otherwise)
+except ImportError:
+    brotli = None
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import asyncio
+import base64
+import contextvars
+import fnmatch
+import inspect
+import gzip
+import hashlib
+import html as html_lib
+import io
+import re
+import queue
+import random
+import sqlite3
+import statistics
+import tempfile
+import traceback
+import zlib
+import threading
 import sys
 import os
 import json
@@ -13,25 +62,119 @@ DEFAULT_FONT_SIZE = 10  # Smaller for A6
 DEFAULT_OUTPUT = "output.pdf"
 DEFAULT_COMMENTARIES = [] #["Rashi_on_Berakhot:8:#0000FF", "Tosafot_on_Berakhot:8:#008000"]
 CACHE_DIR = "data"
+DEFAULT_CACHE_DB = os.path.join(CACHE_DIR, "responses.sqlite3")  # Used with --cache-backend sqlite
 CONTENT_CACHE_DIR = "content_cache"  # Directory for all_content cache files
+CACHE_FORMAT_VERSION = 2  # Version of the compact response records in data/ (1 = full API payload as JSON)
+CACHE_CODEC = "zstd" if zstandard is not None else "gzip"  # Compression for new response records
+NEGATIVE_CACHE_SUBDIR = "_negative"  # Known-missing refs, kept apart from responses in data/
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600  # Seconds a known-missing ref is trusted before asking the API again
+INDEX_CACHE_DIR = os.path.join(CACHE_DIR, "_index")  # Tractate and commentary shapes (see TractateIndex)
+DEFAULT_INDEX_TTL = 30 * 24 * 3600  # Seconds a stored shape is trusted before it is fetched again
+PAGE_CACHE_DIR = os.path.join(CONTENT_CACHE_DIR, "pages")  # Compiled pages, one file per daf and commentary set
+FONT_CACHE_DIR = os.path.join(CONTENT_CACHE_DIR, "fonts")  # Font subsets, keyed by font and glyph set
+FONT_SUBSET_EXTENSIONS = (".woff2", ".ttf")
 DEFAULT_PAGE_FORMAT = "A6"  # A6 is half the size of A5, which is half of A4
+BAVLI_TRACTATES = [  # Sefaria titles in the order of the Bavli, for ranges that cross tractates
+    "Berakhot", "Shabbat", "Eruvin", "Pesachim", "Rosh_Hashanah", "Yoma", "Sukkah", "Beitzah", "Taanit",
+    "Megillah", "Moed_Katan", "Chagigah", "Yevamot", "Ketubot", "Nedarim", "Nazir", "Sotah", "Gittin",
+    "Kiddushin", "Bava_Kamma", "Bava_Metzia", "Bava_Batra", "Sanhedrin", "Makkot", "Shevuot", "Avodah_Zarah",
+    "Horayot", "Zevachim", "Menachot", "Chullin", "Bekhorot", "Arakhin", "Temurah", "Keritot", "Meilah",
+    "Tamid", "Niddah",
+]
+DEFAULT_API_BASE_URL = os.environ.get("SEFARIA_API_BASE_URL", "https://www.sefaria.org/api/v3/texts/")
+DEFAULT_MAX_CONCURRENCY = 8  # Maximum number of Sefaria requests in flight at once
+DEFAULT_MEMO_SIZE = 4096  # Responses kept in memory by the in-process memo; 0 disables it
+DEFAULT_MAIN_TEXT_SPAN = 10  # Max dafs of main text per ranged API call; 1 fetches each daf separately
+DEFAULT_HTTP_POOL_SIZE = DEFAULT_MAX_CONCURRENCY  # Keep-alive connections kept open to Sefaria
+DEFAULT_CONNECT_TIMEOUT = 5.0  # Seconds
+DEFAULT_READ_TIMEOUT = 30.0  # Seconds
+DEFAULT_MAX_RETRIES = 4  # Retries on 429/5xx and connection errors
+DEFAULT_BACKOFF_BASE = 0.5  # Seconds; doubled on each retry
+DEFAULT_BACKOFF_MAX = 30.0  # Seconds; upper bound for a single backoff sleep
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+DEFAULT_RENDER_WORKERS = 2  # Warm Chromium browsers kept by a RenderPool
+DEFAULT_RENDER_MAX_JOBS = 50  # Jobs per browser before it is recycled, to cap memory growth
+RENDER_ORIGIN = "http://talmud-booklet.local"  # Private origin served to the browser by request interception
+RENDER_FONT_URL = f"{RENDER_ORIGIN}/font.ttf"  # Font URL used in documents rendered to PDF
+DEFAULT_CHUNK_SIZE = 0  # Dafs per chunk for parallel rendering; 0 renders the whole document at once
+LOCK_SUBDIR = ".locks"  # Lock files for cross-process single-flight fetches, next to the response store
+LOCK_BUCKETS = 256  # Refs hash onto this many lock files, so the lock directory stays bounded
+BUILD_HISTORY_PATH = os.path.join(CACHE_DIR, "build_history.jsonl")  # Per-build request and timing summaries
+DEFAULT_HISTORY_SIZE = 50  # Builds kept in the history used by --plan estimates
+DEFAULT_PLAN_LATENCY = 0.3  # Seconds per API request assumed by --plan before any history exists
+DEFAULT_PLAN_SEGMENTS = 12  # Segments per daf assumed by --plan when neither cache nor index knows
+DEFAULT_BATCH_WORKERS = 2  # Booklet jobs run at once in batch mode
+DEFAULT_RESULTS_DIR = "results"  # Content-addressed outputs of the booklet service
+DEFAULT_SERVICE_WORKERS = 2  # Booklet jobs the service builds at once
+DEFAULT_SERVICE_QUEUE_SIZE = 16  # Jobs waiting beyond this are rejected with HTTP 429
+DEFAULT_SERVICE_JOB_HISTORY = 1000  # Finished jobs whose status the service remembers
+MAX_REF_SPANS = 10000  # Per-ref spans kept for the JSON report; older ones are dropped in long-running processes
+DEFAULT_GC_MIN_AGE = 300  # Seconds; cache gc never evicts entries written or read more recently than this
 # ---------------------
 
+def touch_cache_entry(path):
+    """Record a cache hit by setting the file's atime (mtime stays the write time).
+    Set explicitly so LRU eviction works on noatime/relatime mounts."""
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+def atomic_write(path, data):
+    """Write bytes or text to path so readers see either the old file or the complete new one:
+    write a temp file in the same directory, fsync it, then rename it over path."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+@contextmanager
+def ref_lock(lock_dir, *keys):
+    """Hold exclusive cross-process locks for cache keys (a no-op without fcntl).
+    Keys share LOCK_BUCKETS lock files, which are never deleted; buckets are always
+    taken in ascending order so holders of several keys cannot deadlock."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(lock_dir, exist_ok=True)
+    buckets = sorted({zlib.crc32(key.encode('utf-8')) % LOCK_BUCKETS for key in keys})
+    files = []
+    try:
+        start = time.perf_counter()
+        for bucket in buckets:
+            f = open(os.path.join(lock_dir, f"{bucket:03d}.lock"), 'a')
+            files.append(f)
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        METRICS.observe("cache_lock_wait", time.perf_counter() - start)
+        yield
+    finally:
+        for f in reversed(files):
+            f.close()  # Closing the descriptor releases its lock
+
 def generate_content_cache_filename(ref_range, commentary_specs, add_cover):
     """
     Generate a cache filename based on command-line options.
     Format: {ref_range}__{commentaries}__{cover}.json
     """
     # Sanitize ref_range (replace / and - with _)
-    safe_ref = ref_range.replace("/", "_").replace("-", "_to_")
+    safe_ref = ref_range.replace("/", "_").replace("-", "_to_").replace(",", "_and_")
     
     # Create a short representation of commentaries (just the names)
     comm_names = []
     for spec in commentary_specs:
         name = spec.split(':')[0]
-        # Simplify name (remove _on_Berakhot suffix if present)
-        short_name = name.replace('_on_Berakhot', '')
-        comm_names.append(short_name)
+        # Simplify name (remove the _on_{tractate} suffix if present)
+        comm_names.append(commentary_base_name(name))
     comms_str = "_".join(comm_names)
     
     # Add cover flag
@@ -46,8 +189,7 @@ def save_content_cache(all_content, cache_filename):
     cache_path = os.path.join(CONTENT_CACHE_DIR, cache_filename)
     
     try:
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            json.dump(all_content, f, ensure_ascii=False, indent=2)
+        atomic_write(cache_path, json.dumps(all_content, ensure_ascii=False, indent=2))
         logging.info(f"Saved content cache to {cache_path}")
         return True
     except Exception as e:
@@ -58,14 +200,14 @@ def load_content_cache(cache_filename):
     """Load all_content from cache file. Returns None if not found or error."""
     cache_path = os.path.join(CONTENT_CACHE_DIR, cache_filename)
     
-    if not os.path.exists(cache_path):
-        return None
-    
     try:
         with open(cache_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
+        touch_cache_entry(cache_path)
         logging.info(f"Loaded content cache from {cache_path}")
         return data
+    except FileNotFoundError:
+        return None
     except Exception as e:
         logging.warning(f"Error loading content cache: {e}")
         return None
@@ -84,6 +226,51 @@ def delete_content_cache(cache_filename):
             return False
     return False
 
+def generate_page_cache_filename(ref, commentary_prefixes):
+    """
+    Generate the cache filename for one compiled daf.
+    Format: {ref}__{commentaries}.json, with full commentary names in spec order.
+    """
+    safe_ref = ref.replace("/", "_").replace(".", "_")
+    comms_str = "_".join(commentary_prefixes)
+    return f"{safe_ref}__{comms_str}.json"
+
+def save_page_cache(ref, commentary_prefixes, talmud_page):
+    """Save one compiled page (build_talmud_page output) to the per-daf cache."""
+    os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(PAGE_CACHE_DIR, generate_page_cache_filename(ref, commentary_prefixes))
+    
+    try:
+        atomic_write(cache_path, json.dumps(talmud_page, ensure_ascii=False, indent=2))
+        return True
+    except Exception as e:
+        logging.warning(f"Error saving page cache for {ref}: {e}")
+        return False
+
+def load_page_cache(ref, commentary_prefixes):
+    """Load one compiled page from the per-daf cache. Returns None if not found or error."""
+    cache_path = os.path.join(PAGE_CACHE_DIR, generate_page_cache_filename(ref, commentary_prefixes))
+    
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            page = json.load(f)
+        touch_cache_entry(cache_path)
+        return page
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Error loading page cache for {ref}: {e}")
+        return None
+
+def commentary_base_name(name):
+    """Commentary name without its tractate, e.g. Rashi_on_Berakhot -> Rashi."""
+    return name.split("_on_")[0]
+
+def commentary_title(name, tractate):
+    """Sefaria title of a commentary on a tractate. Names are generic, so Rashi and
+    Rashi_on_Berakhot both resolve to Rashi_on_Shabbat for a daf of Shabbat."""
+    return f"{commentary_base_name(name)}_on_{tractate}"
+
 def parse_commentary_spec(spec):
     """
     Parse commentary specification in format: name[:font_size[:color]]
@@ -111,42 +298,1044 @@ def parse_commentary_spec(spec):
     
     return name, font_size, color
 
-def fetch_sefaria_text(ref):
-    # Create cache directory if it doesn't exist
-    os.makedirs(CACHE_DIR, exist_ok=True)
+# --- Instrumentation ---
+class Metrics:
+    """Process-wide timing spans and counters.
     
-    # Create a safe filename from the ref (replace / and . with _)
-    safe_filename = ref.replace("/", "_").replace(".", "_") + ".json"
-    cache_path = os.path.join(CACHE_DIR, safe_filename)
+    span() times a block and aggregates count/total/max per span name; spans with a
+    ref label (one per fetched ref) are also kept individually, up to the latest
+    MAX_REF_SPANS, so batch runs and the service do not grow without bound.
+    incr() bumps a counter. The registry is cumulative for the process, like Prometheus counters, and can be
+    exported as a JSON report or in Prometheus text exposition format."""
     
-    # Check if cached file exists
-    if os.path.exists(cache_path):
-        logging.info(f"Loading {ref} from cache")
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.spans = {}
+            self.ref_spans = deque(maxlen=MAX_REF_SPANS)
+    
+    @contextmanager
+    def span(self, name, ref=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, ref)
+    
+    def observe(self, name, seconds, ref=None):
+        with self._lock:
+            agg = self.spans.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            agg['count'] += 1
+            agg['seconds'] += seconds
+            agg['max_seconds'] = max(agg['max_seconds'], seconds)
+            if ref is not None:
+                self.ref_spans.append({'span': name, 'ref': ref, 'seconds': round(seconds, 6)})
+    
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def to_dict(self):
+        with self._lock:
+            report = {
+                'counters': dict(self.counters),
+                'spans': {name: dict(agg) for name, agg in self.spans.items()},
+                'ref_spans': list(self.ref_spans),
+            }
+        report['http'] = get_http_stats()
+        memo = get_response_memo()
+        if memo is not None:
+            report['memo'] = memo.stats()
+        return report
+    
+    def to_prometheus(self, prefix="talmud_booklet"):
+        """Render counters and span aggregates in Prometheus text exposition format.
+        Per-ref spans are left out to keep label cardinality bounded."""
+        report = self.to_dict()
+        lines = []
+        for name, value in sorted(report['counters'].items()):
+            metric = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(report['http'].items()):
+            if name.startswith('latency'):
+                continue
+            metric = f"{prefix}_http_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(report.get('memo', {}).items()):
+            if name in ('entries', 'max_entries'):
+                metric = f"{prefix}_memo_{name}"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+            else:
+                metric = f"{prefix}_memo_{name}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        if report['spans']:
+            lines.append(f"# TYPE {prefix}_span_seconds summary")
+            for name, agg in sorted(report['spans'].items()):
+                lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {agg["seconds"]:.6f}')
+                lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {agg["count"]}')
+            lines.append(f"# TYPE {prefix}_span_max_seconds gauge")
+            for name, agg in sorted(report['spans'].items()):
+                lines.append(f'{prefix}_span_max_seconds{{span="{name}"}} {agg["max_seconds"]:.6f}')
+        return "\n".join(lines) + "\n"
+    
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+    
+    def write_prometheus(self, path):
+        # Write then rename so a scraping node exporter never reads a partial file
+        atomic_write(path, self.to_prometheus())
+
+METRICS = Metrics()
+
+def count_pdf_pages(pdf_bytes):
+    """Number of pages in a PDF (pypdf when available, else a /Type /Page scan)."""
+    if pypdf is not None:
+        return len(pypdf.PdfReader(io.BytesIO(pdf_bytes)).pages)
+    return len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", pdf_bytes))
+
+# --- HTTP client ---
+_http_config = {
+    'api_base_url': DEFAULT_API_BASE_URL,
+    'pool_size': DEFAULT_HTTP_POOL_SIZE,
+    'connect_timeout': DEFAULT_CONNECT_TIMEOUT,
+    'read_timeout': DEFAULT_READ_TIMEOUT,
+    'max_retries': DEFAULT_MAX_RETRIES,
+    'backoff_base': DEFAULT_BACKOFF_BASE,
+    'backoff_max': DEFAULT_BACKOFF_MAX,
+}
+_http_session = None
+_http_lock = threading.Lock()
+
+def new_http_stats():
+    return {'requests': 0, 'retries': 0, 'failures': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+
+_http_stats = new_http_stats()
+# Counters of the build running in this context (see start_http_stats)
+_run_http_stats = contextvars.ContextVar("run_http_stats", default=None)
+
+def configure_http(pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None,
+                   backoff_base=None, backoff_max=None, api_base_url=None):
+    """Update the shared HTTP client settings. Options left as None keep their current value.
+    The pooled session is recreated on next use."""
+    global _http_session
+    updates = {
+        'api_base_url': api_base_url,
+        'pool_size': pool_size,
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+        'max_retries': max_retries,
+        'backoff_base': backoff_base,
+        'backoff_max': backoff_max,
+    }
+    with _http_lock:
+        _http_config.update({k: v for k, v in updates.items() if v is not None})
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+
+def get_http_session():
+    """Return the shared keep-alive session, creating it on first use."""
+    global _http_session
+    with _http_lock:
+        if _http_session is None:
+            session = requests.Session()
+            pool_size = _http_config['pool_size']
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delay in seconds or an HTTP date). Returns seconds or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _record_http_stat(key, value=1):
+    run_stats = _run_http_stats.get()
+    with _http_lock:
+        for stats in (_http_stats, run_stats):
+            if stats is None:
+                continue
+            if key == 'latency':
+                stats['latency_total'] += value
+                stats['latency_max'] = max(stats['latency_max'], value)
+            else:
+                stats[key] += value
+
+def http_get(url):
+    """GET url through the pooled session with timeouts and retries.
+    Retries 429/5xx responses and connection errors with exponential backoff and
+    full jitter, honoring Retry-After up to backoff_max; a response asking for a
+    longer wait is returned as failed at once, since callers may hold a ref lock
+    while sleeping. Returns the last response, or raises the last requests
+    exception if no response was ever received."""
+    session = get_http_session()
+    timeout = (_http_config['connect_timeout'], _http_config['read_timeout'])
+    max_retries = _http_config['max_retries']
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        _record_http_stat('requests')
+        try:
+            resp = session.get(url, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record_http_stat('latency', time.perf_counter() - start)
+            if attempt == max_retries:
+                _record_http_stat('failures')
+                raise
+            retry_after = None
+            reason = type(e).__name__
+        else:
+            _record_http_stat('latency', time.perf_counter() - start)
+            if resp.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                # Only count what retries could not fix; a 404 is an answer (e.g. no commentary)
+                if resp.status_code in RETRY_STATUS_CODES:
+                    _record_http_stat('failures')
+                return resp
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            reason = f"HTTP {resp.status_code}"
+            if retry_after is not None and retry_after > _http_config['backoff_max']:
+                logging.warning(f"{reason} for {url} with Retry-After {retry_after:.0f}s, "
+                                f"longer than {_http_config['backoff_max']:.0f}s; giving up")
+                _record_http_stat('failures')
+                return resp
+        
+        backoff = min(_http_config['backoff_max'], _http_config['backoff_base'] * (2 ** attempt))
+        if retry_after is not None:
+            delay = min(retry_after, _http_config['backoff_max'])
+        else:
+            delay = random.uniform(0, backoff)
+        logging.info(f"{reason} for {url}, retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+        _record_http_stat('retries')
+        time.sleep(delay)
+
+def get_http_stats():
+    """Return a copy of the process-wide HTTP counters."""
+    with _http_lock:
+        return dict(_http_stats)
+
+def start_http_stats():
+    """Count the HTTP activity of one build apart from builds running alongside it
+    (batch jobs, service workers). Requests made in this context, and in fetch
+    executors started from it (see run_http_stats_in), are added to the returned
+    dict as well as to the process-wide counters."""
+    stats = new_http_stats()
+    _run_http_stats.set(stats)
+    return stats
+
+def run_http_stats_in(stats):
+    """Thread initializer that counts a worker thread's requests in stats."""
+    _run_http_stats.set(stats)
+
+def format_http_stats(stats):
+    """Summarize the HTTP activity in a stats dict from start_http_stats()."""
+    with _http_lock:
+        stats = dict(stats)
+    count = stats['requests']
+    avg_ms = (stats['latency_total'] / count * 1000) if count else 0.0
+    return (f"{count} requests, {stats['retries']} retries, {stats['failures']} failures, "
+            f"avg latency {avg_ms:.0f} ms, max latency {stats['latency_max'] * 1000:.0f} ms")
+
+# --- API response store ---
+def response_cache_key(ref):
+    """Create a safe cache key from the ref (replace / and . with _).
+    Also used as the file name stem in data/, so both backends share keys."""
+    return ref.replace("/", "_").replace(".", "_")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+CODEC_EXTENSIONS = {"zstd": ".json.zst", "gzip": ".json.gz"}
+LEGACY_EXTENSION = ".json"
+
+def normalize_response(data):
+    """Keep only the fields the pipeline reads from an API response: title and versions[0].text."""
+    versions = data.get('versions') or []
+    normalized = {'versions': [{'text': versions[0].get('text')}] if versions else []}
+    if data.get('title') is not None:
+        normalized['title'] = data['title']
+    return normalized
+
+def encode_cache_record(data):
+    """Encode a response as a compact, versioned, compressed cache record."""
+    normalized = normalize_response(data)
+    record = {'v': CACHE_FORMAT_VERSION, 'title': normalized.get('title'),
+              'text': normalized['versions'][0]['text'] if normalized['versions'] else None,
+              'has_text': bool(normalized['versions'])}
+    raw = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if CACHE_CODEC == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    return gzip.compress(raw, compresslevel=6, mtime=0)
+
+def decode_cache_record(blob):
+    """Decode a cache record into the API response shape.
+    Returns (data, current): current is False for version-1 entries (full API payloads,
+    e.g. zlib rows from older SQLite stores) that the caller should rewrite.
+    Raises ValueError for records it cannot read, so they are treated as misses."""
+    if blob[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("zstd cache record but the zstandard module is not installed")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    elif blob[:2] == GZIP_MAGIC:
+        raw = gzip.decompress(blob)
+    else:
+        raw = zlib.decompress(blob)
+    record = json.loads(raw.decode('utf-8'))
+    if 'v' not in record:
+        return normalize_response(record), False
+    if record['v'] != CACHE_FORMAT_VERSION:
+        raise ValueError(f"unsupported cache format version {record['v']}")
+    data = {'versions': [{'text': record['text']}] if record.get('has_text', True) else []}
+    if record.get('title') is not None:
+        data['title'] = record['title']
+    return data, True
+
+def load_cache_file(path):
+    """Read a response cache file in any format (compact record or legacy pretty JSON).
+    Returns (data, current) like decode_cache_record."""
+    with open(path, 'rb') as f:
+        blob = f.read()
+    if path.endswith(LEGACY_EXTENSION):
+        return normalize_response(json.loads(blob.decode('utf-8'))), False
+    return decode_cache_record(blob)
+
+class TransientFetchError(str):
+    """Error message of a fetch that may succeed later (HTTP 429/5xx, network errors),
+    as opposed to a ref that has no text. Pages built with one are not cached."""
+
+def is_transient_error(error):
+    return isinstance(error, TransientFetchError)
+
+def is_negative_cacheable(status_code, error):
+    """Whether a failed fetch means the ref has no text (cache it as a miss) rather than
+    a transient failure (429/5xx, network errors) that should be retried next time."""
+    if status_code in (400, 404):
+        return True
+    return status_code == 200 and error is not None
+
+class FileResponseStore:
+    """Stores one compressed compact record per ref in a cache directory
+    ({key}.json.zst, or {key}.json.gz without zstandard). Legacy pretty-printed
+    {key}.json files are read and migrated to the compact format on first access.
+    Negative entries (refs known to have no text) live in a separate subdirectory."""
+    
+    def __init__(self, cache_dir=CACHE_DIR, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.cache_dir = cache_dir
+        self.negative_dir = os.path.join(cache_dir, NEGATIVE_CACHE_SUBDIR)
+        self.lock_dir = os.path.join(cache_dir, LOCK_SUBDIR)
+        self.negative_ttl = negative_ttl
+    
+    def path_for(self, ref):
+        return os.path.join(self.cache_dir, response_cache_key(ref) + CODEC_EXTENSIONS[CACHE_CODEC])
+    
+    def candidate_paths(self, ref):
+        """Paths a ref may be stored under, current format first."""
+        stem = os.path.join(self.cache_dir, response_cache_key(ref))
+        extensions = [CODEC_EXTENSIONS[CACHE_CODEC]]
+        extensions += [ext for ext in CODEC_EXTENSIONS.values() if ext not in extensions]
+        return [stem + ext for ext in extensions + [LEGACY_EXTENSION]]
+    
+    def negative_path_for(self, ref):
+        return os.path.join(self.negative_dir, response_cache_key(ref) + ".json")
+    
+    def contains(self, ref):
+        return any(os.path.exists(path) for path in self.candidate_paths(ref))
+    
+    def get_negative(self, ref):
+        """Return the recorded error if ref is a known miss within the negative TTL, else None."""
+        if not self.negative_ttl:
+            return None
+        try:
+            with open(self.negative_path_for(ref), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('cached_at', 0) > self.negative_ttl:
+            return None
+        return entry.get('error') or "Not found"
+    
+    def put_negative(self, ref, error):
+        if not self.negative_ttl:
+            return
+        os.makedirs(self.negative_dir, exist_ok=True)
+        try:
+            atomic_write(self.negative_path_for(ref),
+                         json.dumps({'ref': ref, 'error': error, 'cached_at': time.time()}, ensure_ascii=False))
+        except Exception as e:
+            logging.warning(f"Error caching miss for {ref}: {e}")
+    
+    def purge_negative(self, pattern=None, expired_only=False):
+        """Delete negative entries whose cache key matches the glob pattern (all if None).
+        With expired_only, only entries older than the negative TTL. Returns the count."""
+        if not os.path.isdir(self.negative_dir):
+            return 0
+        purged = 0
+        now = time.time()
+        for entry in os.scandir(self.negative_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            if pattern and not fnmatch.fnmatch(entry.name[:-len(".json")], pattern):
+                continue
+            if expired_only:
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        cached_at = json.load(f).get('cached_at', 0)
+                except (OSError, ValueError):
+                    cached_at = 0
+                if now - cached_at <= self.negative_ttl:
+                    continue
+            try:
+                os.remove(entry.path)
+                purged += 1
+            except FileNotFoundError:
+                pass
+        return purged
+    
+    def get(self, ref):
+        """Return the cached response for ref, or None on a miss or unreadable entry.
+        Entries in an older format are rewritten in the current one."""
+        for cache_path in self.candidate_paths(ref):
+            try:
+                data, current = load_cache_file(cache_path)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logging.warning(f"Error reading cache for {ref}: {e}, fetching from API")
+                return None
+            if not current or cache_path != self.path_for(ref):
+                self.put(ref, data)
+                try:
+                    os.remove(cache_path)
+                except OSError:
+                    pass
+            else:
+                touch_cache_entry(cache_path)
+            return data
+        return None
+    
+    def put(self, ref, data):
+        # Create cache directory if it doesn't exist
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self.path_for(ref)
         try:
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data, None
+            atomic_write(cache_path, encode_cache_record(data))
+            logging.info(f"Cached {ref} to {cache_path}")
         except Exception as e:
+            logging.warning(f"Error caching {ref}: {e}")
+
+class SqliteResponseStore:
+    """Stores all responses in one SQLite database: one row per ref, holding the same
+    compact compressed record as the files backend (older zlib rows are migrated on read).
+    
+    The database runs in WAL mode so several processes can read while one writes;
+    writers wait on the busy timeout instead of failing. Each thread gets its own
+    connection because the fetch engine calls the store from a thread pool."""
+    
+    def __init__(self, db_path=DEFAULT_CACHE_DB, busy_timeout=30.0, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.lock_dir = os.path.join(os.path.dirname(db_path) or ".", LOCK_SUBDIR)
+        self.negative_ttl = negative_ttl
+        self._local = threading.local()
+        self._connect()
+    
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " payload BLOB NOT NULL,"
+                " fetched_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS negative_responses ("
+                " key TEXT PRIMARY KEY,"
+                " error TEXT NOT NULL,"
+                " cached_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._local.conn = conn
+        return conn
+    
+    def get(self, ref):
+        """Return the cached response for ref (indexed point read), or None."""
+        try:
+            row = self._connect().execute(
+                "SELECT payload FROM responses WHERE key = ?", (response_cache_key(ref),)
+            ).fetchone()
+            if row is None:
+                return None
+            data, current = decode_cache_record(row[0])
+        except (sqlite3.Error, zlib.error, OSError, ValueError) as e:
             logging.warning(f"Error reading cache for {ref}: {e}, fetching from API")
+            return None
+        if not current:
+            self.put(ref, data)
+        return data
+    
+    def contains(self, ref):
+        try:
+            return self._connect().execute(
+                "SELECT 1 FROM responses WHERE key = ?", (response_cache_key(ref),)
+            ).fetchone() is not None
+        except sqlite3.Error:
+            return False
+    
+    def put(self, ref, data):
+        self.put_many([(response_cache_key(ref), data, time.time())])
+        logging.info(f"Cached {ref} to {self.db_path}")
+    
+    def put_many(self, entries):
+        """Insert (key, data, fetched_at) entries in one transaction."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, payload, fetched_at) VALUES (?, ?, ?)",
+                [(key, encode_cache_record(data), fetched_at) for key, data, fetched_at in entries]
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logging.warning(f"Error writing to cache database {self.db_path}: {e}")
+    
+    def get_negative(self, ref):
+        """Return the recorded error if ref is a known miss within the negative TTL, else None."""
+        if not self.negative_ttl:
+            return None
+        try:
+            row = self._connect().execute(
+                "SELECT error FROM negative_responses WHERE key = ? AND cached_at >= ?",
+                (response_cache_key(ref), time.time() - self.negative_ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Error reading negative cache for {ref}: {e}")
+            return None
+        return row[0] if row else None
+    
+    def put_negative(self, ref, error):
+        if not self.negative_ttl:
+            return
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO negative_responses (key, error, cached_at) VALUES (?, ?, ?)",
+                (response_cache_key(ref), error, time.time())
+            )
+        except sqlite3.Error as e:
+            logging.warning(f"Error caching miss for {ref}: {e}")
+    
+    def purge_negative(self, pattern=None, expired_only=False):
+        """Delete negative entries whose cache key matches the glob pattern (all if None).
+        With expired_only, only entries older than the negative TTL. Returns the count."""
+        query = "DELETE FROM negative_responses WHERE 1"
+        params = []
+        if pattern:
+            query += " AND key GLOB ?"
+            params.append(pattern)
+        if expired_only:
+            query += " AND cached_at < ?"
+            params.append(time.time() - self.negative_ttl)
+        return self._connect().execute(query, params).rowcount
+
+_response_store = FileResponseStore(CACHE_DIR)
+
+def configure_response_store(backend="files", path=None, negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """Select the backend used by fetch_sefaria_text: 'files' (one JSON per ref in
+    data/) or 'sqlite' (a single database file). negative_ttl is how long known-missing
+    refs are remembered (0 disables negative caching)."""
+    global _response_store
+    if backend == "sqlite":
+        _response_store = SqliteResponseStore(path or DEFAULT_CACHE_DB, negative_ttl=negative_ttl)
+    else:
+        _response_store = FileResponseStore(path or CACHE_DIR, negative_ttl=negative_ttl)
+    return _response_store
+
+def get_response_store():
+    return _response_store
+
+def split_cache_filename(name):
+    """Return (key, extension) for a response cache file name, or None if it is not one."""
+    for ext in list(CODEC_EXTENSIONS.values()) + [LEGACY_EXTENSION]:
+        if name.endswith(ext):
+            return name[:-len(ext)], ext
+    return None
+
+def migrate_data_dir_to_sqlite(data_dir=CACHE_DIR, db_path=DEFAULT_CACHE_DB, batch_size=500):
+    """Import every response file (compact or legacy JSON) from a data/ directory into
+    the SQLite store. Existing rows for the same ref are replaced. Returns (imported, skipped)."""
+    store = SqliteResponseStore(db_path)
+    imported = skipped = 0
+    batch = []
+    for entry in os.scandir(data_dir):
+        parts = split_cache_filename(entry.name)
+        if not entry.is_file() or parts is None:
+            continue
+        try:
+            data, _ = load_cache_file(entry.path)
+        except Exception as e:
+            logging.warning(f"Skipping {entry.path}: {e}")
+            skipped += 1
+            continue
+        batch.append((parts[0], data, entry.stat().st_mtime))
+        if len(batch) >= batch_size:
+            store.put_many(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        store.put_many(batch)
+        imported += len(batch)
+    logging.info(f"Imported {imported} responses from {data_dir} into {db_path} ({skipped} skipped)")
+    return imported, skipped
+
+def parse_byte_size(value):
+    """Parse a byte count such as '500M', '2G' or '1048576'."""
+    units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+def is_temp_cache_file(name):
+    """True for the temporary files atomic_write renames into place."""
+    return name.startswith(".") and name.endswith(".tmp")
+
+class CacheManager:
+    """Size- and age-bounded eviction for the on-disk caches (data/ and content_cache/).
+    
+    Every cache file is an entry. Its mtime is when it was written and drives the
+    per-store TTL; its atime is when it was last read (see touch_cache_entry) and
+    drives LRU eviction once the stores together exceed max_bytes.
+    
+    Eviction only unlinks files, so it is safe while builds are running: a reader
+    that already opened an entry finishes reading it, and a reader that loses the
+    race sees an ordinary cache miss. Entries written or read within min_age seconds
+    are never evicted for size, so a running build keeps what it just produced;
+    temp files older than min_age are leftovers of interrupted writes and removed.
+    The SQLite store and negative entries are not managed here (see purge-negative),
+    nor are the tractate shapes in INDEX_CACHE_DIR, which are small and not responses."""
     
-    # Fetch from API
-    url = f"https://www.sefaria.org/api/v3/texts/{ref}?return_format=text_only"
-    resp = requests.get(url)
+    def __init__(self, stores=None, max_bytes=None, min_age=DEFAULT_GC_MIN_AGE):
+        # stores: {name: (directory, ttl_seconds or None)}
+        self.stores = stores if stores is not None else {'data': (CACHE_DIR, None), 'content': (CONTENT_CACHE_DIR, None)}
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+    
+    def entries(self):
+        """Yield (store, path, size, last_access, written) for every cache file."""
+        for name, (directory, _) in self.stores.items():
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [d for d in dirs
+                           if d != NEGATIVE_CACHE_SUBDIR and os.path.join(root, d) != INDEX_CACHE_DIR]
+                for filename in files:
+                    if (split_cache_filename(filename) is None and not is_temp_cache_file(filename)
+                            and not filename.endswith(FONT_SUBSET_EXTENSIONS)):
+                        continue
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield name, path, st.st_size, max(st.st_atime, st.st_mtime), st.st_mtime
+    
+    def collect(self, dry_run=False):
+        """Delete expired entries, then least recently used ones until the stores fit
+        in max_bytes. Returns a summary dict; with dry_run nothing is deleted."""
+        now = time.time()
+        summary = {name: {'entries': 0, 'bytes': 0, 'expired': 0, 'evicted': 0, 'bytes_freed': 0}
+                   for name in self.stores}
+        live = []
+        for name, path, size, last_access, written in self.entries():
+            stats = summary[name]
+            stats['entries'] += 1
+            stats['bytes'] += size
+            ttl = self.stores[name][1]
+            if is_temp_cache_file(os.path.basename(path)):
+                ttl = self.min_age  # Left behind by a writer that crashed before renaming
+            if ttl and now - written > ttl:
+                if self._remove(path, dry_run):
+                    stats['expired'] += 1
+                    stats['bytes_freed'] += size
+                continue
+            live.append((last_access, name, path, size))
+        
+        total = sum(size for _, _, _, size in live)
+        if self.max_bytes is not None and total > self.max_bytes:
+            for last_access, name, path, size in sorted(live):
+                if total <= self.max_bytes:
+                    break
+                if now - last_access < self.min_age:
+                    continue
+                if self._remove(path, dry_run):
+                    summary[name]['evicted'] += 1
+                    summary[name]['bytes_freed'] += size
+                    total -= size
+        summary['total_bytes'] = total
+        return summary
+    
+    @staticmethod
+    def _remove(path, dry_run):
+        if dry_run:
+            return True
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False  # Already removed by a concurrent gc or --no-cache
+        except OSError as e:
+            logging.warning(f"Could not evict {path}: {e}")
+            return False
+
+def fetch_from_api(ref):
+    """Fetch ref from the Sefaria API without touching the caches.
+    Returns (data, error, missing); missing is True when the error means the
+    ref has no text, as opposed to a transient failure."""
+    url = f"{_http_config['api_base_url'].rstrip('/')}/{ref}?return_format=text_only"
+    try:
+        with METRICS.span("api_request"):
+            resp = http_get(url)
+    except requests.RequestException as e:
+        return None, f"Request failed: {e}", False
+    METRICS.incr("bytes_fetched", len(resp.content))
     if resp.status_code != 200:
-        return None, f"HTTP {resp.status_code}"
+        err = f"HTTP {resp.status_code}"
+        return None, err, is_negative_cacheable(resp.status_code, err)
     data = resp.json()
     if "error" in data:
-        return None, data["error"]
-    
-    # Save to cache
+        return None, data["error"], True
+    return data, None, False
+
+def sefaria_api_root():
+    """The /api/ prefix of the configured texts endpoint, for Sefaria's other APIs."""
+    base = _http_config['api_base_url']
+    return base[:base.index("/api/") + len("/api/")] if "/api/" in base else base.rstrip('/') + "/"
+
+def fetch_shape_from_api(title):
+    """Fetch a title's shape (lengths of its amudim) from the Sefaria shape API.
+    Returns (shape, error, missing) like fetch_from_api; shape is the API's 'chapters' list."""
+    url = f"{sefaria_api_root()}shape/{title}"
     try:
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logging.info(f"Cached {ref} to {cache_path}")
-    except Exception as e:
-        logging.warning(f"Error caching {ref}: {e}")
+        with METRICS.span("api_request"):
+            resp = http_get(url)
+    except requests.RequestException as e:
+        return None, f"Request failed: {e}", False
+    if resp.status_code != 200:
+        return None, f"HTTP {resp.status_code}", False
+    data = resp.json()
+    if isinstance(data, list):
+        data = data[0] if data else {"error": f"No shape for {title}"}
+    if "error" in data:
+        return None, data["error"], True
+    return data.get("chapters"), None, False
+
+# --- Text sources ---
+TALMUD_REF_PATTERN = re.compile(
+    r"^(?P<title>.+?)[._](?P<page>\d+)(?P<side>[ab])(?:-(?P<end_page>\d+)(?P<end_side>[ab]))?(?:\.(?P<segment>\d+))?$"
+)
+
+def amud_index(page, side):
+    """Position of an amud in a Talmud text array (1a -> 0, 1b -> 1, 2a -> 2, ...)."""
+    return (int(page) - 1) * 2 + (0 if side == "a" else 1)
+
+class TextSource:
+    """Where fetch_sefaria_text gets a ref's text on a cache miss.
+    
+    fetch(ref) returns (data, error, missing) with data in the v3 API shape
+    ({'title': ..., 'versions': [{'text': ...}]}); missing is True when the error
+    means the ref has no text. Sources with cacheable = False are read directly,
+    without the response store in front of them."""
+    name = "base"
+    cacheable = True
+    
+    def fetch(self, ref):
+        raise NotImplementedError
+    
+    def shape(self, title):
+        """Per-amud lengths of a title for the TractateIndex, as (shape, error, missing).
+        Sources that cannot tell return an error with missing = False."""
+        return None, f"{self.name} source has no shape information", False
+
+class SefariaApiSource(TextSource):
+    """The live Sefaria v3 texts API."""
+    name = "api"
+    
+    def fetch(self, ref):
+        return fetch_from_api(ref)
+    
+    def shape(self, title):
+        return fetch_shape_from_api(title)
+
+class ExportDirectorySource(TextSource):
+    """Reads a local Sefaria-Export checkout (its json/ tree of merged.json files).
+    
+    The directory is walked once to index every title's merged.json for the chosen
+    language; a title's file is parsed on first use and kept in a small LRU, after
+    which daf and commentary-segment lookups are list indexing with no I/O."""
+    name = "export"
+    cacheable = False
+    
+    def __init__(self, export_dir, language="Hebrew", max_open_titles=16):
+        self.export_dir = export_dir
+        self.language = language
+        self.max_open_titles = max_open_titles
+        self._index = None
+        self._texts = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _build_index(self):
+        index = {}
+        for dirpath, dirnames, filenames in os.walk(self.export_dir):
+            if os.path.basename(dirpath) == self.language and "merged.json" in filenames:
+                title = os.path.basename(os.path.dirname(dirpath))
+                index[title] = os.path.join(dirpath, "merged.json")
+        logging.info(f"Indexed {len(index)} titles in {self.export_dir}")
+        return index
+    
+    def _load_title(self, title):
+        with self._lock:
+            if self._index is None:
+                self._index = self._build_index()
+            if title in self._texts:
+                self._texts.move_to_end(title)
+                return self._texts[title]
+            path = self._index.get(title)
+            if path is None:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                merged = json.load(f)
+            self._texts[title] = merged
+            while len(self._texts) > self.max_open_titles:
+                self._texts.popitem(last=False)
+            return merged
+    
+    def fetch(self, ref):
+        match = TALMUD_REF_PATTERN.match(ref)
+        if not match:
+            return None, f"Unsupported ref {ref}", True
+        title = match.group('title').replace("_", " ")
+        merged = self._load_title(title)
+        if merged is None:
+            return None, f"{title} not in export", True
+        amudim = merged.get('text', [])
+        start = amud_index(match.group('page'), match.group('side'))
+        
+        def amud(position):
+            return amudim[position] if 0 <= position < len(amudim) and amudim[position] else []
+        
+        if match.group('end_page'):
+            end = amud_index(match.group('end_page'), match.group('end_side'))
+            text = [amud(position) for position in range(start, end + 1)]
+        elif match.group('segment'):
+            segments = amud(start)
+            position = int(match.group('segment')) - 1
+            text = segments[position] if 0 <= position < len(segments) else []
+            if not text:
+                return None, f"No text for {ref}", True
+        else:
+            text = amud(start)
+            if not text:
+                return None, f"No text for {ref}", True
+        return {'ref': ref, 'title': merged.get('title', title), 'versions': [{'text': text}]}, None, False
+    
+    def shape(self, title):
+        merged = self._load_title(title.replace("_", " "))
+        if merged is None:
+            return None, f"{title} not in export", True
+        return merged.get('text', []), None, False
+
+class FixtureSource(TextSource):
+    """Serves fixed payloads, for tests and offline runs: a dict of ref -> payload,
+    and/or a directory of JSON files named like data/ (e.g. Rashi_on_Berakhot_2a.json).
+    shapes optionally maps titles to per-amud shapes for the TractateIndex; titles
+    not in it are then reported as missing."""
+    name = "fixtures"
+    cacheable = False
+    
+    def __init__(self, fixtures=None, fixtures_dir=None, shapes=None):
+        self.fixtures = {response_cache_key(ref): data for ref, data in (fixtures or {}).items()}
+        self.fixtures_dir = fixtures_dir
+        self.shapes = shapes
+    
+    def shape(self, title):
+        if self.shapes is None:
+            return super().shape(title)
+        if title in self.shapes:
+            return self.shapes[title], None, False
+        return None, f"No shape fixture for {title}", True
+    
+    def fetch(self, ref):
+        key = response_cache_key(ref)
+        if key in self.fixtures:
+            return self.fixtures[key], None, False
+        if self.fixtures_dir:
+            path = os.path.join(self.fixtures_dir, key + ".json")
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f), None, False
+        return None, f"No fixture for {ref}", True
+
+_text_source = SefariaApiSource()
+
+def configure_text_source(source):
+    """Select the TextSource used by fetch_sefaria_text. Clears the response memo."""
+    global _text_source
+    _text_source = source
+    if _response_memo is not None:
+        _response_memo.clear()
+    return _text_source
+
+def get_text_source():
+    return _text_source
+
+class ResponseMemo:
+    """In-process LRU of responses in front of the response store.
+    
+    Repeated lookups of a ref in one process (overlapping ranges, several outputs,
+    library callers) skip file I/O and decoding. Concurrent lookups of a ref that is
+    not memoized yet are single-flighted: the first caller fetches and the others
+    wait for its result. Only successful responses are kept; errors are returned to
+    every waiting caller but not remembered."""
+    
+    def __init__(self, max_entries=DEFAULT_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+    
+    def get_or_fetch(self, ref, fetch):
+        """Return fetch(ref)'s (data, error), memoized by cache key."""
+        key = response_cache_key(ref)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return self._entries[key], None
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            return future.result()
+        
+        try:
+            result = fetch(ref)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if result[0] is not None:
+                self._entries[key] = result[0]
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        future.set_result(result)
+        return result
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+_response_memo = ResponseMemo()
+
+def configure_response_memo(max_entries=DEFAULT_MEMO_SIZE):
+    """Replace the in-process response memo; max_entries = 0 disables it."""
+    global _response_memo
+    _response_memo = ResponseMemo(max_entries) if max_entries > 0 else None
+    return _response_memo
+
+def get_response_memo():
+    return _response_memo
+
+def fetch_sefaria_text(ref):
+    """Return (data, error) for ref from the memo, the response store or the text source."""
+    memo = get_response_memo()
+    if memo is not None:
+        return memo.get_or_fetch(ref, _traced_fetch_sefaria_text)
+    return _traced_fetch_sefaria_text(ref)
+
+def _traced_fetch_sefaria_text(ref):
+    with METRICS.span("fetch_ref", ref=ref):
+        return _fetch_sefaria_text(ref)
+
+def _fetch_sefaria_text(ref):
+    source = get_text_source()
+    if not source.cacheable:
+        # Local sources are faster than the cache itself
+        data, err, missing = source.fetch(ref)
+        return data, err if not err or missing else TransientFetchError(err)
+    
+    # Check the response store first
+    with METRICS.span("cache_read"):
+        data = get_response_store().get(ref)
+    if data is not None:
+        METRICS.incr("response_cache_hits")
+        logging.info(f"Loading {ref} from cache")
+        return data, None
+    METRICS.incr("response_cache_misses")
+    
+    # Known-missing refs (e.g. empty commentary slots) are answered without the API
+    negative = get_response_store().get_negative(ref)
+    if negative is not None:
+        METRICS.incr("negative_cache_hits")
+        logging.debug(f"{ref} is a known miss: {negative}")
+        return None, negative
     
-    return data, None
+    # Single-flight: one process fetches the ref while others wait for its result
+    store = get_response_store()
+    with ref_lock(store.lock_dir, response_cache_key(ref)):
+        data = store.get(ref)
+        if data is not None:
+            METRICS.incr("response_fetches_coalesced")
+            return data, None
+        negative = store.get_negative(ref)
+        if negative is not None:
+            METRICS.incr("response_fetches_coalesced")
+            return None, negative
+        
+        # Fetch from the text source (the API by default)
+        data, err, missing = source.fetch(ref)
+        if err:
+            if not missing:
+                return None, TransientFetchError(err)
+            store.put_negative(ref, err)
+            return None, err
+        
+        # Save to cache
+        with METRICS.span("cache_write"):
+            store.put(ref, data)
+        
+        return data, None
 
 def parse_range(ref_range):
     # e.g. Berakhot_3a-Berakhot_5b
@@ -156,12 +1345,12 @@ def parse_range(ref_range):
     return ref_range, ref_range
 
 def parse_talmud_page(ref):
-    # e.g. Berakhot_3a -> ("Berakhot", 3, "a")
-    if "_" in ref:
-        tractate, page_side = ref.split("_")
-    else:
-        tractate, page_side = ref.split(".")
-    if page_side[-1] in ("a", "b"):
+    # e.g. Berakhot_3a -> ("Berakhot", 3, "a"), Rosh_Hashanah_2a -> ("Rosh_Hashanah", 2, "a")
+    separator = "." if "." in ref else "_"
+    if separator not in ref:
+        raise ValueError(f"Invalid Talmud page: {ref}")
+    tractate, page_side = ref.rsplit(separator, 1)
+    if page_side[-1:] in ("a", "b") and page_side[:-1].isdigit():
         page = int(page_side[:-1])
         side = page_side[-1]
     else:
@@ -174,6 +1363,8 @@ def generate_talmud_refs(start_ref, end_ref):
     tractate2, page2, side2 = parse_talmud_page(end_ref)
     if tractate1 != tractate2:
         raise ValueError("Range must be within a single tractate")
+    if amud_index(page1, side1) > amud_index(page2, side2):
+        raise ValueError(f"{start_ref} comes after {end_ref}")
     refs = []
     page = page1
     side = side1
@@ -188,6 +1379,257 @@ def generate_talmud_refs(start_ref, end_ref):
             page += 1
     return refs
 
+def amud_ref(tractate, position):
+    """Inverse of amud_index: Berakhot, 2 -> Berakhot_2a."""
+    return f"{tractate}_{position // 2 + 1}{'ab'[position % 2]}"
+
+def normalize_shape(shape):
+    """Reduce a shape to one entry per amud: a segment count for a tractate, or a list
+    of comment counts per segment for a commentary. Accepts API 'chapters' lists and
+    export text arrays alike."""
+    def count(entry):
+        if isinstance(entry, int):
+            return entry
+        if isinstance(entry, list):
+            return len(entry)
+        return 1 if entry else 0
+    
+    normalized = []
+    for amud in shape or []:
+        if isinstance(amud, list) and any(isinstance(entry, (list, int)) for entry in amud):
+            normalized.append([count(entry) for entry in amud])
+        else:
+            normalized.append(count(amud))
+    return normalized
+
+class TractateIndex:
+    """On-disk index of tractate and commentary shapes, so builds can be planned
+    without probing the API.
+    
+    A title's shape is fetched once from the text source (Sefaria's shape API by
+    default) and stored as data/_index/{title}.json, including titles known not to
+    exist. From it the index answers a tractate's first and last daf, the segment
+    count of each daf, whether a commentary exists for a tractate, and how many
+    comments it has per segment. Answers are None when the source cannot tell
+    (e.g. a transient error or an offline fixture source); callers then fall back
+    to fetching and seeing what exists."""
+    
+    def __init__(self, index_dir=INDEX_CACHE_DIR, ttl=DEFAULT_INDEX_TTL):
+        self.index_dir = index_dir
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def path_for(self, title):
+        return os.path.join(self.index_dir, response_cache_key(title) + ".json")
+    
+    def _load(self, title):
+        path = self.path_for(title)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl and time.time() - entry.get('fetched_at', 0) > self.ttl:
+            return None
+        touch_cache_entry(path)
+        return entry
+    
+    def _fetch(self, title):
+        shape, err, missing = get_text_source().shape(title)
+        if err and not missing:
+            logging.debug(f"No index information for {title}: {err}")
+            return None
+        entry = {'title': title, 'fetched_at': time.time(), 'missing': bool(err),
+                 'shape': [] if err else normalize_shape(shape)}
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            atomic_write(self.path_for(title), json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+        except OSError as e:
+            logging.warning(f"Error saving index entry for {title}: {e}")
+        return entry
+    
+    def entry(self, title):
+        """The stored entry for title ({'missing': bool, 'shape': [...]}), or None if unknown."""
+        with self._lock:
+            if title not in self._entries:
+                entry = self._load(title)
+                if entry is None:
+                    with METRICS.span("index_fetch"):
+                        entry = self._fetch(title)
+                self._entries[title] = entry
+            return self._entries[title]
+    
+    def exists(self, title):
+        """True or False if the title is known to exist or not, None if unknown."""
+        entry = self.entry(title)
+        return None if entry is None else not entry['missing']
+    
+    def bounds(self, tractate):
+        """(first_ref, last_ref) of a tractate, or None if unknown."""
+        entry = self.entry(tractate)
+        if entry is None or entry['missing']:
+            return None
+        present = [position for position, amud in enumerate(entry['shape']) if amud]
+        if not present:
+            return None
+        return amud_ref(tractate, present[0]), amud_ref(tractate, present[-1])
+    
+    def segment_count(self, ref):
+        """Number of segments in a daf of the main text, or None if unknown."""
+        tractate, page, side = parse_talmud_page(ref)
+        entry = self.entry(tractate)
+        if entry is None or entry['missing']:
+            return None
+        position = amud_index(page, side)
+        amud = entry['shape'][position] if position < len(entry['shape']) else 0
+        return amud if isinstance(amud, int) else len(amud)
+    
+    def comment_counts(self, commentary, ref):
+        """Comments per segment of a commentary title on a daf ([] if the commentary has
+        nothing there or does not exist), or None if unknown."""
+        entry = self.entry(commentary)
+        if entry is None:
+            return None
+        if entry['missing']:
+            return []
+        _, page, side = parse_talmud_page(ref)
+        position = amud_index(page, side)
+        amud = entry['shape'][position] if position < len(entry['shape']) else []
+        return amud if isinstance(amud, list) else [1] * amud
+
+_tractate_index = TractateIndex()
+
+def configure_tractate_index(index):
+    """Select the TractateIndex used to plan builds; None disables it."""
+    global _tractate_index
+    _tractate_index = index
+    return _tractate_index
+
+def get_tractate_index():
+    return _tractate_index
+
+def expand_ref_spec(spec, index=None):
+    """Expand a ref spec into the list of daf refs to build.
+    
+    A spec is one or more comma-separated parts, each a daf (Berakhot_3a), a range
+    (Berakhot_3a-Berakhot_5b), a range across tractates in Bavli order
+    (Berakhot_63b-Shabbat_3a) or a whole tractate (Berakhot). Whole tractates and
+    cross-tractate ranges need the index; when it knows a tractate, every daf is
+    checked against the tractate's first and last daf."""
+    index = index if index is not None else get_tractate_index()
+    
+    def tractate_bounds(tractate):
+        bounds = index.bounds(tractate) if index is not None else None
+        if bounds is None and index is not None and index.exists(tractate) is False:
+            raise ValueError(f"Unknown tractate: {tractate}")
+        return bounds
+    
+    def whole_tractate(tractate):
+        bounds = tractate_bounds(tractate)
+        if bounds is None:
+            raise ValueError(f"Length of {tractate} is unknown; give an explicit range such as {tractate}_2a-{tractate}_5b")
+        return generate_talmud_refs(*bounds)
+    
+    def check(ref):
+        tractate, page, side = parse_talmud_page(ref)
+        bounds = tractate_bounds(tractate)
+        if bounds is not None:
+            position = amud_index(page, side)
+            first, last = (amud_index(*parse_talmud_page(bound)[1:]) for bound in bounds)
+            if not first <= position <= last:
+                raise ValueError(f"{ref} is outside {tractate} ({bounds[0]} to {bounds[1]})")
+        return ref
+    
+    refs = []
+    for part in (p.strip() for p in spec.split(",")):
+        if not part:
+            continue
+        start, end = parse_range(part)
+        if start == end and not TALMUD_REF_PATTERN.match(start):
+            refs += whole_tractate(start)
+            continue
+        start_tractate, start_page, start_side = parse_talmud_page(check(start))
+        end_tractate, end_page, end_side = parse_talmud_page(check(end))
+        if start_tractate == end_tractate:
+            if amud_index(start_page, start_side) > amud_index(end_page, end_side):
+                raise ValueError(f"{start} comes after {end}")
+            refs += generate_talmud_refs(start, end)
+            continue
+        if start_tractate not in BAVLI_TRACTATES or end_tractate not in BAVLI_TRACTATES:
+            raise ValueError(f"Cannot order {start_tractate} and {end_tractate}; ranges across tractates need Bavli titles")
+        first, last = BAVLI_TRACTATES.index(start_tractate), BAVLI_TRACTATES.index(end_tractate)
+        if first > last:
+            raise ValueError(f"{start} comes after {end}")
+        refs += generate_talmud_refs(start, whole_tractate(start_tractate)[-1])
+        for tractate in BAVLI_TRACTATES[first + 1:last]:
+            refs += whole_tractate(tractate)
+        refs += generate_talmud_refs(whole_tractate(end_tractate)[0], end)
+    if not refs:
+        raise ValueError(f"Empty ref spec: {spec!r}")
+    return refs
+
+def next_talmud_ref(ref):
+    """The ref of the following amud, e.g. Berakhot_2a -> Berakhot_2b -> Berakhot_3a."""
+    tractate, page, side = parse_talmud_page(ref)
+    return f"{tractate}_{page}b" if side == "a" else f"{tractate}_{page + 1}a"
+
+def group_contiguous_refs(refs, max_span):
+    """Split refs into runs of consecutive amudim, each at most max_span long."""
+    runs = []
+    for ref in refs:
+        if runs and len(runs[-1]) < max_span and next_talmud_ref(runs[-1][-1]) == ref:
+            runs[-1].append(ref)
+        else:
+            runs.append([ref])
+    return runs
+
+def split_ranged_text(data, num_dafs):
+    """Split the text of a ranged main-text response (one list of segments per daf)
+    into per-daf segment lists. Returns None if the response has another shape."""
+    if not data or not data.get("versions"):
+        return None
+    text = data["versions"][0].get("text")
+    if not isinstance(text, list) or len(text) != num_dafs:
+        return None
+    per_daf = []
+    for segments in text:
+        if isinstance(segments, str):
+            segments = [segments]
+        elif not isinstance(segments, list) or not all(isinstance(seg, str) for seg in segments):
+            return None
+        per_daf.append(segments)
+    return per_daf
+
+def fetch_main_text_range(refs):
+    """Fetch the main text of consecutive daf refs with one ranged ref (e.g. Berakhot.2a-5b)
+    and cache each daf individually, in the same shape as a single-daf response, so
+    later single-daf builds hit the cache. Returns the number of dafs cached; on an
+    error or unexpected shape nothing is cached and the dafs are fetched one by one."""
+    tractate, first_page, first_side = parse_talmud_page(refs[0])
+    _, last_page, last_side = parse_talmud_page(refs[-1])
+    range_ref = f"{tractate}.{first_page}{first_side}-{last_page}{last_side}"
+    store = get_response_store()
+    with ref_lock(store.lock_dir, *(response_cache_key(ref) for ref in refs)):
+        # Another build may have fetched these dafs while we waited
+        if all(store.contains(ref) for ref in refs):
+            METRICS.incr("response_fetches_coalesced", len(refs))
+            return len(refs)
+        logging.info(f"Fetching {range_ref}")
+        METRICS.incr("ranged_requests")
+        data, err, _ = get_text_source().fetch(range_ref)
+        if err:
+            logging.warning(f"Error fetching {range_ref}: {err}, fetching dafs separately")
+            return 0
+        per_daf = split_ranged_text(data, len(refs))
+        if per_daf is None:
+            logging.warning(f"Unexpected response for {range_ref}, fetching dafs separately")
+            return 0
+        title = data.get('book') or data.get('title') or tractate
+        for ref, segments in zip(refs, per_daf):
+            store.put(ref, {'ref': ref, 'title': title, 'versions': [{'text': segments}]})
+        return len(refs)
+
 def hebrew_rtl(text):
     # No need for RTL processing with HTML/CSS - the browser handles it
     return text
@@ -232,8 +1674,38 @@ def create_dynamic_batches(segments, commentary_styles, target_batch_size=10):
     
     return batches
 
-def generate_html_optimized(all_content, title, font_path, font_size, commentary_styles, commentary_order):
-    """Generate HTML with optimized layout: batches segments with all Talmud first, then commentaries.
+def font_file_url(font_path):
+    """file:// URL of a local font, used by standalone HTML exports."""
+    return f"file://{Path(font_path).resolve()}"
+
+def generate_page_css(font_size, page_numbers=True):
+    """CSS @page rules shared by all layouts. With page_numbers=False the
+    "- n -" header is left out (chunked rendering stamps numbers after merging)."""
+    if not page_numbers:
+        return """  @page {
+    margin: 15mm 10mm;
+  }
+"""
+    return f"""  @page {{
+    margin: 15mm 10mm;
+    @top-center {{
+      content: "- " counter(page) " -";
+      font-family: 'HebrewFont', 'Noto Sans Hebrew', sans-serif;
+      font-size: {font_size - 2}pt;
+      direction: ltr;
+    }}
+  }}
+  
+  @page :first {{
+    @top-center {{
+      content: none;
+    }}
+  }}
+"""
+
+def iter_html_optimized(all_content, title, font_path, font_size, commentary_styles, commentary_order,
+                        page_numbers=True, font_url=None):
+    """Yield HTML fragments with optimized layout: batches segments with all Talmud first, then commentaries.
     
     DYNAMIC BATCHING: Estimates content size and groups 2-4 segments per batch.
     For each batch:
@@ -244,7 +1716,8 @@ def generate_html_optimized(all_content, title, font_path, font_size, commentary
     Args:
         commentary_order: List of commentary names in the order they should appear
     """
-    font_path_resolved = Path(font_path).resolve()
+    font_url = font_url or font_file_url(font_path)
+    page_css = generate_page_css(font_size, page_numbers)
     
     # Build CSS for commentary styles
     commentary_css = ""
@@ -260,30 +1733,16 @@ def generate_html_optimized(all_content, title, font_path, font_size, commentary
   }}
 """
     
-    html = f"""
+    yield f"""
 <!doctype html>
 <meta charset="utf-8">
 <style>
   @font-face {{
     font-family: 'HebrewFont';
-    src: url('file://{font_path_resolved}');
+    src: url('{font_url}');
   }}
   
-  @page {{
-    margin: 15mm 10mm;
-    @top-center {{
-      content: "- " counter(page) " -";
-      font-family: 'HebrewFont', 'Noto Sans Hebrew', sans-serif;
-      font-size: {font_size - 2}pt;
-      direction: ltr;
-    }}
-  }}
-  
-  @page :first {{
-    @top-center {{
-      content: none;
-    }}
-  }}
+{page_css}
   
   body {{
     font-family: 'HebrewFont', 'Noto Sans Hebrew', sans-serif;
@@ -366,7 +1825,7 @@ def generate_html_optimized(all_content, title, font_path, font_size, commentary
     
     # Add cover if present
     if all_content.get('cover'):
-        html += f"""
+        yield f"""
 <div class="cover">
   <h1 dir="rtl">{all_content['cover']}</h1>
 </div>
@@ -374,24 +1833,25 @@ def generate_html_optimized(all_content, title, font_path, font_size, commentary
     
     # Add all Talmud pages with DYNAMIC BATCHING
     for talmud_page in all_content['pages']:
-        html += f'<div class="page-header">{talmud_page["header"]}</div>\n'
+        yield f'<div class="page-header">{talmud_page["header"]}</div>\n'
         
         segments = talmud_page['segments']
         
         # Dynamically create batches based on estimated content size
-        batches = create_dynamic_batches(segments, commentary_styles, target_batch_size=10)
+        with METRICS.span("create_dynamic_batches"):
+            batches = create_dynamic_batches(segments, commentary_styles, target_batch_size=10)
         
         segment_counter = 1
         for batch in batches:
-            html += '<div class="content-block">\n'
+            yield '<div class="content-block">\n'
             
             # Step 1: Print ALL Talmud text segments in this batch
-            html += '  <div class="talmud-section">\n'
+            yield '  <div class="talmud-section">\n'
             batch_start_num = segment_counter
             for seg_data in batch:
-                html += f'    <div class="segment"><b>[{segment_counter}]</b> {seg_data["text"]}</div>\n'
+                yield f'    <div class="segment"><b>[{segment_counter}]</b> {seg_data["text"]}</div>\n'
                 segment_counter += 1
-            html += '  </div>\n'
+            yield '  </div>\n'
             
             # Step 2: Group commentaries by type and print all of each type
             commentary_types = {}  # {name: [(segment_num, text), ...]}
@@ -406,7 +1866,7 @@ def generate_html_optimized(all_content, title, font_path, font_size, commentary
             
             # Print commentaries grouped by type
             if commentary_types:
-                html += '  <div class="commentary-section">\n'
+                yield '  <div class="commentary-section">\n'
                 
                 # Iterate in the order specified by commentary_order
                 for comm_name in commentary_order:
@@ -415,30 +1875,31 @@ def generate_html_optimized(all_content, title, font_path, font_size, commentary
                     
                     comm_items = commentary_types[comm_name]
                     safe_name = comm_name.replace("_", "-")
-                    display_name = comm_name.replace('_on_Berakhot', '').replace('_', ' ')
+                    display_name = commentary_base_name(comm_name).replace('_', ' ')
                     
-                    html += f'    <div class="commentary-type-group commentary-{safe_name}">\n'
-                    html += f'      <div class="commentary-type-header">{display_name}:</div>\n'
+                    yield f'    <div class="commentary-type-group commentary-{safe_name}">\n'
+                    yield f'      <div class="commentary-type-header">{display_name}:</div>\n'
                     
                     for seg_num, comm_text in comm_items:
-                        html += f'      <div class="commentary-item"><b>[{seg_num}]</b> {comm_text}</div>\n'
+                        yield f'      <div class="commentary-item"><b>[{seg_num}]</b> {comm_text}</div>\n'
                     
-                    html += '    </div>\n'
+                    yield '    </div>\n'
                 
-                html += '  </div>\n'
+                yield '  </div>\n'
             
-            html += '</div>\n'  # end content-block
+            yield '</div>\n'  # end content-block
     
-    html += "</body>\n</html>"
-    return html
+    yield "</body>\n</html>"
 
-def generate_html_text_commentaries(all_content, title, font_path, font_size, commentary_styles, commentary_order):
-    """Generate HTML with traditional layout: text followed immediately by its commentaries.
+def iter_html_text_commentaries(all_content, title, font_path, font_size, commentary_styles, commentary_order,
+                                page_numbers=True, font_url=None):
+    """Yield HTML fragments with traditional layout: text followed immediately by its commentaries.
     
     TRADITIONAL LAYOUT: Each segment is followed by its commentaries inline.
     This is the original format from the committed code.
     """
-    font_path_resolved = Path(font_path).resolve()
+    font_url = font_url or font_file_url(font_path)
+    page_css = generate_page_css(font_size, page_numbers)
     
     # Build CSS for commentary styles
     commentary_css = ""
@@ -454,30 +1915,16 @@ def generate_html_text_commentaries(all_content, title, font_path, font_size, co
   }}
 """
     
-    html = f"""
+    yield f"""
 <!doctype html>
 <meta charset="utf-8">
 <style>
   @font-face {{
     font-family: 'HebrewFont';
-    src: url('file://{font_path_resolved}');
-  }}
-  
-  @page {{
-    margin: 15mm 10mm;
-    @top-center {{
-      content: "- " counter(page) " -";
-      font-family: 'HebrewFont', 'Noto Sans Hebrew', sans-serif;
-      font-size: {font_size - 2}pt;
-      direction: ltr;
-    }}
+    src: url('{font_url}');
   }}
   
-  @page :first {{
-    @top-center {{
-      content: none;
-    }}
-  }}
+{page_css}
   
   body {{
     font-family: 'HebrewFont', 'Noto Sans Hebrew', sans-serif;
@@ -535,7 +1982,7 @@ def generate_html_text_commentaries(all_content, title, font_path, font_size, co
     
     # Add cover if present
     if all_content.get('cover'):
-        html += f"""
+        yield f"""
 <div class="cover">
   <h1 dir="rtl">{all_content['cover']}</h1>
 </div>
@@ -543,28 +1990,82 @@ def generate_html_text_commentaries(all_content, title, font_path, font_size, co
     
     # Add all Talmud pages with traditional layout
     for talmud_page in all_content['pages']:
-        html += '<div class="talmud-page">\n'
-        html += f'  <div class="page-header">{talmud_page["header"]}</div>\n'
+        yield '<div class="talmud-page">\n'
+        yield f'  <div class="page-header">{talmud_page["header"]}</div>\n'
         
         for seg_data in talmud_page['segments']:
-            html += '  <div class="segment-block">\n'
-            html += f'    <div class="segment">{seg_data["text"]}</div>\n'
+            yield '  <div class="segment-block">\n'
+            yield f'    <div class="segment">{seg_data["text"]}</div>\n'
             for comm in seg_data['commentaries']:
                 safe_name = comm['name'].replace("_", "-")
-                html += f'    <div class="commentary commentary-{safe_name}">{comm["text"]}</div>\n'
-            html += '  </div>\n'
+                yield f'    <div class="commentary commentary-{safe_name}">{comm["text"]}</div>\n'
+            yield '  </div>\n'
         
-        html += '</div>\n'
+        yield '</div>\n'
     
-    html += "</body>\n</html>"
-    return html
+    yield "</body>\n</html>"
 
-def generate_html(all_content, title, font_path, font_size, commentary_styles, commentary_order, text_format='optimize'):
-    """Dispatcher function to select the appropriate HTML generation method."""
+def iter_html(all_content, title, font_path, font_size, commentary_styles, commentary_order, text_format='optimize',
+              page_numbers=True, font_url=None):
+    """Dispatcher function to select the appropriate HTML generation method.
+    Returns a generator of HTML fragments; write them out with write_html().
+    font_url defaults to a file:// URL of font_path; documents rendered to PDF use RENDER_FONT_URL,
+    and write_targets() embeds the font subset in HTML exports (font_data_url)."""
     if text_format == 'text-commentaries':
-        return generate_html_text_commentaries(all_content, title, font_path, font_size, commentary_styles, commentary_order)
+        return iter_html_text_commentaries(all_content, title, font_path, font_size, commentary_styles, commentary_order,
+                                           page_numbers, font_url)
     else:  # 'optimize' is default
-        return generate_html_optimized(all_content, title, font_path, font_size, commentary_styles, commentary_order)
+        return iter_html_optimized(all_content, title, font_path, font_size, commentary_styles, commentary_order,
+                                   page_numbers, font_url)
+
+def generate_html(all_content, title, font_path, font_size, commentary_styles, commentary_order, text_format='optimize',
+                  page_numbers=True, font_url=None):
+    """Return the whole HTML document as one string."""
+    return "".join(iter_html(all_content, title, font_path, font_size, commentary_styles, commentary_order,
+                             text_format, page_numbers, font_url))
+
+def write_html(html, path):
+    """Write an HTML document (a string or an iterable of fragments) to path, streaming fragments."""
+    with open(path, 'w', encoding='utf-8') as f:
+        if isinstance(html, str):
+            f.write(html)
+        else:
+            for fragment in html:
+                f.write(fragment)
+
+def generate_page_number_html(num_pages, font_path, font_size, font_url=None):
+    """HTML for a transparent overlay document with num_pages empty pages that carry
+    only the "- n -" page header. Used to number a PDF merged from several chunks."""
+    font_url = font_url or font_file_url(font_path)
+    page_css = generate_page_css(font_size)
+    blank_pages = '<div class="blank"></div>\n' * num_pages
+    return f"""
+<!doctype html>
+<meta charset="utf-8">
+<style>
+  @font-face {{
+    font-family: 'HebrewFont';
+    src: url('{font_url}');
+  }}
+  
+{page_css}
+  body {{
+    margin: 0;
+    padding: 0;
+  }}
+  
+  .blank {{
+    height: 1px;
+    break-after: page;
+  }}
+  
+  .blank:last-child {{
+    break-after: auto;
+  }}
+</style>
+<body>
+{blank_pages}</body>
+</html>"""
 
 def add_cover_page(content, title):
     content['cover'] = title
@@ -583,6 +2084,952 @@ def build_talmud_page(header, segments, commentaries):
         'segments': segment_data
     }
 
+async def fetch_sefaria_text_async(ref, semaphore, executor):
+    """Run fetch_sefaria_text in the executor, bounded by the shared semaphore."""
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, fetch_sefaria_text, ref)
+
+def split_bulk_commentary(data, num_segments):
+    """Split a whole-daf commentary response into per-segment lists of texts.
+    The v3 API returns nested text for a daf-level commentary ref, e.g.
+    Rashi_on_Berakhot.2a -> [[comment, ...], [comment, ...], ...] (one list per segment).
+    Returns None if the response does not have that shape."""
+    if not data or "versions" not in data or not data["versions"]:
+        return None
+    text = data["versions"][0].get("text")
+    if not isinstance(text, list):
+        return None
+    per_segment = []
+    for entry in text:
+        if isinstance(entry, str):
+            entry = [entry] if entry else []
+        elif not isinstance(entry, list) or not all(isinstance(t, str) for t in entry):
+            return None
+        per_segment.append(entry)
+    if len(per_segment) > num_segments:
+        logging.debug(f"Bulk commentary has {len(per_segment)} segments, daf has {num_segments}")
+    # Segments without any commentary may be missing from the end of the list
+    per_segment += [[] for _ in range(num_segments - len(per_segment))]
+    return per_segment[:num_segments]
+
+async def fetch_segment_commentaries_async(prefix, daf, num_segments, semaphore, executor, comment_counts=None,
+                                           failures=None):
+    """Fetch a commentary one segment at a time (prefix.daf.1, prefix.daf.2, ...).
+    Segments the index knows to have no comments (comment_counts) are not requested.
+    Refs whose fetch failed transiently are appended to failures.
+    Returns a list of comment texts per segment."""
+    comm_refs = [f"{prefix}.{daf}.{i}" for i in range(1, num_segments + 1)]
+    
+    async def fetch_segment(i, comm_ref):
+        if comment_counts is not None and i < len(comment_counts) and not comment_counts[i]:
+            METRICS.incr("index_skipped_requests")
+            return None, None
+        return await fetch_sefaria_text_async(comm_ref, semaphore, executor)
+    
+    results = await asyncio.gather(*(fetch_segment(i, comm_ref) for i, comm_ref in enumerate(comm_refs)))
+    per_segment = []
+    for comm_ref, (comm_data, comm_err) in zip(comm_refs, results):
+        comm_texts = []
+        if comm_data and comm_data.get("versions"):
+            comm_texts = comm_data["versions"][0]["text"] or []
+            if isinstance(comm_texts, str):
+                comm_texts = [comm_texts]
+        elif comm_err:
+            logging.debug(f"Missing commentary {comm_ref}: {comm_err}")
+            # Don't add placeholder - just skip missing commentaries
+            if is_transient_error(comm_err) and failures is not None:
+                failures.append(comm_ref)
+        per_segment.append(comm_texts)
+    return per_segment
+
+async def fetch_bulk_commentaries_async(prefix, daf, num_segments, semaphore, executor, comment_counts=None,
+                                        failures=None):
+    """Fetch a whole commentary for a daf with one ranged ref (e.g. Rashi_on_Berakhot.2a).
+    Skipped when the index knows the daf has no comments (comment_counts).
+    Falls back to the per-segment path when the response shape is unexpected.
+    The ref is appended to failures if its fetch failed transiently."""
+    if comment_counts is not None and not any(comment_counts):
+        METRICS.incr("index_skipped_requests")
+        return [[] for _ in range(num_segments)]
+    comm_ref = f"{prefix}.{daf}"
+    comm_data, comm_err = await fetch_sefaria_text_async(comm_ref, semaphore, executor)
+    if comm_err:
+        logging.debug(f"Missing commentary {comm_ref}: {comm_err}")
+        if is_transient_error(comm_err) and failures is not None:
+            failures.append(comm_ref)
+        return [[] for _ in range(num_segments)]
+    per_segment = split_bulk_commentary(comm_data, num_segments)
+    if per_segment is None:
+        logging.warning(f"Unexpected bulk response for {comm_ref}, fetching per segment")
+        return await fetch_segment_commentaries_async(prefix, daf, num_segments, semaphore, executor, comment_counts,
+                                                      failures)
+    return per_segment
+
+async def fetch_talmud_page_async(ref, commentary_prefixes, semaphore, executor, commentary_fetch="bulk"):
+    """Fetch one daf, then all of its commentaries concurrently.
+    commentary_fetch selects one request per commentary per daf ('bulk')
+    or one request per (segment, commentary) pair ('segment').
+    Returns the page structure produced by build_talmud_page, marked 'incomplete'
+    if any of its fetches failed transiently, so it is fetched again next time."""
+    logging.info(f"Fetching {ref}")
+    data, err = await fetch_sefaria_text_async(ref, semaphore, executor)
+    tractate, daf = ref.rsplit('_', 1)
+    index = get_tractate_index()
+    failures = [ref] if is_transient_error(err) else []
+    if not err and not (data.get("versions") and data["versions"][0].get("text")):
+        # An empty daf (e.g. [] in a ranged response, or no versions) is treated as missing text
+        err = "empty text"
+    if err:
+        logging.warning(f"Error fetching {ref}: {err}")
+        # Insert placeholder for missing page
+        segments = [missing_text_placeholder(ref)]
+        all_commentaries = [[]]
+    else:
+        segments = data["versions"][0]["text"]
+        if isinstance(segments, str):
+            segments = [segments]
+        fetch_commentary = (fetch_bulk_commentaries_async if commentary_fetch == "bulk"
+                            else fetch_segment_commentaries_async)
+        # Schedule every commentary for this daf at once; gather keeps the order.
+        # Commentary names are generic: Rashi_on_Berakhot fetches Rashi_on_{tractate}.
+        comm_titles = [commentary_title(prefix, tractate) for prefix in commentary_prefixes]
+        by_prefix = await asyncio.gather(*(
+            fetch_commentary(title, daf, len(segments), semaphore, executor,
+                             index.comment_counts(title, ref) if index is not None else None, failures)
+            for title in comm_titles
+        ))
+        # Store as tuples: (text, commentary_name), commentaries in spec order per segment
+        all_commentaries = [
+            [(text, prefix) for prefix, per_segment in zip(commentary_prefixes, by_prefix)
+             for text in per_segment[i]]
+            for i in range(len(segments))
+        ]
+    
+    # Create header for this Talmud page (all segments from this daf)
+    header = f"{(data or {}).get('title', ref)} {daf}"
+    
+    # Build the page with all its segments
+    talmud_page = build_talmud_page(header, segments, all_commentaries)
+    if failures:
+        logging.warning(f"{ref} is incomplete ({len(failures)} failed fetches); it will not be cached")
+        talmud_page['incomplete'] = True
+    return talmud_page
+
+async def prefetch_main_text_async(refs, main_text_span, semaphore, executor):
+    """Fetch uncached main text for refs in as few ranged calls as possible."""
+    store = get_response_store()
+    uncached = [ref for ref in refs if not store.contains(ref)]
+    runs = [run for run in group_contiguous_refs(uncached, main_text_span) if len(run) > 1]
+    
+    async def fetch_run(run):
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fetch_main_text_range, run)
+    
+    await asyncio.gather(*(fetch_run(run) for run in runs))
+
+async def fetch_all_pages_async(refs, commentary_prefixes, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                                commentary_fetch="bulk", main_text_span=DEFAULT_MAIN_TEXT_SPAN):
+    """Fetch all dafs in refs concurrently. Pages are returned in the order of refs.
+    With main_text_span > 1, uncached main text is first fetched with ranged refs."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with ThreadPoolExecutor(max_workers=max_concurrency, initializer=run_http_stats_in,
+                            initargs=(_run_http_stats.get(),)) as executor:
+        index = get_tractate_index()
+        if index is not None and commentary_prefixes:
+            # Load commentary shapes up front, off the event loop
+            titles = {commentary_title(prefix, ref.rsplit('_', 1)[0]) for ref in refs for prefix in commentary_prefixes}
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(executor, index.entry, title) for title in titles))
+        if main_text_span > 1 and get_text_source().cacheable:
+            await prefetch_main_text_async(refs, main_text_span, semaphore, executor)
+        return await asyncio.gather(*(
+            fetch_talmud_page_async(ref, commentary_prefixes, semaphore, executor, commentary_fetch)
+            for ref in refs
+        ))
+
+def fetch_all_pages(refs, commentary_prefixes, max_concurrency=DEFAULT_MAX_CONCURRENCY, commentary_fetch="bulk",
+                    main_text_span=DEFAULT_MAIN_TEXT_SPAN):
+    """Synchronous entry point for the asyncio fetch engine."""
+    return list(asyncio.run(fetch_all_pages_async(
+        refs, commentary_prefixes, max(1, max_concurrency), commentary_fetch, main_text_span
+    )))
+
+# --- PDF rendering ---
+def pdf_options(page_format):
+    """Options passed to page.pdf() for every render."""
+    return {
+        'format': page_format,
+        'print_background': True,
+        'margin': {"top": "0mm", "bottom": "0mm", "left": "0mm", "right": "0mm"},
+    }
+
+class RenderPool:
+    """Long-lived pool of warm Chromium browsers that turn HTML into PDF bytes.
+    
+    Each worker thread owns its own Playwright instance, browser and context (the sync
+    API is bound to the thread that started it). Jobs are taken from a shared queue and
+    answered through concurrent.futures.Future objects. Before every job the worker
+    checks that its browser is still connected, and it relaunches the browser after
+    max_jobs renders to cap Chromium memory growth. A job that fails because the
+    browser died is retried once on a fresh browser. Once every worker has stopped
+    (e.g. Chromium cannot be launched), queued and new jobs fail instead of waiting.
+    
+        with RenderPool(workers=4) as pool:
+            pdf_bytes = pool.render(html, "A6")
+    """
+    
+    def __init__(self, workers=DEFAULT_RENDER_WORKERS, max_jobs=DEFAULT_RENDER_MAX_JOBS, launch_options=None):
+        self.workers = max(1, workers)
+        self.max_jobs = max(1, max_jobs)
+        self.launch_options = launch_options or {}
+        self._jobs = queue.Queue()
+        self._status = [{'alive': False, 'connected': False, 'jobs': 0, 'total_jobs': 0, 'recycles': 0}
+                        for _ in range(self.workers)]
+        self._status_lock = threading.Lock()
+        self._live_workers = self.workers
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, args=(i,), name=f"render-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, html, page_format=DEFAULT_PAGE_FORMAT, resources=None):
+        """Queue an HTML document (a string or an iterable of fragments) for rendering.
+        resources maps URL paths under RENDER_ORIGIN to (bytes, content_type), e.g. the
+        font from render_resources(). Returns a Future resolving to PDF bytes."""
+        if self._closed:
+            raise RuntimeError("RenderPool is closed")
+        future = Future()
+        with self._status_lock:
+            # Checked under the lock, so a job is never queued after the last worker drained the queue
+            if not self._live_workers:
+                raise RuntimeError("No render workers available")
+            self._jobs.put((future, html, page_format, resources or {}))
+        return future
+    
+    def render(self, html, page_format=DEFAULT_PAGE_FORMAT, resources=None, timeout=None):
+        """Render an HTML document and wait for the PDF bytes."""
+        return self.submit(html, page_format, resources).result(timeout)
+    
+    def health(self):
+        """Per-worker status: thread alive, browser connected, jobs since last recycle, totals."""
+        with self._status_lock:
+            status = [dict(s) for s in self._status]
+        for s, thread in zip(status, self._threads):
+            s['alive'] = s['alive'] and thread.is_alive()
+        return status
+    
+    def is_healthy(self):
+        return all(s['alive'] and s['connected'] for s in self.health())
+    
+    def close(self):
+        """Stop all workers after the queued jobs are done and close their browsers."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def _update_status(self, index, **values):
+        with self._status_lock:
+            self._status[index].update(values)
+    
+    def _render_job(self, context, document, page_format, resources):
+        # Serve the document and its resources from memory through a private origin,
+        # so concurrent jobs never share a file and nothing is written to disk
+        def handle(route):
+            path = urlsplit(route.request.url).path
+            if path == "/document.html":
+                route.fulfill(status=200, content_type="text/html; charset=utf-8", body=document)
+            elif path in resources:
+                body, content_type = resources[path]
+                route.fulfill(status=200, content_type=content_type, body=body)
+            else:
+                route.fulfill(status=404, body="")
+        
+        page = context.new_page()
+        try:
+            page.route(f"{RENDER_ORIGIN}/**", handle)
+            with METRICS.span("page_load"):
+                page.goto(f"{RENDER_ORIGIN}/document.html")
+            with METRICS.span("page_pdf"):
+                return page.pdf(**pdf_options(page_format))
+        finally:
+            page.close()
+    
+    def _worker(self, index):
+        status = self._status[index]
+        try:
+            with sync_playwright() as p:
+                browser = context = None
+                
+                def launch():
+                    nonlocal browser, context
+                    if browser is not None:
+                        try:
+                            browser.close()
+                        except Exception:
+                            pass
+                        self._update_status(index, recycles=status['recycles'] + 1)
+                    with METRICS.span("browser_launch"):
+                        browser = p.chromium.launch(**self.launch_options)
+                        context = browser.new_context()
+                    self._update_status(index, connected=True, jobs=0)
+                
+                launch()
+                self._update_status(index, alive=True)
+                while True:
+                    job = self._jobs.get()
+                    if job is None:
+                        break
+                    future, html, page_format, resources = job
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        # Join fragments once, so a retry renders the same document
+                        with METRICS.span("html_generation"):
+                            document = html if isinstance(html, str) else "".join(html)
+                        if not browser.is_connected() or status['jobs'] >= self.max_jobs:
+                            launch()
+                        try:
+                            pdf_bytes = self._render_job(context, document, page_format, resources)
+                        except Exception:
+                            if browser.is_connected():
+                                raise
+                            logging.warning(f"Render worker {index}: browser disconnected, retrying job")
+                            launch()
+                            pdf_bytes = self._render_job(context, document, page_format, resources)
+                        self._update_status(index, jobs=status['jobs'] + 1, total_jobs=status['total_jobs'] + 1)
+                        future.set_result(pdf_bytes)
+                    except Exception as e:
+                        self._update_status(index, connected=browser.is_connected())
+                        future.set_exception(e)
+                browser.close()
+        except Exception as e:
+            logging.error(f"Render worker {index} stopped: {e}")
+        finally:
+            with self._status_lock:
+                status.update(alive=False, connected=False)
+                self._live_workers -= 1
+                last_worker = not self._live_workers
+            # Fail queued jobs if this was the last live worker
+            if last_worker:
+                while True:
+                    try:
+                        job = self._jobs.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is not None and job[0].set_running_or_notify_cancel():
+                        job[0].set_exception(RuntimeError("No render workers available"))
+
+_font_cache = {}
+_font_cache_lock = threading.Lock()
+
+def read_font(font_path):
+    """Font file bytes, read once per (path, mtime) and kept in memory.
+    None if the file does not exist (see warn_missing_font)."""
+    path = str(Path(font_path).resolve())
+    try:
+        key = (path, os.path.getmtime(path))
+        with _font_cache_lock:
+            if key not in _font_cache:
+                _font_cache[key] = Path(path).read_bytes()
+            return _font_cache[key]
+    except FileNotFoundError:
+        warn_missing_font(path)
+        return None
+
+def render_resources(font_path, text=None):
+    """Resources served to the browser for a render: the font at RENDER_FONT_URL.
+    With text, the font is subset to the characters of text (see font_subset_bytes).
+    A missing font is not served, so the browser falls back to another font."""
+    if text is None:
+        font_data, content_type = read_font(font_path), "font/ttf"
+    else:
+        font_data, content_type = font_subset_bytes(font_path, text)
+    if font_data is None:
+        return {}
+    return {urlsplit(RENDER_FONT_URL).path: (font_data, content_type)}
+
+_missing_fonts = set()
+
+def warn_missing_font(path):
+    """Log once per path that a font file does not exist."""
+    with _font_cache_lock:
+        if path in _missing_fonts:
+            return
+        _missing_fonts.add(path)
+    logging.warning(f"Font file not found: {path}; documents will fall back to another font")
+
+_font_digests = {}
+
+def font_digest(font_path):
+    """SHA-256 of a font file, computed once per (path, mtime).
+    None if the file does not exist, so a missing font is still a known input."""
+    path = str(Path(font_path).resolve())
+    try:
+        key = (path, os.path.getmtime(path))
+        with _font_cache_lock:
+            if key not in _font_digests:
+                _font_digests[key] = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+            return _font_digests[key]
+    except FileNotFoundError:
+        warn_missing_font(path)
+        return None
+
+FONT_BASE_CHARACTERS = "".join(chr(c) for c in range(0x20, 0x7f)) + "\u00a0"  # Headers, page numbers, spacing
+
+def content_characters(all_content, title=""):
+    """Every character a document for all_content can display: the text of the cover,
+    headers, segments and commentaries with HTML entities resolved, the title, and
+    printable ASCII for headers and page numbers. Returned as a sorted string."""
+    characters = set(FONT_BASE_CHARACTERS) | set(title)
+    texts = [all_content.get('cover') or ""]
+    for talmud_page in all_content['pages']:
+        texts.append(talmud_page['header'])
+        for segment in talmud_page['segments']:
+            texts.append(segment['text'])
+            texts.extend(commentary['text'] for commentary in segment['commentaries'])
+    for text in texts:
+        characters.update(html_lib.unescape(text))
+    return "".join(sorted(characters))
+
+def font_delivery():
+    """How fonts reach documents in this environment: 'woff2-subset', 'ttf-subset' or 'ttf'."""
+    if font_subset is None:
+        return "ttf"
+    return "woff2-subset" if brotli is not None else "ttf-subset"
+
+def font_subset_bytes(font_path, text):
+    """(font bytes, content type) covering the characters of text.
+    
+    The font is subset with fontTools to the glyphs those characters need (keeping
+    all layout features, so niqqud and cantillation marks still position correctly)
+    and saved as WOFF2 when brotli is installed. Subsets are cached in FONT_CACHE_DIR
+    under a hash of the font and the glyph set, so a range is subset once. Without
+    fontTools, or if subsetting fails, the whole font is returned. The bytes are None
+    if the font file does not exist."""
+    delivery = font_delivery()
+    if delivery == "ttf":
+        return read_font(font_path), "font/ttf"
+    flavor, content_type = ("woff2", "font/woff2") if delivery == "woff2-subset" else (None, "font/ttf")
+    digest = font_digest(font_path)
+    if digest is None:
+        return None, content_type
+    characters = "".join(sorted(set(text)))
+    glyph_set = hashlib.sha256(f"{digest}:{delivery}:{characters}".encode('utf-8')).hexdigest()
+    path = os.path.join(FONT_CACHE_DIR, f"{glyph_set}.{flavor or 'ttf'}")
+    try:
+        data = Path(path).read_bytes()
+        touch_cache_entry(path)
+        METRICS.incr("font_subset_hits")
+        return data, content_type
+    except FileNotFoundError:
+        pass
+    try:
+        with METRICS.span("font_subset"):
+            options = font_subset.Options()
+            options.flavor = flavor
+            options.layout_features = ["*"]
+            # From the bytes read_font keeps, so a font fontTools cannot parse leaves no open file
+            font = font_subset.load_font(io.BytesIO(read_font(font_path)), options)
+            subsetter = font_subset.Subsetter(options)
+            subsetter.populate(text=characters)
+            subsetter.subset(font)
+            buffer = io.BytesIO()
+            font_subset.save_font(font, buffer, options)
+            data = buffer.getvalue()
+    except Exception as e:
+        logging.warning(f"Font subsetting failed, using the whole font: {e}")
+        return read_font(font_path), "font/ttf"
+    os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+    atomic_write(path, data)
+    METRICS.incr("font_subsets_built")
+    logging.info(f"Subset font to {len(characters)} characters: {len(data) / 1024:.1f} KB ({flavor or 'ttf'})")
+    return data, content_type
+
+def quiet_font_tools_logging():
+    """Keep fontTools, which logs every subsetting step at INFO, out of the build log.
+    Called once by the command-line entry point; library users configure logging themselves."""
+    logging.getLogger("fontTools").setLevel(logging.WARNING)
+
+def font_data_url(font_path, text):
+    """data: URL of the font subset for text, so HTML exports carry their own font.
+    None if the font file does not exist."""
+    data, content_type = font_subset_bytes(font_path, text)
+    if data is None:
+        return None
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+def render_pdf(html, page_format=DEFAULT_PAGE_FORMAT, pool=None, resources=None):
+    """Library entry point: render an HTML document to PDF bytes.
+    Uses the given RenderPool, or a single short-lived browser when pool is None."""
+    if pool is not None:
+        return pool.render(html, page_format, resources)
+    with RenderPool(workers=1) as oneshot_pool:
+        return oneshot_pool.render(html, page_format, resources)
+
+def find_header_pages(reader, headers):
+    """Return the 0-based page index in reader where each header first appears,
+    searching forward in document order. Headers that cannot be found map to the
+    page of the previous header (or 0)."""
+    page_texts = [page.extract_text() or "" for page in reader.pages]
+    positions = []
+    current = 0
+    for header in headers:
+        for index in range(current, len(page_texts)):
+            if header in page_texts[index]:
+                current = index
+                break
+        positions.append(current)
+    return positions
+
+def render_chunked_pdf(all_content, title, font_path, font_size, commentary_styles, commentary_order,
+                       text_format, page_format, chunk_size, pool=None, workers=DEFAULT_RENDER_WORKERS,
+                       resources=None):
+    """Render all_content in chunks of chunk_size dafs in parallel and merge the pieces.
+    
+    Each chunk is rendered without page headers on its own browser from the pool. The
+    merged PDF is then numbered continuously by overlaying a rendered page-number
+    document (same @page rules as a single-shot render), and gets one outline entry
+    per daf. resources default to the font subset for all_content. Requires pypdf.
+    Returns the PDF bytes."""
+    if pypdf is None:
+        raise RuntimeError("Chunked rendering requires pypdf (pip install pypdf)")
+    
+    pages = all_content['pages']
+    chunks = [pages[i:i + chunk_size] for i in range(0, len(pages), chunk_size)]
+    htmls = []
+    for index, chunk_pages in enumerate(chunks):
+        chunk_content = {'cover': all_content.get('cover') if index == 0 else None, 'pages': chunk_pages}
+        # Fragments are generated lazily by the worker that renders the chunk
+        htmls.append(iter_html(chunk_content, title, font_path, font_size, commentary_styles, commentary_order,
+                               text_format, page_numbers=False, font_url=RENDER_FONT_URL))
+    logging.info(f"Rendering {len(pages)} dafs in {len(chunks)} chunks of up to {chunk_size}")
+    
+    resources = resources or render_resources(font_path, content_characters(all_content, title))
+    own_pool = pool is None
+    if own_pool:
+        pool = RenderPool(workers=min(workers, len(chunks)))
+    try:
+        futures = [pool.submit(html, page_format, resources) for html in htmls]
+        writer = pypdf.PdfWriter()
+        outline = []
+        for chunk_pages, future in zip(chunks, futures):
+            reader = pypdf.PdfReader(io.BytesIO(future.result()))
+            offset = len(writer.pages)
+            headers = [talmud_page['header'] for talmud_page in chunk_pages]
+            for header, position in zip(headers, find_header_pages(reader, headers)):
+                outline.append((header, offset + position))
+            for page in reader.pages:
+                writer.add_page(page)
+        
+        # Stamp continuous page numbers from a single overlay document
+        numbers_html = generate_page_number_html(len(writer.pages), font_path, font_size, RENDER_FONT_URL)
+        numbers = pypdf.PdfReader(io.BytesIO(pool.render(numbers_html, page_format, resources)))
+        for page, number_page in zip(writer.pages, numbers.pages):
+            page.merge_page(number_page)
+    finally:
+        if own_pool:
+            pool.close()
+    
+    for header, page_index in outline:
+        writer.add_outline_item(header, page_index)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+TARGET_FORMATS = ("pdf", "html", "html-for-epub")
+TEXT_FORMATS = ("optimize", "text-commentaries")
+
+def parse_target_spec(spec, defaults):
+    """Parse an output target such as 'format=pdf,page_format=A5,output=a5.pdf'.
+    Keys are format, page_format, font_size, text_format and output; keys left out
+    are taken from defaults. Returns a target dict."""
+    target = dict(defaults)
+    for item in spec.split(","):
+        key, sep, value = item.partition("=")
+        key = key.strip()
+        if not sep or key not in ('format', 'page_format', 'font_size', 'text_format', 'output'):
+            raise ValueError(f"Invalid target item '{item}' in '{spec}'")
+        target[key] = int(value) if key == 'font_size' else value.strip()
+    if target['format'] not in TARGET_FORMATS:
+        raise ValueError(f"Invalid target format: {target['format']}")
+    if target['text_format'] not in TEXT_FORMATS:
+        raise ValueError(f"Invalid target text_format: {target['text_format']}")
+    return target
+
+def commentary_styles_for(commentary_specs, font_size):
+    """(commentary_styles, commentary_prefixes) for commentary specs; commentaries
+    without an explicit size are set 2pt smaller than font_size."""
+    commentary_styles = {}
+    commentary_prefixes = []
+    for spec in commentary_specs:
+        name, comm_font_size, color = parse_commentary_spec(spec)
+        commentary_prefixes.append(name)
+        commentary_styles[name] = {
+            'font_size': comm_font_size if comm_font_size else font_size - 2,
+            'color': color if color else '#000000'
+        }
+    return commentary_styles, commentary_prefixes
+
+def write_targets(all_content, title, commentary_specs, font_path, targets, chunk_size=DEFAULT_CHUNK_SIZE,
+                  render_pool=None, render_workers=DEFAULT_RENDER_WORKERS):
+    """Write every output target (format, page_format, font_size, text_format, output) from one all_content.
+    
+    Targets that need the same document (same text_format and font_size, and both HTML
+    exports or both PDF renders, since page_format does not change the HTML) share one
+    generated HTML variant. PDF targets are rendered concurrently in one RenderPool: the
+    given one, or one started for this call with up to render_workers browsers. Chunked
+    targets use the same pool. HTML exports are written while the PDFs render."""
+    num_pages = len(all_content['pages'])
+    chunked = [t for t in targets if t['format'] == "pdf" and chunk_size and num_pages > chunk_size]
+    variants = {}
+    for target in targets:
+        if target not in chunked:
+            key = (target['text_format'], target['font_size'], target['format'] == "pdf")
+            variants.setdefault(key, []).append(target)
+    
+    render_jobs = sum(1 for t in targets if t['format'] == "pdf" and t not in chunked)
+    render_jobs += len(chunked) * -(-num_pages // chunk_size) if chunked else 0
+    own_pool = render_pool is None and render_jobs > 0
+    pool = RenderPool(workers=min(render_workers, render_jobs)) if own_pool else render_pool
+    # Every target uses the same font subset: the glyphs of all_content
+    characters = content_characters(all_content, title)
+    resources = render_resources(font_path, characters) if render_jobs else None
+    exports = any(not for_pdf for _, _, for_pdf in variants)
+    embedded_font_url = font_data_url(font_path, characters) if exports else None
+    try:
+        futures = []
+        for (text_format, font_size, for_pdf), group in variants.items():
+            # HTML exports embed the font; PDF renders get it from the in-memory render origin
+            commentary_styles, commentary_prefixes = commentary_styles_for(commentary_specs, font_size)
+            html_content = iter_html(all_content, title, font_path, font_size, commentary_styles, commentary_prefixes,
+                                     text_format, font_url=RENDER_FONT_URL if for_pdf else embedded_font_url)
+            if len(group) > 1:
+                # A shared variant is generated once; a single use streams lazily
+                with METRICS.span("html_generation"):
+                    html_content = "".join(html_content)
+            for target in group:
+                output_file = target['output']
+                if for_pdf:
+                    logging.info(f"Generating PDF with Playwright: {output_file}")
+                    futures.append((output_file, pool.submit(html_content, target['page_format'], resources)))
+                    continue
+                if target['format'] == "html-for-epub":
+                    # Note: Full EPUB support would require additional libraries like ebooklib
+                    logging.info("HTML file will be saved for EPUB conversion.")
+                    logging.info("Use a tool like Calibre or pandoc to convert HTML to EPUB:")
+                    logging.info(f"  pandoc {output_file} -o {output_file.replace('.html', '.epub')}")
+                with METRICS.span("html_generation"):
+                    write_html(html_content, output_file)
+                logging.info(f"HTML file generated successfully: {output_file}")
+        
+        for target in chunked:
+            # Render chunks in parallel and stitch them into one PDF
+            logging.info(f"Generating chunked PDF with Playwright: {target['output']}")
+            commentary_styles, commentary_prefixes = commentary_styles_for(commentary_specs, target['font_size'])
+            pdf_bytes = render_chunked_pdf(
+                all_content, title, font_path, target['font_size'], commentary_styles, commentary_prefixes,
+                target['text_format'], target['page_format'], chunk_size, pool=pool, workers=render_workers,
+                resources=resources
+            )
+            Path(target['output']).write_bytes(pdf_bytes)
+            METRICS.incr("output_pages", count_pdf_pages(pdf_bytes))
+            logging.info(f"PDF generated successfully: {target['output']}")
+        
+        for output_file, future in futures:
+            pdf_bytes = future.result()
+            Path(output_file).write_bytes(pdf_bytes)
+            METRICS.incr("output_pages", count_pdf_pages(pdf_bytes))
+            logging.info(f"PDF generated successfully: {output_file}")
+    finally:
+        if own_pool:
+            pool.close()
+
+_code_version = None
+
+def code_version():
+    """SHA-256 of this module's source, so outputs are rebuilt when the generator changes."""
+    global _code_version
+    if _code_version is None:
+        _code_version = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+    return _code_version
+
+def file_signature(path):
+    """[size, mtime_ns] of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def content_digest(all_content):
+    """SHA-256 of all_content, independent of key order."""
+    return hashlib.sha256(json.dumps(all_content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def output_manifest_path(output_file):
+    return f"{output_file}.manifest.json"
+
+def target_inputs(target, title, commentary_specs, font_path, chunk_size, content):
+    """Everything that determines one target's output file: the content digest, the
+    font, the options that reach the HTML and CSS, and the generator version."""
+    commentary_styles, commentary_prefixes = commentary_styles_for(commentary_specs, target['font_size'])
+    inputs = {
+        'version': code_version(),
+        'content': content,
+        'title': title,
+        'font': font_digest(font_path),
+        'commentaries': [[name, commentary_styles[name]] for name in commentary_prefixes],
+        'format': target['format'],
+        'page_format': target['page_format'],
+        'font_size': target['font_size'],
+        'text_format': target['text_format'],
+    }
+    if target['format'] == "pdf":
+        inputs['chunk_size'] = chunk_size
+    # Whether the font is subset and in which format depends on the installed packages
+    inputs['font_delivery'] = font_delivery()
+    return inputs
+
+def inputs_fingerprint(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def load_output_manifest(output_file):
+    try:
+        with open(output_manifest_path(output_file), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def output_is_current(target, fingerprint, manifest=None):
+    """True if the target's output exists, unchanged in size since its manifest
+    recorded it, and the manifest's fingerprint matches."""
+    manifest = manifest or load_output_manifest(target['output'])
+    if not manifest or manifest.get('fingerprint') != fingerprint:
+        return False
+    return (file_signature(target['output']) or [None])[0] == manifest.get('output_bytes')
+
+def outputs_current_for_content_cache(targets, title, commentary_specs, font_path, chunk_size, signature):
+    """Check targets without reading the content cache: true if every target's manifest
+    was written from a content cache file of this signature and is still current."""
+    if signature is None:
+        return False
+    for target in targets:
+        manifest = load_output_manifest(target['output'])
+        if not manifest or manifest.get('content_cache') != signature:
+            return False
+        inputs = target_inputs(target, title, commentary_specs, font_path, chunk_size,
+                               manifest.get('inputs', {}).get('content'))
+        if not output_is_current(target, inputs_fingerprint(inputs), manifest):
+            return False
+    return True
+
+def write_output_manifest(target, inputs, content_cache=None):
+    """Record what a target was built from next to its output file."""
+    manifest = {
+        'fingerprint': inputs_fingerprint(inputs),
+        'inputs': inputs,
+        'content_cache': content_cache,
+        'output_bytes': (file_signature(target['output']) or [None])[0],
+        'built_at': time.time(),
+    }
+    atomic_write(output_manifest_path(target['output']), json.dumps(manifest, ensure_ascii=False, indent=2))
+
+def missing_text_placeholder(ref):
+    return f"[Missing text for {ref}]"
+
+def assemble_pages(refs, commentary_prefixes, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                   commentary_fetch="bulk", use_page_cache=True, main_text_span=DEFAULT_MAIN_TEXT_SPAN):
+    """Build the pages for refs, reusing compiled dafs from the per-daf page cache.
+    Only dafs missing from the cache are fetched and compiled; they are then cached
+    (placeholder pages and pages with transiently failed fetches are not). Pages are
+    returned in the order of refs."""
+    pages = {}
+    if use_page_cache:
+        for ref in refs:
+            talmud_page = load_page_cache(ref, commentary_prefixes)
+            if talmud_page is not None:
+                pages[ref] = talmud_page
+    missing_refs = [ref for ref in refs if ref not in pages]
+    METRICS.incr("page_cache_hits", len(pages))
+    METRICS.incr("page_cache_misses", len(missing_refs))
+    logging.info(f"Page cache: {len(pages)} of {len(refs)} dafs cached, fetching {len(missing_refs)}")
+    
+    if missing_refs:
+        fetched = fetch_all_pages(missing_refs, commentary_prefixes, max_concurrency, commentary_fetch, main_text_span)
+        for ref, talmud_page in zip(missing_refs, fetched):
+            pages[ref] = talmud_page
+            if talmud_page.get('incomplete'):
+                continue
+            if talmud_page['segments'] and talmud_page['segments'][0]['text'] != missing_text_placeholder(ref):
+                save_page_cache(ref, commentary_prefixes, talmud_page)
+    
+    return [pages[ref] for ref in refs]
+
+def record_build_history(entry, path=BUILD_HISTORY_PATH, keep=DEFAULT_HISTORY_SIZE):
+    """Append one build summary to the history file, keeping roughly the last `keep` builds."""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+        history = load_build_history(path)
+        if len(history) > 2 * keep:
+            atomic_write(path, "".join(json.dumps(e, separators=(',', ':')) + "\n" for e in history[-keep:]))
+    except OSError as e:
+        logging.warning(f"Error recording build history: {e}")
+
+def load_build_history(path=BUILD_HISTORY_PATH):
+    """Build summaries recorded by previous runs, oldest first."""
+    history = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    continue  # A line cut short by a concurrent writer
+    except OSError:
+        pass
+    return history
+
+def estimate_duration(requests, dafs_to_compile, output_format, max_concurrency, history):
+    """Estimate build seconds from recorded history: API time from the mean request
+    latency and the parallelism previous builds achieved, output time from the mean
+    seconds per daf of previous builds with the same output format."""
+    fetch_runs = [e for e in history if e.get('requests') and e.get('content_seconds')]
+    total_requests = sum(e['requests'] for e in fetch_runs)
+    latency = sum(e['latency_total'] for e in fetch_runs) / total_requests if total_requests else DEFAULT_PLAN_LATENCY
+    parallelism = (statistics.median(e['latency_total'] / e['content_seconds'] for e in fetch_runs)
+                   if fetch_runs else max_concurrency)
+    parallelism = max(1.0, min(parallelism, max_concurrency, requests or 1))
+    fetch_seconds = requests * latency / parallelism
+    
+    output_runs = [e for e in history if e.get('output_format') == output_format and e.get('dafs')]
+    output_dafs = sum(e['dafs'] for e in output_runs)
+    per_daf = sum(e['output_seconds'] for e in output_runs) / output_dafs if output_dafs else None
+    output_seconds = per_daf * dafs_to_compile if per_daf is not None else None
+    return {
+        'fetch_seconds': round(fetch_seconds, 2),
+        'output_seconds': round(output_seconds, 2) if output_seconds is not None else None,
+        'total_seconds': round(fetch_seconds + (output_seconds or 0), 2),
+        'request_latency': round(latency, 4),
+        'parallelism': round(parallelism, 2),
+        'history_runs': len(history),
+    }
+
+def plan_build(ref_range, commentary_specs=DEFAULT_COMMENTARIES, add_cover=False, output_format="pdf",
+               no_cache=False, max_concurrency=DEFAULT_MAX_CONCURRENCY, commentary_fetch="bulk", range_memo=True,
+               main_text_span=DEFAULT_MAIN_TEXT_SPAN):
+    """Dry run of main(): work out which requests a build would make and which would be
+    served from the content cache, page cache or response store, without fetching text.
+    (The tractate index may fetch the shape of titles it has not stored yet.)
+    Returns a dict of request counts by kind, the cache hit ratio and a duration estimate."""
+    refs = expand_ref_spec(ref_range)
+    commentary_prefixes = [parse_commentary_spec(spec)[0] for spec in commentary_specs]
+    source = get_text_source()
+    store = get_response_store()
+    index = get_tractate_index()
+    requests_by_kind = {'main_text': 0, 'main_text_ranged': 0, 'commentary': 0}
+    hits = {'content_cache': 0, 'page_cache': 0, 'response_cache': 0, 'negative_cache': 0}
+    skipped_by_index = estimated_dafs = 0
+    
+    content_cached = (range_memo and not no_cache and
+                      os.path.exists(os.path.join(CONTENT_CACHE_DIR,
+                                                  generate_content_cache_filename(ref_range, commentary_specs, add_cover))))
+    if content_cached:
+        hits['content_cache'] = 1
+        missing_refs = []
+    else:
+        missing_refs = [ref for ref in refs if no_cache or not os.path.exists(
+            os.path.join(PAGE_CACHE_DIR, generate_page_cache_filename(ref, commentary_prefixes)))]
+        hits['page_cache'] = len(refs) - len(missing_refs)
+    
+    def lookup(ref):
+        """'hit', 'negative' or 'request' for one response lookup."""
+        if not source.cacheable:
+            return 'hit'
+        if store.contains(ref):
+            return 'hit'
+        if store.get_negative(ref) is not None:
+            return 'negative'
+        return 'request'
+    
+    uncached_main = []
+    for ref in missing_refs:
+        if lookup(ref) == 'request':
+            uncached_main.append(ref)
+        else:
+            hits['response_cache'] += 1
+    runs = (group_contiguous_refs(uncached_main, main_text_span) if main_text_span > 1 and source.cacheable
+            else [[ref] for ref in uncached_main])
+    for run in runs:
+        requests_by_kind['main_text_ranged' if len(run) > 1 else 'main_text'] += 1
+    
+    for ref in missing_refs:
+        tractate, daf = ref.rsplit('_', 1)
+        for prefix in commentary_prefixes:
+            title = commentary_title(prefix, tractate)
+            counts = index.comment_counts(title, ref) if index is not None else None
+            if commentary_fetch == "bulk":
+                comm_refs = [f"{title}.{daf}"] if counts is None or any(counts) else []
+                skipped_by_index += 1 - len(comm_refs)
+            else:
+                num_segments = index.segment_count(ref) if index is not None else None
+                if num_segments is None:
+                    cached = store.get(ref) if source.cacheable else None
+                    num_segments = len(cached['versions'][0]['text']) if cached and cached.get('versions') else None
+                if num_segments is None:
+                    num_segments = DEFAULT_PLAN_SEGMENTS
+                    estimated_dafs += 1
+                comm_refs = [f"{title}.{daf}.{i}" for i in range(1, num_segments + 1)
+                             if counts is None or i > len(counts) or counts[i - 1]]
+                skipped_by_index += num_segments - len(comm_refs)
+            for comm_ref in comm_refs:
+                result = lookup(comm_ref)
+                if result == 'request':
+                    requests_by_kind['commentary'] += 1
+                else:
+                    hits['response_cache' if result == 'hit' else 'negative_cache'] += 1
+    
+    total_requests = sum(requests_by_kind.values()) if source.cacheable else 0
+    lookups = total_requests + hits['response_cache'] + hits['negative_cache']
+    return {
+        'ref_range': ref_range,
+        'dafs': len(refs),
+        'dafs_to_compile': len(missing_refs),
+        'text_source': source.name,
+        'requests': dict(requests_by_kind, total=total_requests),
+        'cache_hits': hits,
+        'cache_hit_ratio': round(1 - total_requests / lookups, 4) if lookups else 1.0,
+        'daf_hit_ratio': round(1 - len(missing_refs) / len(refs), 4),
+        'skipped_by_index': skipped_by_index,
+        'dafs_with_estimated_segments': estimated_dafs,
+        'estimate': estimate_duration(total_requests, len(missing_refs), output_format, max_concurrency,
+                                      load_build_history()),
+    }
+
+def write_metrics_reports(metrics_out=None, metrics_prom=None):
+    """Write METRICS as JSON and/or Prometheus text, for the paths that are set."""
+    if metrics_out:
+        METRICS.write_json(metrics_out)
+        logging.info(f"Metrics written to {metrics_out}")
+    if metrics_prom:
+        METRICS.write_prometheus(metrics_prom)
+        logging.info(f"Prometheus metrics written to {metrics_prom}")
+
 def main(
     ref_range,
     commentary_specs=DEFAULT_COMMENTARIES,
@@ -593,7 +3040,19 @@ def main(
     font_path=DEFAULT_FONT,
     page_format=DEFAULT_PAGE_FORMAT,
     text_format="optimize",
-    no_cache=False
+    no_cache=False,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    commentary_fetch="bulk",
+    range_memo=True,
+    render_pool=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    render_workers=DEFAULT_RENDER_WORKERS,
+    metrics_out=None,
+    metrics_prom=None,
+    main_text_span=DEFAULT_MAIN_TEXT_SPAN,
+    targets=None,
+    force=False,
+    output_manifest=True
 ):
     # Setup logging
     logging.basicConfig(
@@ -604,7 +3063,9 @@ def main(
     logger = logging.getLogger(__name__)
     
     start_time = time.time()
-    logger.info(f"Starting Talmud booklet generation (format: {output_format})")
+    http_stats = start_http_stats()
+    formats = ", ".join(target['format'] for target in targets) if targets else output_format
+    logger.info(f"Starting Talmud booklet generation (format: {formats})")
     
     # Generate cache filename based on options
     cache_filename = generate_content_cache_filename(ref_range, commentary_specs, add_cover)
@@ -613,14 +3074,33 @@ def main(
     if no_cache:
         delete_content_cache(cache_filename)
     
-    # Try to load from cache first (unless no_cache is set)
+    # Every target is written from the same all_content
+    if not targets:
+        targets = [{'format': output_format, 'page_format': page_format, 'font_size': font_size,
+                    'text_format': text_format, 'output': output_file}]
+    
+    # Make-style skip: if the content cache is unchanged since every output's manifest
+    # was written and the other inputs match, there is nothing to read or render
+    check_outputs = output_manifest and not force
+    cache_path = os.path.join(CONTENT_CACHE_DIR, cache_filename)
+    if check_outputs and range_memo and not no_cache and outputs_current_for_content_cache(
+            targets, ref_range, commentary_specs, font_path, chunk_size, file_signature(cache_path)):
+        touch_cache_entry(cache_path)
+        METRICS.incr("outputs_up_to_date", len(targets))
+        logger.info(f"Up to date: {', '.join(target['output'] for target in targets)} (use --force to rebuild)")
+        write_metrics_reports(metrics_out, metrics_prom)
+        return
+    
+    # Try the whole-range memo first (unless no_cache is set)
+    content_start = time.perf_counter()
     all_content = None
-    if not no_cache:
-        all_content = load_content_cache(cache_filename)
+    if range_memo and not no_cache:
+        with METRICS.span("content_cache_read"):
+            all_content = load_content_cache(cache_filename)
     
-    # If cache miss or no_cache, generate content
+    # If memo miss or no_cache, assemble content from per-daf pages
     if all_content is None:
-        logger.info("Building content from API calls")
+        logger.info("Building content from page cache and API calls")
         
         # Initialize content structure
         all_content = {
@@ -629,136 +3109,577 @@ def main(
         }
 
         # Parse commentary specifications
-        commentary_styles = {}
-        commentary_prefixes = []
-        for spec in commentary_specs:
-            name, comm_font_size, color = parse_commentary_spec(spec)
-            commentary_prefixes.append(name)
-            commentary_styles[name] = {
-                'font_size': comm_font_size if comm_font_size else font_size - 2,
-                'color': color if color else '#000000'
-            }
+        _, commentary_prefixes = commentary_styles_for(commentary_specs, font_size)
         
         logger.info(f"Commentaries: {', '.join(commentary_prefixes)}")
 
-        # Parse range
-        start_ref, end_ref = parse_range(ref_range)
-        # Generate all refs in range
-        refs = generate_talmud_refs(start_ref, end_ref)
-        logger.info(f"Processing {len(refs)} Talmud pages from {start_ref} to {end_ref}")
+        # Expand the ref spec (dafs, ranges, whole tractates) into daf refs
+        refs = expand_ref_spec(ref_range)
+        logger.info(f"Processing {len(refs)} Talmud pages from {refs[0]} to {refs[-1]}")
 
         if add_cover:
-            add_cover_page(all_content, f"מסכת {start_ref}")
+            add_cover_page(all_content, f"מסכת {refs[0]}")
 
-        for ref in refs:
-            logger.info(f"Fetching {ref}")
-            data, err = fetch_sefaria_text(ref)
-            if err:
-                logger.warning(f"Error fetching {ref}: {err}")
-                # Insert placeholder for missing page
-                segments = [f"[Missing text for {ref}]"]
-                all_commentaries = [[]]
-            else:
-                segments = data["versions"][0]["text"]
-                if isinstance(segments, str):
-                    segments = [segments]
-                # Fetch commentaries for each segment
-                all_commentaries = []
-                for i, seg in enumerate(segments, 1):
-                    comms = []
-                    for prefix in commentary_prefixes:
-                        comm_ref = f"{prefix}.{ref.split('_')[1]}.{i}"
-                        comm_data, comm_err = fetch_sefaria_text(comm_ref)
-                        if comm_data and "versions" in comm_data:
-                            comm_texts = comm_data["versions"][0]["text"]
-                            if isinstance(comm_texts, str):
-                                comm_texts = [comm_texts]
-                            # Store as tuples: (text, commentary_name)
-                            for text in comm_texts:
-                                comms.append((text, prefix))
-                        elif comm_err:
-                            logger.debug(f"Missing commentary {prefix} on {ref}.{i}: {comm_err}")
-                            # Don't add placeholder - just skip missing commentaries
-                    all_commentaries.append(comms)
-            
-            # Create header for this Talmud page (all segments from this daf)
-            header = f"{data.get('title', ref)} {ref.split('_')[1]}"
-            
-            # Build the page with all its segments
-            talmud_page = build_talmud_page(header, segments, all_commentaries)
-            all_content['pages'].append(talmud_page)
+        # Reuse cached dafs; fetch the rest (pages and commentaries) concurrently
+        all_content['pages'] = assemble_pages(
+            refs, commentary_prefixes, max_concurrency, commentary_fetch, use_page_cache=not no_cache,
+            main_text_span=main_text_span
+        )
         
-        # Save to cache for future runs
-        save_content_cache(all_content, cache_filename)
+        # Save the whole-range memo for future runs, unless some fetch failed transiently
+        if range_memo and not any(talmud_page.get('incomplete') for talmud_page in all_content['pages']):
+            save_content_cache(all_content, cache_filename)
     else:
+        METRICS.incr("content_cache_hits")
         logger.info("Using cached content")
+    content_seconds = time.perf_counter() - content_start
+    METRICS.observe("content", content_seconds)
+    METRICS.incr("dafs_processed", len(all_content['pages']))
+    METRICS.incr("segments_processed", sum(len(p['segments']) for p in all_content['pages']))
+    METRICS.incr("commentaries_processed", sum(
+        len(seg['commentaries']) for p in all_content['pages'] for seg in p['segments']
+    ))
     
-    # Parse commentary specifications for styles (needed even when using cache)
-    commentary_styles = {}
-    commentary_prefixes = []
-    for spec in commentary_specs:
-        name, comm_font_size, color = parse_commentary_spec(spec)
-        commentary_prefixes.append(name)
-        commentary_styles[name] = {
-            'font_size': comm_font_size if comm_font_size else font_size - 2,
-            'color': color if color else '#000000'
-        }
+    # Only targets whose fingerprint changed are written
+    output_start = time.perf_counter()
+    digest = content_digest(all_content) if output_manifest else None
+    content_cache = file_signature(cache_path) if range_memo else None
+    pending = []
+    for target in targets:
+        inputs = target_inputs(target, ref_range, commentary_specs, font_path, chunk_size, digest) \
+            if output_manifest else None
+        manifest = load_output_manifest(target['output']) if check_outputs else None
+        if manifest and output_is_current(target, inputs_fingerprint(inputs), manifest):
+            METRICS.incr("outputs_up_to_date")
+            logger.info(f"Up to date: {target['output']} (use --force to rebuild)")
+            if manifest.get('content_cache') != content_cache:
+                # Same content in a rewritten cache file: let the next run skip reading it
+                write_output_manifest(target, inputs, content_cache)
+        else:
+            pending.append((target, inputs))
+    if pending:
+        write_targets(all_content, ref_range, commentary_specs, font_path, [target for target, _ in pending],
+                      chunk_size=chunk_size, render_pool=render_pool, render_workers=render_workers)
+    if output_manifest:
+        for target, inputs in pending:
+            write_output_manifest(target, inputs, content_cache)
+    
+    output_seconds = time.perf_counter() - output_start
+    METRICS.observe("output", output_seconds)
+    
+    logger.info(f"HTTP: {format_http_stats(http_stats)}")
+    if get_response_memo() is not None:
+        memo_stats = get_response_memo().stats()
+        logger.info(f"Memo: {memo_stats['hits']} hits, {memo_stats['misses']} misses, "
+                    f"{memo_stats['coalesced']} coalesced, {memo_stats['entries']} entries")
+    # Request latency and phase timings feed the --plan duration estimates
+    record_build_history({
+        'finished_at': time.time(),
+        'ref_range': ref_range,
+        'output_format': ",".join(sorted({target['format'] for target in targets})),
+        'dafs': len(all_content['pages']),
+        'requests': http_stats['requests'],
+        'latency_total': round(http_stats['latency_total'], 4),
+        'max_concurrency': max_concurrency,
+        'content_seconds': round(content_seconds, 4),
+        'output_seconds': round(output_seconds, 4),
+    })
+    elapsed_time = time.time() - start_time
+    METRICS.observe("total", elapsed_time)
+    write_metrics_reports(metrics_out, metrics_prom)
+    logger.info(f"Total execution time: {elapsed_time:.2f} seconds")
+
+def load_manifest(path):
+    """Read a batch manifest (JSON, or YAML with PyYAML installed) into a list of job dicts.
+    The manifest is a list of jobs, or {'defaults': {...}, 'jobs': [...]} where defaults
+    apply to every job. Job keys are main() parameters, plus an optional 'name'."""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuntimeError("YAML manifests require PyYAML (pip install pyyaml)")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    defaults = manifest.get('defaults') or {}
+    return [dict(defaults, **job) for job in manifest.get('jobs') or []]
 
-    # Generate HTML
-    logger.info("Generating HTML")
-    html_content = generate_html(all_content, ref_range, font_path, font_size, commentary_styles, commentary_prefixes, text_format)
+def job_main_kwargs(job):
+    """Check a batch job against main()'s parameters and fill in a default output file."""
+    allowed = set(inspect.signature(main).parameters) - {'render_pool'}
+    kwargs = {key: value for key, value in job.items() if key != 'name'}
+    unknown = sorted(set(kwargs) - allowed)
+    if unknown:
+        raise ValueError(f"Unknown job options: {', '.join(unknown)}")
+    if 'ref_range' not in kwargs:
+        raise ValueError("Job has no ref_range")
+    if kwargs.get('targets'):
+        # Targets may leave out keys, which then come from the job
+        defaults = {'format': kwargs.get('output_format', "pdf"),
+                    'page_format': kwargs.get('page_format', DEFAULT_PAGE_FORMAT),
+                    'font_size': kwargs.get('font_size', DEFAULT_FONT_SIZE),
+                    'text_format': kwargs.get('text_format', "optimize")}
+        kwargs['targets'] = [dict(defaults, **target) for target in kwargs['targets']]
+        if any('output' not in target for target in kwargs['targets']):
+            raise ValueError("Every target needs an output")
+    elif 'output_file' not in kwargs:
+        extension = "pdf" if kwargs.get('output_format', "pdf") == "pdf" else "html"
+        kwargs['output_file'] = f"{kwargs['ref_range'].replace(',', '_')}.{extension}"
+    return kwargs
+
+def run_batch(jobs, workers=DEFAULT_BATCH_WORKERS, render_workers=DEFAULT_RENDER_WORKERS, render_pool=None):
+    """Run booklet jobs in this process: up to `workers` at once, sharing the response
+    store, memo and tractate index, and rendering through one warm RenderPool. A failing
+    job is recorded and does not stop the others. Returns one result dict per job, in order."""
+    prepared = []
+    for job in jobs:
+        try:
+            prepared.append((job, job_main_kwargs(job), None))
+        except Exception as e:
+            prepared.append((job, None, e))
     
-    if output_format == "html":
-        # Export as HTML
-        output_path = Path(output_file)
-        output_path.write_text(html_content, encoding="utf-8")
-        logger.info(f"HTML file generated successfully: {output_file}")
+    def run_job(item):
+        job, kwargs, error = item
+        name = job.get('name') or job.get('ref_range') or "?"
+        start = time.perf_counter()
+        try:
+            if error is not None:
+                raise error
+            target_files = [target['output'] for target in kwargs.get('targets') or []]
+            main(render_pool=pool, **kwargs)
+            return {'name': name, 'status': "ok", 'seconds': round(time.perf_counter() - start, 3),
+                    'outputs': target_files or [kwargs['output_file']]}
+        except Exception as e:
+            logging.error(f"Job {name} failed: {e}")
+            return {'name': name, 'status': "failed", 'seconds': round(time.perf_counter() - start, 3),
+                    'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc()}
     
-    elif output_format == "html-for-epub":
-        # Export as HTML for EPUB conversion
-        logger.info(f"Generating HTML for EPUB conversion: {output_file}")
-        
-        # Note: Full EPUB support would require additional libraries like ebooklib
-        logger.info("HTML file will be saved for EPUB conversion.")
-        logger.info("Use a tool like Calibre or pandoc to convert HTML to EPUB:")
-        logger.info(f"  pandoc {output_file} -o {output_file.replace('.html', '.epub')}")
+    # Browsers are only started when some job renders a PDF
+    renders = any(any(target['format'] == "pdf" for target in kwargs['targets']) if kwargs.get('targets')
+                  else kwargs.get('output_format', "pdf") == "pdf"
+                  for _, kwargs, _ in prepared if kwargs is not None)
+    own_pool = render_pool is None and renders
+    pool = RenderPool(workers=render_workers) if own_pool else render_pool
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch-job") as executor:
+            return list(executor.map(run_job, prepared))
+    finally:
+        if own_pool:
+            pool.close()
+
+def batch_command(argv):
+    """Batch mode: python talmud_booklet.py batch manifest.yaml [--workers N] [--report report.json]"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="talmud_booklet.py batch",
+                                     description="Build many booklets from a JSON/YAML manifest in one process")
+    parser.add_argument("manifest", help="JSON or YAML list of jobs (main() parameters), or {defaults, jobs}")
+    parser.add_argument("--workers", type=int, default=DEFAULT_BATCH_WORKERS, help="Jobs run at once")
+    parser.add_argument("--render-workers", type=int, default=DEFAULT_RENDER_WORKERS,
+                        help=f"Warm browsers shared by all jobs (default: {DEFAULT_RENDER_WORKERS})")
+    parser.add_argument("--report", help="Write the per-job summary as JSON")
+    parser.add_argument("--force", action="store_true", help="Rebuild every job's outputs, even if up to date")
+    parser.add_argument("--api-base-url", help="Sefaria v3 texts endpoint")
+    parser.add_argument("--cache-backend", default="files", choices=["files", "sqlite"], help="API response store")
+    parser.add_argument("--cache-db", default=DEFAULT_CACHE_DB, help="Database for --cache-backend sqlite")
+    parser.add_argument("--memo-size", type=int, default=DEFAULT_MEMO_SIZE, help="Responses kept in memory")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(threadName)s %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    configure_http(api_base_url=args.api_base_url)
+    configure_response_store(args.cache_backend, args.cache_db if args.cache_backend == "sqlite" else None)
+    configure_response_memo(args.memo_size)
+    
+    jobs = load_manifest(args.manifest)
+    if args.force:
+        jobs = [dict(job, force=True) for job in jobs]
+    start = time.perf_counter()
+    results = run_batch(jobs, args.workers, args.render_workers)
+    elapsed = time.perf_counter() - start
+    
+    failed = [result for result in results if result['status'] != "ok"]
+    logging.info(f"Batch finished: {len(results) - len(failed)} ok, {len(failed)} failed in {elapsed:.2f} seconds")
+    for result in results:
+        detail = ", ".join(result['outputs']) if result['status'] == "ok" else result['error']
+        logging.info(f"  {result['status']:>6}  {result['seconds']:8.2f}s  {result['name']}: {detail}")
+    if args.report:
+        report = {'jobs': results, 'ok': len(results) - len(failed), 'failed': len(failed),
+                  'seconds': round(elapsed, 3), 'memo': get_response_memo().stats() if get_response_memo() else None}
+        atomic_write(args.report, json.dumps(report, ensure_ascii=False, indent=2))
+        logging.info(f"Batch report written to {args.report}")
+    return 1 if failed else 0
+
+SERVICE_OPTIONS = ('ref_range', 'commentary_specs', 'font_size', 'add_cover', 'output_format', 'page_format',
+                   'text_format', 'commentary_fetch', 'chunk_size')
+
+def validate_service_params(params):
+    """Check the types and values of service job options, as the CLI parser would.
+    Raises ValueError for the first invalid option."""
+    if not isinstance(params.get('ref_range'), str):
+        raise ValueError("ref_range must be a string")
+    specs = params.get('commentary_specs', DEFAULT_COMMENTARIES)
+    if not isinstance(specs, list) or not all(isinstance(spec, str) for spec in specs):
+        raise ValueError("commentary_specs must be a list of strings")
+    for name in ('font_size', 'chunk_size'):
+        value = params.get(name, 0)
+        # bool is an int subclass, but true is not a size
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{name} must be a non-negative integer")
+    if params.get('font_size', DEFAULT_FONT_SIZE) == 0:
+        raise ValueError("font_size must be a positive integer")
+    if not isinstance(params.get('add_cover', False), bool):
+        raise ValueError("add_cover must be true or false")
+    if not isinstance(params.get('page_format', DEFAULT_PAGE_FORMAT), str):
+        raise ValueError("page_format must be a string")
+    for name, default, choices in (('output_format', "pdf", TARGET_FORMATS), ('text_format', "optimize", TEXT_FORMATS),
+                                   ('commentary_fetch', "bulk", ("bulk", "segment"))):
+        if params.get(name, default) not in choices:
+            raise ValueError(f"Invalid {name}: {params[name]!r} (choose from {', '.join(choices)})")
+
+def result_key(params, font_path):
+    """Content address of a booklet: a hash of everything that changes the output
+    (the expanded refs and title, every SERVICE_OPTIONS value, the font file contents
+    and how it is delivered, and the generator version)."""
+    inputs = {
+        'version': code_version(),
+        'refs': expand_ref_spec(params['ref_range']),
+        'title': params['ref_range'],
+        'commentary_specs': list(params.get('commentary_specs', DEFAULT_COMMENTARIES)),
+        'font': font_digest(font_path),
+        'font_delivery': font_delivery(),
+        'font_size': params.get('font_size', DEFAULT_FONT_SIZE),
+        'page_format': params.get('page_format', DEFAULT_PAGE_FORMAT),
+        'text_format': params.get('text_format', "optimize"),
+        'output_format': params.get('output_format', "pdf"),
+        'add_cover': bool(params.get('add_cover', False)),
+        'commentary_fetch': params.get('commentary_fetch', "bulk"),
+        'chunk_size': params.get('chunk_size', DEFAULT_CHUNK_SIZE),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class BookletService:
+    """Builds booklets on request for an HTTP frontend.
+    
+    Jobs take the main() options in SERVICE_OPTIONS and are identified by result_key,
+    so a result already on disk in results_dir is returned at once and identical
+    requests in flight share one job. New jobs wait in a bounded queue for one of
+    `workers` threads, which render through a shared pool of warm browsers; when the
+    queue is full, submit() rejects the job (HTTP 429) instead of queueing it.
+    
+        POST /jobs              {"ref_range": "Berakhot_2a", ...} -> 200 done, 202 queued, 429 full
+        GET  /jobs/<id>         job status
+        GET  /jobs/<id>/result  the PDF or HTML
+        GET  /metrics           Prometheus metrics, including queue depth and job latency
+        GET  /health            render pool health
+    """
+    
+    def __init__(self, results_dir=DEFAULT_RESULTS_DIR, font_path=DEFAULT_FONT, workers=DEFAULT_SERVICE_WORKERS,
+                 queue_size=DEFAULT_SERVICE_QUEUE_SIZE, render_workers=DEFAULT_RENDER_WORKERS, render_pool=None):
+        self.results_dir = results_dir
+        self.font_path = font_path
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._own_pool = render_pool is None
+        self.render_pool = render_pool or RenderPool(workers=render_workers)
+        self._threads = [threading.Thread(target=self._worker, name=f"service-worker-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+    
+    def result_path(self, key, output_format):
+        extension = "pdf" if output_format == "pdf" else "html"
+        return os.path.join(self.results_dir, f"{key}.{extension}")
+    
+    def submit(self, params):
+        """Queue a booklet job. Returns (http_status, job status dict)."""
+        unknown = sorted(set(params) - set(SERVICE_OPTIONS))
+        if unknown:
+            return 400, {'error': f"Unknown options: {', '.join(unknown)}"}
+        if 'ref_range' not in params:
+            return 400, {'error': "ref_range is required"}
+        if font_digest(self.font_path) is None:
+            return 400, {'error': f"Font file not found: {self.font_path}"}
+        try:
+            validate_service_params(params)
+            key = result_key(params, self.font_path)
+        except (ValueError, KeyError, OSError) as e:
+            return 400, {'error': str(e)}
+        METRICS.incr("service_jobs_submitted")
         
-        output_path = Path(output_file)
-        output_path.write_text(html_content, encoding="utf-8")
-        logger.info(f"HTML file generated for EPUB conversion: {output_path}")
-    
-    else:  # pdf (default)
-        # Write HTML to temporary file
-        html_file = Path("temp_talmud.html")
-        html_file.write_text(html_content, encoding="utf-8")
-        logger.info(f"HTML written to {html_file}")
-
-        # Generate PDF using Playwright
-        logger.info(f"Generating PDF with Playwright: {output_file}")
-        with sync_playwright() as p:
-            browser = p.chromium.launch()
-            page = browser.new_page()
-            page.goto(html_file.resolve().as_uri())
-            page.pdf(
-                path=output_file,
-                format=page_format,
-                print_background=True,
-                margin={"top": "0mm", "bottom": "0mm", "left": "0mm", "right": "0mm"}
-            )
-            browser.close()
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job['status'] in ("queued", "running"):
+                METRICS.incr("service_jobs_coalesced")
+                return 202, self._public(job)
+            path = self.result_path(key, params.get('output_format', "pdf"))
+            if os.path.exists(path):
+                METRICS.incr("service_result_cache_hits")
+                touch_cache_entry(path)
+                job = self._remember({'id': key, 'status': "done", 'params': params, 'path': path,
+                                      'submitted_at': time.time(), 'cached': True})
+                return 200, self._public(job)
+            job = {'id': key, 'status': "queued", 'params': params, 'path': path, 'submitted_at': time.time(),
+                   'cached': False}
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                METRICS.incr("service_jobs_rejected")
+                return 429, {'error': "Queue is full, retry later", 'queue_size': self._queue.maxsize}
+            self._remember(job)
+            return 202, self._public(job)
+    
+    def status(self, key):
+        with self._lock:
+            job = self._jobs.get(key)
+            return self._public(job) if job is not None else None
+    
+    def _remember(self, job):
+        # Called with the lock held; forgets the oldest finished jobs beyond the history size
+        self._jobs[job['id']] = job
+        self._jobs.move_to_end(job['id'])
+        finished = [k for k, j in self._jobs.items() if j['status'] in ("done", "failed")]
+        for old_key in finished[:max(0, len(finished) - DEFAULT_SERVICE_JOB_HISTORY)]:
+            del self._jobs[old_key]
+        return job
+    
+    @staticmethod
+    def _public(job):
+        return {k: v for k, v in job.items() if k not in ('params', 'path')}
+    
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            started = time.time()
+            METRICS.observe("service_queue_wait", started - job['submitted_at'])
+            with self._lock:
+                job.update(status="running", started_at=started)
+            params = job['params']
+            tmp_path = f"{job['path']}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(self.results_dir, exist_ok=True)
+                with METRICS.span("service_job"):
+                    # Results are content-addressed already, so no per-output manifest
+                    main(font_path=self.font_path, output_file=tmp_path, render_pool=self.render_pool,
+                         output_manifest=False, **params)
+                os.replace(tmp_path, job['path'])
+                status, error = "done", None
+                METRICS.incr("service_jobs_done")
+            except Exception as e:
+                logging.error(f"Job {job['id']} failed: {e}")
+                status, error = "failed", f"{type(e).__name__}: {e}"
+                METRICS.incr("service_jobs_failed")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            finished = time.time()
+            METRICS.observe("service_latency", finished - job['submitted_at'])
+            with self._lock:
+                job.update(status=status, finished_at=finished, seconds=round(finished - job['submitted_at'], 3))
+                if error:
+                    job['error'] = error
+    
+    def metrics(self):
+        """Prometheus text: the process metrics plus queue and job gauges."""
+        with self._lock:
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job['status']] = by_status.get(job['status'], 0) + 1
+        lines = [METRICS.to_prometheus().rstrip("\n"),
+                 "# TYPE talmud_booklet_service_queue_depth gauge",
+                 f"talmud_booklet_service_queue_depth {self._queue.qsize()}",
+                 "# TYPE talmud_booklet_service_queue_capacity gauge",
+                 f"talmud_booklet_service_queue_capacity {self._queue.maxsize}",
+                 "# TYPE talmud_booklet_service_jobs gauge"]
+        for status in ("queued", "running", "done", "failed"):
+            lines.append(f'talmud_booklet_service_jobs{{status="{status}"}} {by_status.get(status, 0)}')
+        return "\n".join(lines) + "\n"
+    
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._own_pool:
+            self.render_pool.close()
+    
+    def handler_class(self):
+        service = self
         
-        # Clean up temporary HTML file
-        html_file.unlink()
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if urlsplit(self.path).path.rstrip("/") != "/jobs":
+                    return self._send_json(404, {'error': "Not found"})
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    params = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(params, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    return self._send_json(400, {'error': f"Invalid JSON: {e}"})
+                status, payload = service.submit(params)
+                headers = {"Retry-After": "5"} if status == 429 else {}
+                if 'id' in payload:
+                    headers["Location"] = f"/jobs/{payload['id']}"
+                self._send_json(status, payload, headers)
+            
+            def do_GET(self):
+                parts = [part for part in urlsplit(self.path).path.split("/") if part]
+                if parts == ["metrics"]:
+                    return self._send(200, service.metrics().encode('utf-8'), "text/plain; version=0.0.4")
+                if parts == ["health"]:
+                    return self._send_json(200, {'workers': service.render_pool.health(),
+                                                 'queue_depth': service._queue.qsize()})
+                if len(parts) in (2, 3) and parts[0] == "jobs":
+                    job = service.status(parts[1])
+                    if job is None:
+                        return self._send_json(404, {'error': "Unknown job"})
+                    if len(parts) == 2:
+                        return self._send_json(200, job)
+                    if parts[2] == "result" and job['status'] == "done":
+                        with service._lock:
+                            path = service._jobs[parts[1]]['path']
+                        content_type = "application/pdf" if path.endswith(".pdf") else "text/html; charset=utf-8"
+                        return self._send(200, Path(path).read_bytes(), content_type)
+                    return self._send_json(409 if parts[2] == "result" else 404, job)
+                self._send_json(404, {'error': "Not found"})
+            
+            def _send_json(self, status, payload, headers=None):
+                self._send(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                           "application/json; charset=utf-8", headers)
+            
+            def _send(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                logging.debug(f"{self.address_string()} {format % args}")
         
-        logger.info(f"PDF generated successfully: {output_file}")
+        return Handler
+
+def serve_command(argv):
+    """Service mode: python talmud_booklet.py serve [--port 8080] [--workers N] [--queue-size N]"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="talmud_booklet.py serve", description="HTTP booklet service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=DEFAULT_SERVICE_WORKERS, help="Jobs built at once")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_SERVICE_QUEUE_SIZE,
+                        help="Jobs that may wait; further jobs are rejected with HTTP 429")
+    parser.add_argument("--render-workers", type=int, default=DEFAULT_RENDER_WORKERS, help="Warm browsers")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR, help="Content-addressed result files")
+    parser.add_argument("--font", default=DEFAULT_FONT, help="Path to Hebrew TTF font file")
+    parser.add_argument("--api-base-url", help="Sefaria v3 texts endpoint")
+    parser.add_argument("--cache-backend", default="files", choices=["files", "sqlite"], help="API response store")
+    parser.add_argument("--cache-db", default=DEFAULT_CACHE_DB, help="Database for --cache-backend sqlite")
+    parser.add_argument("--memo-size", type=int, default=DEFAULT_MEMO_SIZE, help="Responses kept in memory")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(threadName)s %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    configure_http(api_base_url=args.api_base_url)
+    configure_response_store(args.cache_backend, args.cache_db if args.cache_backend == "sqlite" else None)
+    configure_response_memo(args.memo_size)
     
-    elapsed_time = time.time() - start_time
-    logger.info(f"Total execution time: {elapsed_time:.2f} seconds")
+    service = BookletService(args.results_dir, args.font, args.workers, args.queue_size, args.render_workers)
+    httpd = ThreadingHTTPServer((args.host, args.port), service.handler_class())
+    httpd.daemon_threads = True
+    logging.info(f"Booklet service listening on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+    return 0
+
+def cache_command(argv):
+    """Maintenance commands for the caches: python talmud_booklet.py cache <command> ..."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="talmud_booklet.py cache", description="Cache maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    migrate = subparsers.add_parser("migrate", help="Import a data/ directory into the SQLite store")
+    migrate.add_argument("--data-dir", default=CACHE_DIR, help="Directory of cached JSON responses")
+    migrate.add_argument("--db", default=DEFAULT_CACHE_DB, help="SQLite database to import into")
+    
+    purge = subparsers.add_parser("purge-negative", help="Delete negative (known-missing) entries")
+    purge.add_argument("--backend", default="files", choices=["files", "sqlite"], help="Response store to purge")
+    purge.add_argument("--data-dir", default=CACHE_DIR, help="Cache directory for the files backend")
+    purge.add_argument("--db", default=DEFAULT_CACHE_DB, help="Database for the sqlite backend")
+    purge.add_argument("--match", metavar="GLOB",
+                       help="Only entries whose cache key matches, e.g. 'Tosafot_on_Berakhot_*'")
+    purge.add_argument("--expired-only", action="store_true", help="Only entries older than --negative-ttl")
+    purge.add_argument("--negative-ttl", type=float, default=DEFAULT_NEGATIVE_TTL,
+                       help="Negative entry TTL in seconds (for --expired-only)")
+    
+    gc = subparsers.add_parser("gc", help="Evict expired and least recently used cache files")
+    gc.add_argument("--max-bytes", type=parse_byte_size,
+                    help="Byte budget for data/ and content_cache/ together, e.g. 500M or 2G")
+    gc.add_argument("--data-dir", default=CACHE_DIR, help="API response cache directory")
+    gc.add_argument("--content-dir", default=CONTENT_CACHE_DIR, help="Content cache directory")
+    gc.add_argument("--data-ttl", type=float, help="Evict API responses older than this many seconds")
+    gc.add_argument("--content-ttl", type=float, help="Evict content cache entries older than this many seconds")
+    gc.add_argument("--min-age", type=float, default=DEFAULT_GC_MIN_AGE,
+                    help="Never evict entries written or read within this many seconds")
+    gc.add_argument("--dry-run", action="store_true", help="Report what would be evicted without deleting")
+    
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    if args.command == "migrate":
+        migrate_data_dir_to_sqlite(args.data_dir, args.db)
+    elif args.command == "purge-negative":
+        path = args.db if args.backend == "sqlite" else args.data_dir
+        store = configure_response_store(args.backend, path, negative_ttl=args.negative_ttl)
+        purged = store.purge_negative(args.match, args.expired_only)
+        logging.info(f"Purged {purged} negative cache entries")
+    elif args.command == "gc":
+        manager = CacheManager({'data': (args.data_dir, args.data_ttl), 'content': (args.content_dir, args.content_ttl)},
+                               max_bytes=args.max_bytes, min_age=args.min_age)
+        summary = manager.collect(dry_run=args.dry_run)
+        verb = "Would evict" if args.dry_run else "Evicted"
+        for name in manager.stores:
+            stats = summary[name]
+            logging.info(f"{name}: {stats['entries']} entries, {stats['bytes'] / 1024 / 1024:.1f} MB; "
+                         f"{verb} {stats['expired']} expired and {stats['evicted']} least recently used "
+                         f"({stats['bytes_freed'] / 1024 / 1024:.1f} MB)")
+        logging.info(f"Cache size after gc: {summary['total_bytes'] / 1024 / 1024:.1f} MB")
+    return 0
 
 if __name__ == "__main__":
     # Example usage: 
     # python talmud_booklet.py Berakhot_3b --font_size 18 --cover
     # python talmud_booklet.py Berakhot_3a --commentaries Rashi_on_Berakhot:10:#0000FF Tosafot_on_Berakhot:12:#008000
+    # python talmud_booklet.py cache migrate --data-dir data --db data/responses.sqlite3
+    # python talmud_booklet.py cache gc --max-bytes 2G --content-ttl 2592000
+    # python talmud_booklet.py batch nightly.yaml --workers 4 --report report.json
+    quiet_font_tools_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == "cache":
+        sys.exit(cache_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(batch_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        sys.exit(serve_command(sys.argv[2:]))
+    
     import argparse
     parser = argparse.ArgumentParser(
         description="Generate Talmud booklet PDFs with optional commentaries",
@@ -778,7 +3699,9 @@ Commentary Format:
     --commentaries Rashi_on_Berakhot:10:#0000FF Tosafot_on_Berakhot:12:#008000
         """
     )
-    parser.add_argument("ref_range", help="Reference or range, e.g. Berakhot_3a-Berakhot_5b")
+    parser.add_argument("ref_range",
+                        help="Daf, range, tractate or comma-separated list, e.g. Berakhot_3a-Berakhot_5b, Berakhot, "
+                             "Berakhot_63b-Shabbat_3a,Yoma_2a")
     parser.add_argument("--commentaries", nargs="+", default=DEFAULT_COMMENTARIES,
                         help="Commentary specifications (see format below)")
     parser.add_argument("--font_size", type=int, default=DEFAULT_FONT_SIZE,
@@ -790,11 +3713,97 @@ Commentary Format:
     parser.add_argument("--cover", action="store_true", help="Add cover page")
     parser.add_argument("--no-cache", action="store_true", 
                         help="Ignore content cache and regenerate from API (deletes existing cache)")
+    parser.add_argument("--no-range-memo", action="store_true",
+                        help="Do not read or write the whole-range content cache (per-daf page cache is still used)")
+    parser.add_argument("--target", action="append", metavar="SPEC",
+                        help="Output target, repeatable, written instead of the --format/--output output: "
+                             "comma-separated key=value pairs for format, page_format, "
+                             "font_size, text_format and output, e.g. format=pdf,page_format=A5,output=a5.pdf. "
+                             "Keys left out default to the options above. All targets share one content build "
+                             "and one browser session")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild outputs even if their manifests (<output>.manifest.json) show nothing changed")
+    parser.add_argument("--plan", action="store_true",
+                        help="Print the requests the build would make, the cache hit ratio and an estimated "
+                             "duration as JSON, without fetching or rendering")
+    parser.add_argument("--memo-size", type=int, default=DEFAULT_MEMO_SIZE,
+                        help="Responses kept in memory for reuse within the process (0 disables the memo)")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Do not use the tractate index (data/_index/) to resolve and check refs or skip "
+                             "commentaries known not to exist")
     parser.add_argument("--format", default="pdf", choices=["pdf", "html", "html-for-epub"],
                         help="Output format: pdf (default), html, or html-for-epub")
     parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Output file path")
     parser.add_argument("--font", default=DEFAULT_FONT, help="Path to Hebrew TTF font file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Render PDF in chunks of this many dafs in parallel and merge them (requires pypdf)")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or DEFAULT_RENDER_WORKERS,
+                        help="Parallel browsers for chunked rendering (default: number of CPUs)")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="Maximum number of concurrent Sefaria API requests")
+    parser.add_argument("--metrics-out", metavar="PATH",
+                        help="Write a JSON report of phase timings, per-ref fetch spans and counters")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+                        help="Write metrics in Prometheus text format (e.g. for the node exporter textfile collector)")
+    parser.add_argument("--text-source", default="api", choices=["api", "export", "fixtures"],
+                        help="Where text comes from: Sefaria API (default), a local Sefaria-Export dump, or fixtures")
+    parser.add_argument("--export-dir", help="Sefaria-Export json/ directory for --text-source export")
+    parser.add_argument("--export-language", default="Hebrew", help="Language directory to read from the export")
+    parser.add_argument("--fixtures-dir", help="Directory of JSON fixtures (data/ layout) for --text-source fixtures")
+    parser.add_argument("--api-base-url", default=DEFAULT_API_BASE_URL,
+                        help="Sefaria v3 texts endpoint (default: $SEFARIA_API_BASE_URL or the public API)")
+    parser.add_argument("--http-pool-size", type=int, default=None,
+                        help="Keep-alive HTTP connections to Sefaria (default: --max-concurrency)")
+    parser.add_argument("--connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help="HTTP connect timeout in seconds")
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT,
+                        help="HTTP read timeout in seconds")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help="Retries on HTTP 429/5xx and connection errors (exponential backoff)")
+    parser.add_argument("--cache-backend", default="files", choices=["files", "sqlite"],
+                        help="API response store: one JSON file per ref in data/ (default) or one SQLite database")
+    parser.add_argument("--cache-db", default=DEFAULT_CACHE_DB,
+                        help="SQLite database path for --cache-backend sqlite")
+    parser.add_argument("--negative-ttl", type=float, default=DEFAULT_NEGATIVE_TTL,
+                        help="Seconds to remember refs with no text before asking the API again (0 disables)")
+    parser.add_argument("--max-span", type=int, default=DEFAULT_MAIN_TEXT_SPAN,
+                        help="Max dafs of main text fetched per ranged API call (1 fetches each daf separately)")
+    parser.add_argument("--commentary-fetch", default="bulk", choices=["bulk", "segment"],
+                        help="Fetch each commentary per daf in one request (bulk, default) or per segment")
     args = parser.parse_args()
+    configure_http(
+        pool_size=args.http_pool_size or args.max_concurrency,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        max_retries=args.max_retries,
+        api_base_url=args.api_base_url
+    )
+    if args.text_source == "export":
+        if not args.export_dir:
+            parser.error("--text-source export requires --export-dir")
+        configure_text_source(ExportDirectorySource(args.export_dir, args.export_language))
+    elif args.text_source == "fixtures":
+        if not args.fixtures_dir:
+            parser.error("--text-source fixtures requires --fixtures-dir")
+        configure_text_source(FixtureSource(fixtures_dir=args.fixtures_dir))
+    configure_response_store(args.cache_backend, args.cache_db if args.cache_backend == "sqlite" else None,
+                             negative_ttl=args.negative_ttl)
+    target_defaults = {'format': args.format, 'page_format': args.page_format, 'font_size': args.font_size,
+                       'text_format': args.text_format, 'output': args.output}
+    try:
+        targets = [parse_target_spec(spec, target_defaults) for spec in args.target or []]
+    except ValueError as e:
+        parser.error(str(e))
+    configure_response_memo(args.memo_size)
+    if args.no_index:
+        configure_tractate_index(None)
+    if args.plan:
+        print(json.dumps(plan_build(
+            args.ref_range, args.commentaries, add_cover=args.cover, output_format=args.format,
+            no_cache=args.no_cache, max_concurrency=args.max_concurrency, commentary_fetch=args.commentary_fetch,
+            range_memo=not args.no_range_memo, main_text_span=args.max_span
+        ), indent=2))
+        sys.exit(0)
     main(
         args.ref_range,
         commentary_specs=args.commentaries,
@@ -805,5 +3814,15 @@ Commentary Format:
         font_path=args.font,
         page_format=args.page_format,
         text_format=args.text_format,
-        no_cache=args.no_cache
+        no_cache=args.no_cache,
+        max_concurrency=args.max_concurrency,
+        commentary_fetch=args.commentary_fetch,
+        range_memo=not args.no_range_memo,
+        chunk_size=args.chunk_size,
+        render_workers=args.render_workers,
+        metrics_out=args.metrics_out,
+        metrics_prom=args.metrics_prom,
+        main_text_span=args.max_span,
+        targets=targets,
+        force=args.force
     )
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Offline tests for talmud_booklet.py. Text comes from FixtureSource payloads, so
+no test touches the network or launches a browser.
+
+Run from the repository root:
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import talmud_booklet as tb  # noqa: E402
+
+def daf_payload(segments, title="Berakhot"):
+    """A v3 API response for one daf (or a ranged ref, with one list per daf)."""
+    return {'title': title, 'versions': [{'text': segments, 'language': "he"}]}
+
+class IsolatedTestCase(unittest.TestCase):
+    """Runs each test in an empty working directory, so data/ and content_cache/
+    start empty, with a fresh response store and memo and no tractate index."""
+
+    def setUp(self):
+        previous = os.getcwd()
+        self.workdir = tempfile.mkdtemp(prefix="talmud_test_")
+        os.chdir(self.workdir)
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.addCleanup(os.chdir, previous)
+        self.addCleanup(tb.configure_text_source, tb.SefariaApiSource())
+        self.addCleanup(tb.configure_tractate_index, tb.TractateIndex())
+        tb.configure_response_store("files")
+        tb.configure_response_memo(tb.DEFAULT_MEMO_SIZE)
+        tb.configure_tractate_index(None)
+
+    def use_fixtures(self, fixtures=None, shapes=None):
+        """Serve text from fixtures; with shapes, also use a TractateIndex built from them."""
+        source = tb.FixtureSource(fixtures, shapes=shapes)
+        tb.configure_text_source(source)
+        if shapes is not None:
+            tb.configure_tractate_index(tb.TractateIndex())
+        return source
@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = json.dumps(payload).encode('utf-8')
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+class SlowSession:
+    """Answers every text request with a one-segment daf, slowly enough for jobs to overlap."""
+    def __init__(self):
+        self.urls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        with self.lock:
+            self.urls.append(url)
+        time.sleep(0.02)
+        return FakeResponse(daf_payload(["text"]))
+
+class BatchHttpStatsTest(IsolatedTestCase):
+    def test_each_job_records_only_its_own_requests(self):
+        session = SlowSession()
+        patcher = mock.patch.object(tb, "get_http_session", lambda: session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs = [
+            {'ref_range': "Berakhot_2a", 'output_file': "one.html"},
+            {'ref_range': "Shabbat_2a-Shabbat_3b", 'output_file': "four.html"},
+        ]
+        defaults = {'output_format': "html", 'commentary_specs': [], 'main_text_span': 1, 'font_path': "font.ttf"}
+        with self.assertLogs(level="INFO"):
+            results = tb.run_batch([dict(defaults, **job) for job in jobs], workers=2)
+        self.assertEqual([result['status'] for result in results], ["ok", "ok"])
+        self.assertEqual(len(session.urls), 5)
+        history = {entry['ref_range']: entry for entry in tb.load_build_history()}
+        self.assertEqual(history["Berakhot_2a"]['requests'], 1)
+        self.assertEqual(history["Shabbat_2a-Shabbat_3b"]['requests'], 4)
+
+class BatchIsolationTest(IsolatedTestCase):
+    def test_failing_jobs_do_not_stop_the_others(self):
+        self.use_fixtures({"Berakhot_2a": daf_payload(["a"]), "Berakhot_2b": daf_payload(["b"])})
+        jobs = [
+            {'name': "bad option", 'ref_range': "Berakhot_2a", 'colour': "red"},
+            {'name': "reversed", 'ref_range': "Berakhot_2b-Berakhot_2a", 'output_format': "html"},
+            {'name': "good", 'ref_range': "Berakhot_2a-Berakhot_2b", 'output_format': "html",
+             'commentary_specs': [], 'font_path': "font.ttf"},
+        ]
+        with self.assertLogs(level="INFO"):
+            results = tb.run_batch(jobs, workers=3)
+        self.assertEqual([result['status'] for result in results], ["failed", "failed", "ok"])
+        self.assertIn("colour", results[0]['error'])
+        self.assertIn("ValueError", results[1]['error'])
+        self.assertEqual(results[2]['outputs'], ["Berakhot_2a-Berakhot_2b.html"])
+        with open("Berakhot_2a-Berakhot_2b.html", 'r', encoding='utf-8') as f:
+            html = f.read()
+        self.assertIn("Berakhot 2b", html)
+
+    def test_manifest_defaults_apply_to_every_job(self):
+        with open("jobs.json", 'w', encoding='utf-8') as f:
+            json.dump({'defaults': {'output_format': "html"},
+                       'jobs': [{'ref_range': "Berakhot_2a"}, {'ref_range': "Shabbat_2a", 'output_format': "pdf"}]}, f)
+        jobs = tb.load_manifest("jobs.json")
+        self.assertEqual([job['output_format'] for job in jobs], ["html", "pdf"])
+        self.assertEqual([tb.job_main_kwargs(job)['output_file'] for job in jobs], ["Berakhot_2a.html", "Shabbat_2a.pdf"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import gzip
+import json
+import os
+import time
+import unittest
+import zlib
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+class CacheRecordTest(unittest.TestCase):
+    def test_round_trip_keeps_only_used_fields(self):
+        data = dict(daf_payload(["א", "ב"]), ref="Berakhot_2a", available_versions=[{'x': 1}])
+        decoded, current = tb.decode_cache_record(tb.encode_cache_record(data))
+        self.assertTrue(current)
+        self.assertEqual(decoded, {'title': "Berakhot", 'versions': [{'text': ["א", "ב"]}]})
+
+    def test_round_trip_without_versions(self):
+        decoded, current = tb.decode_cache_record(tb.encode_cache_record({'versions': []}))
+        self.assertTrue(current)
+        self.assertEqual(decoded, {'versions': []})
+
+    def test_version_one_record_needs_rewrite(self):
+        blob = zlib.compress(json.dumps(dict(daf_payload(["א"]), ref="Berakhot_2a")).encode('utf-8'))
+        decoded, current = tb.decode_cache_record(blob)
+        self.assertFalse(current)
+        self.assertEqual(decoded, {'title': "Berakhot", 'versions': [{'text': ["א"]}]})
+
+    def test_unknown_version_raises(self):
+        blob = gzip.compress(json.dumps({'v': 99, 'text': []}).encode('utf-8'))
+        with self.assertRaises(ValueError):
+            tb.decode_cache_record(blob)
+
+class FileResponseStoreTest(IsolatedTestCase):
+    def test_put_and_get(self):
+        store = tb.FileResponseStore()
+        store.put("Berakhot_2a", daf_payload(["א"]))
+        self.assertTrue(os.path.exists(store.path_for("Berakhot_2a")))
+        self.assertEqual(store.get("Berakhot_2a"), {'title': "Berakhot", 'versions': [{'text': ["א"]}]})
+        self.assertIsNone(store.get("Berakhot_2b"))
+
+    def test_legacy_file_is_migrated(self):
+        store = tb.FileResponseStore()
+        os.makedirs(tb.CACHE_DIR)
+        legacy_path = os.path.join(tb.CACHE_DIR, "Rashi_on_Berakhot_2a_1.json")
+        with open(legacy_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(daf_payload(["פירוש"], title="Rashi on Berakhot"), ref="Rashi on Berakhot 2a:1"), f, indent=2)
+        data = store.get("Rashi_on_Berakhot.2a.1")
+        self.assertEqual(data, {'title': "Rashi on Berakhot", 'versions': [{'text': ["פירוש"]}]})
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertEqual(tb.load_cache_file(store.path_for("Rashi_on_Berakhot.2a.1")), (data, True))
+
+class SqliteResponseStoreTest(IsolatedTestCase):
+    def test_put_get_and_contains(self):
+        store = tb.SqliteResponseStore("cache.db")
+        self.assertFalse(store.contains("Berakhot_2a"))
+        store.put("Berakhot_2a", daf_payload(["א"]))
+        self.assertTrue(store.contains("Berakhot_2a"))
+        self.assertEqual(store.get("Berakhot_2a"), {'title': "Berakhot", 'versions': [{'text': ["א"]}]})
+        self.assertIsNone(store.get("Berakhot_2b"))
+
+    def test_zlib_row_is_rewritten_on_read(self):
+        store = tb.SqliteResponseStore("cache.db")
+        blob = zlib.compress(json.dumps(dict(daf_payload(["א"]), ref="Berakhot_2a")).encode('utf-8'))
+        store._connect().execute("INSERT INTO responses (key, payload, fetched_at) VALUES (?, ?, ?)",
+                                 ("Berakhot_2a", blob, time.time()))
+        self.assertEqual(store.get("Berakhot_2a"), {'title': "Berakhot", 'versions': [{'text': ["א"]}]})
+        payload = store._connect().execute("SELECT payload FROM responses WHERE key = ?", ("Berakhot_2a",)).fetchone()[0]
+        self.assertTrue(tb.decode_cache_record(payload)[1])
+
+    def test_negative_entries(self):
+        store = tb.SqliteResponseStore("cache.db", negative_ttl=60)
+        store.put_negative("Rashi_on_Berakhot.2a.9", "Not found")
+        self.assertEqual(store.get_negative("Rashi_on_Berakhot.2a.9"), "Not found")
+        self.assertEqual(store.purge_negative("Rashi_on_Berakhot_*"), 1)
+        self.assertIsNone(store.get_negative("Rashi_on_Berakhot.2a.9"))
+
+    def test_data_dir_is_migrated(self):
+        files = tb.FileResponseStore()
+        files.put("Berakhot_2a", daf_payload(["א"]))
+        with open(os.path.join(tb.CACHE_DIR, "Berakhot_2b.json"), 'w', encoding='utf-8') as f:
+            json.dump(daf_payload(["ב"]), f)
+        with open(os.path.join(tb.CACHE_DIR, "Berakhot_3a.json.gz"), 'wb') as f:
+            f.write(b"not gzip")
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(tb.migrate_data_dir_to_sqlite(tb.CACHE_DIR, "cache.db"), (2, 1))
+        store = tb.SqliteResponseStore("cache.db")
+        self.assertEqual(store.get("Berakhot_2a")['versions'], [{'text': ["א"]}])
+        self.assertEqual(store.get("Berakhot_2b")['versions'], [{'text': ["ב"]}])
+        self.assertFalse(store.contains("Berakhot_3a"))
+
+class NegativeCacheTest(IsolatedTestCase):
+    def test_miss_is_remembered_within_ttl(self):
+        store = tb.FileResponseStore(negative_ttl=60)
+        self.assertIsNone(store.get_negative("Rashi_on_Berakhot.2a.9"))
+        store.put_negative("Rashi_on_Berakhot.2a.9", "Not found")
+        self.assertEqual(store.get_negative("Rashi_on_Berakhot.2a.9"), "Not found")
+
+    def test_expired_miss_is_ignored_and_purged(self):
+        store = tb.FileResponseStore(negative_ttl=60)
+        store.put_negative("Rashi_on_Berakhot.2a.9", "Not found")
+        store.put_negative("Rashi_on_Berakhot.2a.8", "Not found")
+        path = store.negative_path_for("Rashi_on_Berakhot.2a.9")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'ref': "Rashi_on_Berakhot.2a.9", 'error': "Not found", 'cached_at': time.time() - 120}, f)
+        self.assertIsNone(store.get_negative("Rashi_on_Berakhot.2a.9"))
+        self.assertEqual(store.purge_negative(expired_only=True), 1)
+        self.assertEqual(store.get_negative("Rashi_on_Berakhot.2a.8"), "Not found")
+
+    def test_zero_ttl_disables_negative_cache(self):
+        store = tb.FileResponseStore(negative_ttl=0)
+        store.put_negative("Rashi_on_Berakhot.2a.9", "Not found")
+        self.assertFalse(os.path.exists(store.negative_path_for("Rashi_on_Berakhot.2a.9")))
+        self.assertIsNone(store.get_negative("Rashi_on_Berakhot.2a.9"))
+
+    def test_only_missing_text_is_negative_cacheable(self):
+        self.assertTrue(tb.is_negative_cacheable(404, "Not found"))
+        self.assertFalse(tb.is_negative_cacheable(503, "Service Unavailable"))
+        self.assertFalse(tb.is_negative_cacheable(429, "Too Many Requests"))
+
+class CacheManagerTest(IsolatedTestCase):
+    def write_entry(self, directory, name, size, age, last_read=None):
+        """Write a cache file of size bytes, written age seconds ago and last read last_read seconds ago."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(b"x" * size)
+        now = time.time()
+        os.utime(path, (now - (age if last_read is None else last_read), now - age))
+        return path
+
+    def test_ttl_expires_old_entries(self):
+        old = self.write_entry("data", "Berakhot_2a.json.gz", 100, age=1000)
+        new = self.write_entry("data", "Berakhot_2b.json.gz", 100, age=10)
+        content = self.write_entry("content_cache", "range.json", 100, age=1000)
+        manager = tb.CacheManager({'data': ("data", 500), 'content': ("content_cache", None)}, min_age=0)
+        summary = manager.collect()
+        self.assertEqual(summary['data']['expired'], 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.exists(content))
+        self.assertEqual(summary['total_bytes'], 200)
+
+    def test_budget_evicts_least_recently_read(self):
+        paths = [self.write_entry("data", f"Berakhot_{daf}.json.gz", 100, age=5000, last_read=read)
+                 for daf, read in (("2a", 4000), ("2b", 1000), ("3a", 3000))]
+        manager = tb.CacheManager({'data': ("data", None)}, max_bytes=150, min_age=0)
+        summary = manager.collect()
+        self.assertEqual(summary['data']['evicted'], 2)
+        self.assertEqual([os.path.exists(path) for path in paths], [False, True, False])
+        self.assertEqual(summary['total_bytes'], 100)
+
+    def test_recent_entries_are_kept_over_budget(self):
+        recent = self.write_entry("data", "Berakhot_2a.json.gz", 100, age=5, last_read=5)
+        old = self.write_entry("data", "Berakhot_2b.json.gz", 100, age=5000)
+        summary = tb.CacheManager({'data': ("data", None)}, max_bytes=0, min_age=300).collect()
+        self.assertTrue(os.path.exists(recent))
+        self.assertFalse(os.path.exists(old))
+        self.assertEqual(summary['total_bytes'], 100)
+
+    def test_dry_run_deletes_nothing(self):
+        path = self.write_entry("data", "Berakhot_2a.json.gz", 100, age=5000)
+        summary = tb.CacheManager({'data': ("data", 60)}, max_bytes=0, min_age=0).collect(dry_run=True)
+        self.assertEqual(summary['data']['expired'], 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_non_cache_files_are_ignored(self):
+        other = self.write_entry("data", "build_history.jsonl", 100, age=5000)
+        summary = tb.CacheManager({'data': ("data", 60)}, max_bytes=0, min_age=0).collect()
+        self.assertTrue(os.path.exists(other))
+        self.assertEqual(summary['data']['entries'], 0)
+
+    def test_index_shapes_are_not_evicted(self):
+        shape = self.write_entry(tb.INDEX_CACHE_DIR, "Berakhot.json", 100, age=5000)
+        response = self.write_entry(tb.CACHE_DIR, "Berakhot_2a.json", 100, age=5000)
+        summary = tb.CacheManager({'data': (tb.CACHE_DIR, 60)}, max_bytes=0, min_age=0).collect()
+        self.assertTrue(os.path.exists(shape))
+        self.assertFalse(os.path.exists(response))
+        self.assertEqual(summary['data']['entries'], 1)
+
+if __name__ == "__main__":
+    unittest.main()
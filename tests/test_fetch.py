@@ -0,0 +1,120 @@
+import threading
+import unittest
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+class ResponseMemoTest(unittest.TestCase):
+    def test_concurrent_lookups_are_single_flighted(self):
+        memo = tb.ResponseMemo(max_entries=10)
+        calls = []
+        release = threading.Event()
+
+        def fetch(ref):
+            calls.append(ref)
+            release.wait(5)
+            return daf_payload(["א"]), None
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(memo.get_or_fetch("Berakhot_2a", fetch)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Wait until one caller fetches and the other four wait on it
+        while memo.stats()['misses'] + memo.stats()['coalesced'] < 5:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(calls, ["Berakhot_2a"])
+        self.assertEqual(results, [(daf_payload(["א"]), None)] * 5)
+        self.assertEqual(memo.get_or_fetch("Berakhot.2a", fetch), (daf_payload(["א"]), None))
+        stats = memo.stats()
+        self.assertEqual((stats['misses'], stats['coalesced'], stats['hits']), (1, 4, 1))
+
+    def test_errors_are_not_remembered(self):
+        memo = tb.ResponseMemo()
+        self.assertEqual(memo.get_or_fetch("Berakhot_2a", lambda ref: (None, "HTTP 503")), (None, "HTTP 503"))
+        self.assertEqual(memo.get_or_fetch("Berakhot_2a", lambda ref: (daf_payload(["א"]), None)),
+                         (daf_payload(["א"]), None))
+        self.assertEqual(memo.stats()['misses'], 2)
+
+    def test_exceptions_reach_the_caller(self):
+        memo = tb.ResponseMemo()
+
+        def fail(ref):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            memo.get_or_fetch("Berakhot_2a", fail)
+        self.assertEqual(memo.get_or_fetch("Berakhot_2a", lambda ref: (daf_payload(["א"]), None))[1], None)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        memo = tb.ResponseMemo(max_entries=2)
+        for ref in ("Berakhot_2a", "Berakhot_2b"):
+            memo.get_or_fetch(ref, lambda ref: (daf_payload([ref]), None))
+        memo.get_or_fetch("Berakhot_2a", lambda ref: (None, "not used"))
+        memo.get_or_fetch("Berakhot_3a", lambda ref: (daf_payload([ref]), None))
+        self.assertEqual(memo.get_or_fetch("Berakhot_2a", lambda ref: (None, "evicted"))[1], None)
+        self.assertEqual(memo.get_or_fetch("Berakhot_2b", lambda ref: (None, "evicted"))[1], "evicted")
+        self.assertEqual(memo.stats()['evictions'], 1)
+
+class CachedFixtureSource(tb.FixtureSource):
+    """Fixtures behind the response store, like the API source."""
+    cacheable = True
+
+class FlakyFixtureSource(CachedFixtureSource):
+    """Fixtures whose commentary requests fail the way a 503 from the API does."""
+    def fetch(self, ref):
+        if ref.startswith("Rashi"):
+            return None, "HTTP 503", False
+        return super().fetch(ref)
+
+class AssemblePagesTest(IsolatedTestCase):
+    def test_pages_with_bulk_commentary(self):
+        self.use_fixtures({
+            "Berakhot_2a": daf_payload(["seg1", "seg2"]),
+            "Berakhot_2b": daf_payload("only"),
+            "Rashi_on_Berakhot.2a": daf_payload([["r1"], []], title="Rashi on Berakhot"),
+        })
+        pages = tb.assemble_pages(["Berakhot_2a", "Berakhot_2b"], ["Rashi"], main_text_span=1)
+        self.assertEqual([page['header'] for page in pages], ["Berakhot 2a", "Berakhot 2b"])
+        self.assertEqual(pages[0]['segments'], [
+            {'text': "seg1", 'commentaries': [{'text': "r1", 'name': "Rashi"}]},
+            {'text': "seg2", 'commentaries': []},
+        ])
+        self.assertEqual(pages[1]['segments'], [{'text': "only", 'commentaries': []}])
+
+    def test_ranged_main_text_is_split_per_daf(self):
+        # Only the ranged ref has a fixture; each daf is then read from the response store
+        tb.configure_text_source(CachedFixtureSource({"Berakhot.2a-3a": daf_payload([["a"], ["b"], ["c"]])}))
+        pages = tb.assemble_pages(["Berakhot_2a", "Berakhot_2b", "Berakhot_3a"], [])
+        self.assertEqual([page['segments'][0]['text'] for page in pages], ["a", "b", "c"])
+        self.assertTrue(tb.get_response_store().contains("Berakhot_2b"))
+
+    def test_missing_and_empty_dafs_get_placeholders(self):
+        self.use_fixtures({"Berakhot_2a": daf_payload([]), "Berakhot_3a": daf_payload(["c"])})
+        refs = ["Berakhot_2a", "Berakhot_2b", "Berakhot_3a"]
+        pages = tb.assemble_pages(refs, [], main_text_span=1)
+        self.assertEqual([page['segments'][0]['text'] for page in pages],
+                         [tb.missing_text_placeholder("Berakhot_2a"), tb.missing_text_placeholder("Berakhot_2b"), "c"])
+        # Placeholder pages are not cached, so the dafs are fetched again next time
+        self.assertIsNone(tb.load_page_cache("Berakhot_2a", []))
+        self.assertIsNotNone(tb.load_page_cache("Berakhot_3a", []))
+
+    def test_response_without_versions_gets_placeholder(self):
+        # The shape a compact cache record without text decodes to
+        self.use_fixtures({"Berakhot_2a": {'title': "Berakhot", 'versions': []}})
+        pages = tb.assemble_pages(["Berakhot_2a"], [], main_text_span=1)
+        self.assertEqual(pages[0]['segments'][0]['text'], tb.missing_text_placeholder("Berakhot_2a"))
+
+    def test_transient_commentary_failure_is_not_cached(self):
+        tb.configure_text_source(FlakyFixtureSource({"Berakhot_2a": daf_payload(["seg1"])}))
+        pages = tb.assemble_pages(["Berakhot_2a"], ["Rashi"], main_text_span=1)
+        self.assertEqual(pages[0]['segments'], [{'text': "seg1", 'commentaries': []}])
+        self.assertTrue(pages[0]['incomplete'])
+        self.assertIsNone(tb.load_page_cache("Berakhot_2a", ["Rashi"]))
+        # Unlike a real miss, the failure is not remembered in the negative cache
+        self.assertIsNone(tb.get_response_store().get_negative("Rashi_on_Berakhot.2a"))
+
+if __name__ == "__main__":
+    unittest.main()
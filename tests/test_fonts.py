@@ -0,0 +1,72 @@
+import logging
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), tb.DEFAULT_FONT)
+
+class ContentCharactersTest(unittest.TestCase):
+    def test_text_title_and_entities(self):
+        content = {'cover': None, 'pages': [{'header': "Berakhot 2a", 'segments': [
+            {'text': "א&amp;ב", 'commentaries': [{'text': "ג", 'name': "Rashi"}]}]}]}
+        characters = tb.content_characters(content, "מסכת")
+        for character in "אבגמסכת&" + tb.FONT_BASE_CHARACTERS:
+            self.assertIn(character, characters)
+        self.assertNotIn(";", characters.replace(tb.FONT_BASE_CHARACTERS, ""))
+        self.assertEqual(characters, "".join(sorted(set(characters))))
+
+@unittest.skipIf(tb.font_subset is None, "fontTools is not installed")
+class FontSubsetCacheTest(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        shutil.copy(FONT, "font.ttf")
+
+    def counter(self, name):
+        return tb.METRICS.to_dict()['counters'].get(name, 0)
+
+    def test_subset_is_built_once_and_cached(self):
+        built, hits = self.counter("font_subsets_built"), self.counter("font_subset_hits")
+        data, content_type = tb.font_subset_bytes("font.ttf", "אב")
+        self.assertLess(len(data), os.path.getsize("font.ttf"))
+        self.assertEqual(content_type, "font/woff2" if tb.brotli is not None else "font/ttf")
+        self.assertEqual(len(os.listdir(tb.FONT_CACHE_DIR)), 1)
+        # The same characters in another order are the same glyph set
+        self.assertEqual(tb.font_subset_bytes("font.ttf", "באב"), (data, content_type))
+        self.assertEqual((self.counter("font_subsets_built") - built, self.counter("font_subset_hits") - hits), (1, 1))
+        tb.font_subset_bytes("font.ttf", "אבג")
+        self.assertEqual(len(os.listdir(tb.FONT_CACHE_DIR)), 2)
+
+    def test_changed_font_gets_a_new_subset(self):
+        tb.font_subset_bytes("font.ttf", "אב")
+        with open("font.ttf", 'ab') as f:
+            f.write(b"\0" * 4)
+        tb.font_subset_bytes("font.ttf", "אב")
+        self.assertEqual(len(os.listdir(tb.FONT_CACHE_DIR)), 2)
+
+    def test_subsetting_leaves_font_tools_logging_alone(self):
+        # assertLogs sets fontTools to DEBUG for the block and restores it afterwards
+        with self.assertLogs("fontTools", level="DEBUG"):
+            tb.font_subset_bytes("font.ttf", "אב")
+            self.assertEqual(logging.getLogger("fontTools").level, logging.DEBUG)
+
+    def test_unreadable_font_falls_back_to_the_whole_file(self):
+        with open("broken.ttf", 'wb') as f:
+            f.write(b"not a font")
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(tb.font_subset_bytes("broken.ttf", "אב"), (b"not a font", "font/ttf"))
+        self.assertFalse(os.path.exists(tb.FONT_CACHE_DIR))
+
+class WholeFontTest(IsolatedTestCase):
+    def test_without_font_tools_the_whole_font_is_used(self):
+        shutil.copy(FONT, "font.ttf")
+        with mock.patch.object(tb, "font_subset", None):
+            self.assertEqual(tb.font_delivery(), "ttf")
+            with open("font.ttf", 'rb') as f:
+                self.assertEqual(tb.font_subset_bytes("font.ttf", "אב"), (f.read(), "font/ttf"))
+            self.assertTrue(tb.font_data_url("font.ttf", "אב").startswith("data:font/ttf;base64,"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from tests import tb
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b"{}"
+
+class ScriptedSession:
+    """Returns (or raises) the scripted outcomes in order, one per request."""
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+class HttpGetTest(unittest.TestCase):
+    def setUp(self):
+        tb.configure_http(max_retries=2, backoff_base=0.5, backoff_max=5)
+        self.addCleanup(tb.configure_http, max_retries=tb.DEFAULT_MAX_RETRIES, backoff_base=tb.DEFAULT_BACKOFF_BASE,
+                        backoff_max=tb.DEFAULT_BACKOFF_MAX)
+        sleep = mock.patch.object(tb.time, "sleep")
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+        self.stats = tb.start_http_stats()
+
+    def get(self, *outcomes):
+        session = ScriptedSession(*outcomes)
+        with mock.patch.object(tb, "get_http_session", lambda: session):
+            return tb.http_get("https://example.org/api/v3/texts/Berakhot_2a"), session
+
+    def test_retryable_statuses_are_retried(self):
+        resp, session = self.get(FakeResponse(503), FakeResponse(429), FakeResponse(200))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(session.calls, 3)
+        self.assertEqual((self.stats['requests'], self.stats['retries'], self.stats['failures']), (3, 2, 0))
+        for (delay,), _ in self.sleep.call_args_list:
+            self.assertLessEqual(delay, 5)
+
+    def test_exhausted_retries_count_one_failure(self):
+        resp, session = self.get(FakeResponse(503), FakeResponse(503), FakeResponse(503))
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual((self.stats['requests'], self.stats['retries'], self.stats['failures']), (3, 2, 1))
+
+    def test_not_found_is_not_a_failure(self):
+        resp, session = self.get(FakeResponse(404))
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual((session.calls, self.stats['retries'], self.stats['failures']), (1, 0, 0))
+
+    def test_retry_after_is_honored_up_to_backoff_max(self):
+        resp, _ = self.get(FakeResponse(503, {"Retry-After": "2"}), FakeResponse(200))
+        self.assertEqual(resp.status_code, 200)
+        self.sleep.assert_called_once_with(2.0)
+
+    def test_longer_retry_after_gives_up_at_once(self):
+        with self.assertLogs(level="WARNING"):
+            resp, session = self.get(FakeResponse(429, {"Retry-After": "3600"}))
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(session.calls, 1)
+        self.sleep.assert_not_called()
+        self.assertEqual(self.stats['failures'], 1)
+
+    def test_connection_errors_raise_after_retries(self):
+        error = requests.ConnectionError("refused")
+        with self.assertRaises(requests.ConnectionError):
+            self.get(error, error, error)
+        self.assertEqual((self.stats['requests'], self.stats['retries'], self.stats['failures']), (3, 2, 1))
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds_and_dates(self):
+        self.assertEqual(tb.parse_retry_after("7"), 7.0)
+        self.assertEqual(tb.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(tb.parse_retry_after("soon"))
+        self.assertIsNone(tb.parse_retry_after(None))
+
+if __name__ == "__main__":
+    unittest.main()
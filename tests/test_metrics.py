@@ -0,0 +1,50 @@
+import json
+import unittest
+from unittest import mock
+
+from tests import IsolatedTestCase, tb
+
+class MetricsTest(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics = tb.Metrics()
+        self.metrics.incr("dafs_processed", 3)
+        self.metrics.incr("dafs_processed")
+        self.metrics.observe("fetch_text", 0.25, ref="Berakhot_2a")
+        self.metrics.observe("fetch_text", 0.75, ref="Berakhot_2b")
+        with self.metrics.span("output"):
+            pass
+
+    def test_json_report(self):
+        self.metrics.write_json("metrics.json")
+        with open("metrics.json", 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual(report['counters'], {'dafs_processed': 4})
+        self.assertEqual(report['spans']['fetch_text'], {'count': 2, 'seconds': 1.0, 'max_seconds': 0.75})
+        self.assertEqual(report['spans']['output']['count'], 1)
+        self.assertEqual([span['ref'] for span in report['ref_spans']], ["Berakhot_2a", "Berakhot_2b"])
+        self.assertEqual(set(report['http']), {'requests', 'retries', 'failures', 'latency_total', 'latency_max'})
+
+    def test_prometheus_text(self):
+        self.metrics.write_prometheus("metrics.prom")
+        with open("metrics.prom", 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertIn("# TYPE talmud_booklet_dafs_processed_total counter", lines)
+        self.assertIn("talmud_booklet_dafs_processed_total 4", lines)
+        self.assertIn('talmud_booklet_span_seconds_sum{span="fetch_text"} 1.000000', lines)
+        self.assertIn('talmud_booklet_span_seconds_count{span="fetch_text"} 2', lines)
+        self.assertIn('talmud_booklet_span_max_seconds{span="fetch_text"} 0.750000', lines)
+        self.assertIn("talmud_booklet_http_requests_total", "\n".join(lines))
+        # Per-ref spans would give every ref its own series
+        self.assertFalse(any("Berakhot_2a" in line for line in lines))
+
+    def test_ref_spans_are_bounded(self):
+        with mock.patch.object(tb, "MAX_REF_SPANS", 2):
+            self.metrics.reset()
+        for daf in ("2a", "2b", "3a"):
+            self.metrics.observe("fetch_text", 0.1, ref=f"Berakhot_{daf}")
+        self.assertEqual([span['ref'] for span in self.metrics.to_dict()['ref_spans']], ["Berakhot_2b", "Berakhot_3a"])
+        self.assertEqual(self.metrics.to_dict()['spans']['fetch_text']['count'], 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import unittest
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), tb.DEFAULT_FONT)
+
+TARGET = {'format': "html", 'page_format': "A6", 'font_size': 10, 'text_format': "optimize", 'output': "out.html"}
+
+class TargetInputsTest(IsolatedTestCase):
+    def inputs(self, font_path):
+        return tb.target_inputs(TARGET, "Berakhot", ["Rashi"], font_path, 0, "digest")
+
+    def test_missing_font_is_a_known_input(self):
+        with self.assertLogs(level="WARNING"):
+            inputs = self.inputs("missing.ttf")
+        self.assertIsNone(inputs['font'])
+        # Adding the font later changes the fingerprint, so the output is rebuilt with it
+        with open("missing.ttf", 'wb') as f:
+            f.write(b"font")
+        self.assertNotEqual(tb.inputs_fingerprint(self.inputs("missing.ttf")), tb.inputs_fingerprint(inputs))
+
+class IncrementalBuildTest(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_fixtures({"Berakhot_2a": daf_payload(["a"])})
+        shutil.copy(FONT, "font.ttf")
+
+    def build(self, **options):
+        """Run a build; True if it wrote out.html, False if it found it up to date."""
+        options = dict({'commentary_specs': [], 'output_format': "html", 'output_file': "out.html",
+                        'font_path': "font.ttf"}, **options)
+        with self.assertLogs(level="INFO") as logs:
+            tb.main("Berakhot_2a", **options)
+        return not any("Up to date" in line for line in logs.output)
+
+    def test_unchanged_build_is_skipped(self):
+        self.assertTrue(self.build())
+        self.assertTrue(os.path.exists(tb.output_manifest_path("out.html")))
+        self.assertFalse(self.build())
+
+    def test_changed_inputs_rebuild(self):
+        self.build()
+        self.assertTrue(self.build(font_size=12))
+        self.assertFalse(self.build(font_size=12))
+        with open("font.ttf", 'ab') as f:
+            f.write(b"\0" * 4)
+        self.assertTrue(self.build(font_size=12))
+
+    def test_missing_or_edited_output_and_force_rebuild(self):
+        self.build()
+        os.remove("out.html")
+        self.assertTrue(self.build())
+        with open("out.html", 'a', encoding='utf-8') as f:
+            f.write("edited")
+        self.assertTrue(self.build())
+        self.assertTrue(self.build(force=True))
+
+    def test_no_manifest_without_output_manifest(self):
+        self.build(output_manifest=False)
+        self.assertFalse(os.path.exists(tb.output_manifest_path("out.html")))
+        self.assertTrue(self.build())
+
+if __name__ == "__main__":
+    unittest.main()
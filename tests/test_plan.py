@@ -0,0 +1,53 @@
+import unittest
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+class EstimateDurationTest(unittest.TestCase):
+    def test_without_history(self):
+        estimate = tb.estimate_duration(10, 5, "pdf", 4, [])
+        self.assertEqual(estimate['request_latency'], tb.DEFAULT_PLAN_LATENCY)
+        self.assertEqual(estimate['parallelism'], 4)
+        self.assertEqual(estimate['fetch_seconds'], round(10 * tb.DEFAULT_PLAN_LATENCY / 4, 2))
+        self.assertIsNone(estimate['output_seconds'])
+
+    def test_from_history(self):
+        history = [
+            {'requests': 10, 'latency_total': 2.0, 'content_seconds': 1.0, 'output_format': "pdf", 'dafs': 5,
+             'output_seconds': 5.0},
+            {'requests': 10, 'latency_total': 4.0, 'content_seconds': 1.0, 'output_format': "html", 'dafs': 5,
+             'output_seconds': 1.0},
+        ]
+        estimate = tb.estimate_duration(6, 2, "pdf", 8, history)
+        # 0.3 s per request, with the median parallelism (2 and 4) of earlier builds
+        self.assertEqual((estimate['request_latency'], estimate['parallelism']), (0.3, 3.0))
+        self.assertEqual(estimate['fetch_seconds'], 0.6)
+        self.assertEqual(estimate['output_seconds'], 2.0)
+        self.assertEqual(estimate['total_seconds'], 2.6)
+
+class CachedFixtureSource(tb.FixtureSource):
+    cacheable = True
+
+class PlanBuildTest(IsolatedTestCase):
+    def test_requests_by_kind_and_cache_hits(self):
+        tb.configure_text_source(CachedFixtureSource({}))
+        store = tb.get_response_store()
+        store.put("Berakhot_3a", daf_payload(["c"]))
+        store.put("Rashi_on_Berakhot.2a", daf_payload([["r"]], title="Rashi on Berakhot"))
+        store.put_negative("Rashi_on_Berakhot.2b", "Not found")
+        plan = tb.plan_build("Berakhot_2a-Berakhot_3b", commentary_specs=["Rashi"], main_text_span=10)
+        # 2a-2b in one ranged call, 3b alone; 3a is in the store
+        self.assertEqual(plan['requests'], {'main_text': 1, 'main_text_ranged': 1, 'commentary': 2, 'total': 4})
+        self.assertEqual(plan['cache_hits'], {'content_cache': 0, 'page_cache': 0, 'response_cache': 2,
+                                              'negative_cache': 1})
+        self.assertEqual(plan['cache_hit_ratio'], round(1 - 4 / 7, 4))
+
+    def test_output_estimate_counts_only_dafs_to_compile(self):
+        self.use_fixtures({})
+        tb.record_build_history({'output_format': "html", 'dafs': 4, 'output_seconds': 2.0})
+        tb.save_page_cache("Berakhot_2a", [], {'header': "Berakhot 2a", 'segments': []})
+        plan = tb.plan_build("Berakhot_2a-Berakhot_3a", commentary_specs=[], output_format="html")
+        self.assertEqual((plan['dafs'], plan['dafs_to_compile']), (3, 2))
+        self.assertEqual(plan['estimate']['output_seconds'], 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
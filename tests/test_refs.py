@@ -0,0 +1,115 @@
+import unittest
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+# Per-amud segment counts: Berakhot runs from 2a to 4a, Shabbat from 2a to 3a
+SHAPES = {
+    'Berakhot': [0, 0, 3, 2, 4, 1, 2],
+    'Shabbat': [0, 0, 2, 2, 2],
+}
+
+class SplitRangedTextTest(unittest.TestCase):
+    def test_one_list_per_daf(self):
+        data = daf_payload([["a", "b"], ["c"]])
+        self.assertEqual(tb.split_ranged_text(data, 2), [["a", "b"], ["c"]])
+
+    def test_single_string_daf(self):
+        self.assertEqual(tb.split_ranged_text(daf_payload(["a", ["b"]]), 2), [["a"], ["b"]])
+
+    def test_empty_daf_is_kept_empty(self):
+        self.assertEqual(tb.split_ranged_text(daf_payload([["a"], []]), 2), [["a"], []])
+
+    def test_unexpected_shapes(self):
+        self.assertIsNone(tb.split_ranged_text(daf_payload([["a"]]), 2))
+        self.assertIsNone(tb.split_ranged_text(daf_payload([["a"], [1]]), 2))
+        self.assertIsNone(tb.split_ranged_text(daf_payload("a"), 1))
+        self.assertIsNone(tb.split_ranged_text({'versions': []}, 1))
+        self.assertIsNone(tb.split_ranged_text(None, 1))
+
+class SplitBulkCommentaryTest(unittest.TestCase):
+    def test_one_list_per_segment(self):
+        data = daf_payload([["x"], [], ["y", "z"]])
+        self.assertEqual(tb.split_bulk_commentary(data, 3), [["x"], [], ["y", "z"]])
+
+    def test_strings_and_empty_strings(self):
+        self.assertEqual(tb.split_bulk_commentary(daf_payload(["x", ""]), 2), [["x"], []])
+
+    def test_pads_missing_trailing_segments(self):
+        self.assertEqual(tb.split_bulk_commentary(daf_payload([["x"]]), 3), [["x"], [], []])
+
+    def test_truncates_extra_segments(self):
+        self.assertEqual(tb.split_bulk_commentary(daf_payload([["x"], ["y"], ["z"]]), 2), [["x"], ["y"]])
+
+    def test_unexpected_shapes(self):
+        self.assertIsNone(tb.split_bulk_commentary(daf_payload("x"), 1))
+        self.assertIsNone(tb.split_bulk_commentary(daf_payload([[["x"]]]), 1))
+        self.assertIsNone(tb.split_bulk_commentary({'versions': []}, 1))
+        self.assertIsNone(tb.split_bulk_commentary(None, 1))
+
+class GenerateTalmudRefsTest(unittest.TestCase):
+    def test_inclusive_range(self):
+        self.assertEqual(tb.generate_talmud_refs("Berakhot_2b", "Berakhot_4a"),
+                         ["Berakhot_2b", "Berakhot_3a", "Berakhot_3b", "Berakhot_4a"])
+
+    def test_reversed_range_raises(self):
+        with self.assertRaises(ValueError):
+            tb.generate_talmud_refs("Berakhot_5a", "Berakhot_2a")
+        with self.assertRaises(ValueError):
+            tb.generate_talmud_refs("Berakhot_2b", "Berakhot_2a")
+
+    def test_cross_tractate_range_raises(self):
+        with self.assertRaises(ValueError):
+            tb.generate_talmud_refs("Berakhot_2a", "Shabbat_2a")
+
+class ExpandRefSpecWithoutIndexTest(IsolatedTestCase):
+    def test_daf_and_range(self):
+        self.assertEqual(tb.expand_ref_spec("Berakhot_2a"), ["Berakhot_2a"])
+        self.assertEqual(tb.expand_ref_spec("Berakhot_2a-Berakhot_3a"), ["Berakhot_2a", "Berakhot_2b", "Berakhot_3a"])
+
+    def test_comma_separated_parts(self):
+        self.assertEqual(tb.expand_ref_spec("Berakhot_2a, Yoma_3b-Yoma_4a"), ["Berakhot_2a", "Yoma_3b", "Yoma_4a"])
+
+    def test_reversed_range_raises(self):
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Berakhot_5a-Berakhot_2a")
+
+    def test_whole_tractate_needs_index(self):
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Berakhot")
+
+    def test_invalid_and_empty_specs(self):
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Berakhot_2c")
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec(" , ")
+
+class ExpandRefSpecWithIndexTest(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_fixtures(shapes=SHAPES)
+
+    def test_whole_tractate(self):
+        self.assertEqual(tb.expand_ref_spec("Shabbat"), ["Shabbat_2a", "Shabbat_2b", "Shabbat_3a"])
+
+    def test_cross_tractate_range(self):
+        self.assertEqual(tb.expand_ref_spec("Berakhot_3b-Shabbat_2b"),
+                         ["Berakhot_3b", "Berakhot_4a", "Shabbat_2a", "Shabbat_2b"])
+
+    def test_reversed_ranges_raise(self):
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Berakhot_4a-Berakhot_2a")
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Shabbat_2a-Berakhot_3a")
+
+    def test_out_of_bounds_range_raises(self):
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Berakhot_3a-Berakhot_9a")
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Shabbat_1b")
+
+    def test_unknown_tractate_raises(self):
+        with self.assertRaises(ValueError):
+            tb.expand_ref_spec("Nonexistent")
+
+if __name__ == "__main__":
+    unittest.main()
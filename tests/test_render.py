@@ -0,0 +1,115 @@
+import io
+import threading
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import pypdf
+
+from tests import IsolatedTestCase, daf_payload, tb
+
+class FailingPlaywright:
+    """Stands in for sync_playwright(): every Chromium launch fails once release is set."""
+    def __init__(self, release):
+        self.release = release
+        self.chromium = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def launch(self, **options):
+        self.release.wait(5)
+        raise RuntimeError("Failed to launch chromium")
+
+class RenderPoolFailureTest(unittest.TestCase):
+    def start_pool(self, release):
+        patcher = mock.patch.object(tb, "sync_playwright", lambda: FailingPlaywright(release))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pool = tb.RenderPool(workers=2)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_queued_jobs_fail_when_no_worker_starts(self):
+        release = threading.Event()
+        pool = self.start_pool(release)
+        future = pool.submit("<html></html>")
+        with self.assertLogs(level="ERROR"):
+            release.set()
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+            for thread in pool._threads:
+                thread.join(5)
+
+    def test_submit_raises_once_all_workers_stopped(self):
+        release = threading.Event()
+        release.set()
+        with self.assertLogs(level="ERROR"):
+            pool = self.start_pool(release)
+            for thread in pool._threads:
+                thread.join(5)
+        with self.assertRaises(RuntimeError):
+            pool.submit("<html></html>")
+        self.assertFalse(pool.is_healthy())
+
+def blank_pdf(num_pages):
+    writer = pypdf.PdfWriter()
+    for _ in range(num_pages):
+        writer.add_blank_page(width=298, height=420)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+class FakePool:
+    """Stands in for a RenderPool: answers every document with one blank page per daf
+    header it contains, or per blank page of a page-number overlay."""
+    def __init__(self, headers):
+        self.headers = headers
+        self.documents = []
+
+    def submit(self, html, page_format=tb.DEFAULT_PAGE_FORMAT, resources=None):
+        document = html if isinstance(html, str) else "".join(html)
+        self.documents.append(document)
+        num_pages = document.count('<div class="blank">') or sum(header in document for header in self.headers)
+        future = Future()
+        future.set_result(blank_pdf(num_pages))
+        return future
+
+    def render(self, html, page_format=tb.DEFAULT_PAGE_FORMAT, resources=None, timeout=None):
+        return self.submit(html, page_format, resources).result(timeout)
+
+class ChunkedRenderTest(IsolatedTestCase):
+    def test_chunks_are_merged_in_order_with_numbers_and_outline(self):
+        refs = [f"Berakhot_{daf}" for daf in ("2a", "2b", "3a", "3b", "4a")]
+        self.use_fixtures({ref: daf_payload([f"text of {ref}"]) for ref in refs})
+        pages = tb.assemble_pages(refs, [], main_text_span=1)
+        headers = [page['header'] for page in pages]
+        pool = FakePool(headers)
+        pdf_bytes = tb.render_chunked_pdf(
+            {'cover': None, 'pages': pages}, "Berakhot", "font.ttf", 10, {}, [], "optimize", "A6", 2,
+            pool=pool, resources={"/font.ttf": (b"font", "font/ttf")})
+        # Three chunks of up to two dafs, then one page-number overlay for all five pages
+        self.assertEqual(len(pool.documents), 4)
+        self.assertIn("text of Berakhot_2a", pool.documents[0])
+        self.assertNotIn("text of Berakhot_3a", pool.documents[0])
+        self.assertIn("text of Berakhot_4a", pool.documents[2])
+        self.assertEqual(pool.documents[3].count('<div class="blank">'), 5)
+        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+        self.assertEqual(len(reader.pages), 5)
+        self.assertEqual([item.title for item in reader.outline], headers)
+        self.assertEqual([reader.get_destination_page_number(item) for item in reader.outline], [0, 0, 2, 2, 4])
+
+class MissingFontTest(IsolatedTestCase):
+    def test_missing_font_is_not_served(self):
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(tb.read_font("missing.ttf"))
+        self.assertEqual(tb.render_resources("missing.ttf"), {})
+        self.assertEqual(tb.render_resources("missing.ttf", "אב"), {})
+        # HTML exports then keep the file:// URL of the font, as without subsetting
+        self.assertIsNone(tb.font_data_url("missing.ttf", "אב"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tests import IsolatedTestCase, tb
+
+class IdlePool:
+    """Stands in for a RenderPool; validation tests never render."""
+    def health(self):
+        return []
+
+class ServiceValidationTest(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        with open("font.ttf", 'wb') as f:
+            f.write(b"font")
+        self.service = tb.BookletService(results_dir="results", font_path="font.ttf", workers=1,
+                                         render_pool=IdlePool())
+        self.addCleanup(self.service.close)
+
+    def assertRejected(self, params):
+        status, payload = self.service.submit(params)
+        self.assertEqual(status, 400, payload)
+        self.assertIn('error', payload)
+
+    def test_invalid_values_are_rejected(self):
+        for params in ({'output_format': "docx"}, {'text_format': "columns"}, {'commentary_fetch': "all"},
+                       {'font_size': "12"}, {'font_size': 0}, {'font_size': True}, {'chunk_size': -1},
+                       {'add_cover': "yes"}, {'commentary_specs': "Rashi"}, {'ref_range': 5},
+                       {'ref_range': "Berakhot_5a-Berakhot_2a"}):
+            with self.subTest(params=params):
+                self.assertRejected(dict({'ref_range': "Berakhot_2a"}, **params))
+
+    def test_unknown_and_missing_options_are_rejected(self):
+        self.assertRejected({'ref_range': "Berakhot_2a", 'colour': "red"})
+        self.assertRejected({'font_size': 12})
+
+    def test_missing_font_is_rejected(self):
+        service = tb.BookletService(results_dir="results", font_path="missing.ttf", workers=1,
+                                    render_pool=IdlePool())
+        self.addCleanup(service.close)
+        with self.assertLogs(level="WARNING"):
+            status, payload = service.submit({'ref_range': "Berakhot_2a"})
+        self.assertEqual(status, 400)
+        self.assertIn("missing.ttf", payload['error'])
+
+class ServiceBackpressureTest(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        with open("font.ttf", 'wb') as f:
+            f.write(b"font")
+        self.release = threading.Event()
+        self.builds = []
+
+        def build(output_file, **kwargs):
+            self.builds.append(kwargs['ref_range'])
+            self.release.wait(5)
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write("<html></html>")
+
+        patcher = mock.patch.object(tb, "main", build)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = tb.BookletService(results_dir="results", font_path="font.ttf", workers=1, queue_size=1,
+                                         render_pool=IdlePool())
+        self.addCleanup(self.service.close)
+        self.addCleanup(self.release.set)
+
+    def wait_for(self, job_id, status):
+        for _ in range(500):
+            if self.service.status(job_id)['status'] == status:
+                return
+            time.sleep(0.01)
+        self.fail(f"job {job_id} never became {status}")
+
+    def test_full_queue_rejects_and_identical_jobs_coalesce(self):
+        first = {'ref_range': "Berakhot_2a", 'output_format': "html"}
+        status, running = self.service.submit(first)
+        self.assertEqual(status, 202)
+        self.wait_for(running['id'], "running")
+        self.assertEqual(self.service.submit({'ref_range': "Berakhot_2b", 'output_format': "html"})[0], 202)
+        status, payload = self.service.submit({'ref_range': "Berakhot_3a", 'output_format': "html"})
+        self.assertEqual(status, 429)
+        self.assertEqual(payload['queue_size'], 1)
+        # An identical request joins the running job instead of queueing another
+        status, joined = self.service.submit(dict(first))
+        self.assertEqual((status, joined['id']), (202, running['id']))
+        self.release.set()
+        self.wait_for(running['id'], "done")
+        status, cached = self.service.submit(dict(first))
+        self.assertEqual((status, cached['cached']), (200, True))
+        self.assertEqual(self.builds[0], "Berakhot_2a")
+        self.assertNotIn("Berakhot_3a", self.builds)
+        self.assertIn("talmud_booklet_service_queue_capacity 1", self.service.metrics())
+
+if __name__ == "__main__":
+    unittest.main()
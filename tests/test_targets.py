@@ -0,0 +1,28 @@
+import unittest
+
+from tests import tb
+
+DEFAULTS = {'format': "pdf", 'page_format': "A6", 'font_size': 10, 'text_format': "optimize", 'output': "out.pdf"}
+
+class ParseTargetSpecTest(unittest.TestCase):
+    def test_keys_left_out_come_from_defaults(self):
+        target = tb.parse_target_spec("page_format=A5,output=a5.pdf", DEFAULTS)
+        self.assertEqual(target, dict(DEFAULTS, page_format="A5", output="a5.pdf"))
+
+    def test_values_are_typed_and_stripped(self):
+        target = tb.parse_target_spec("format=html, font_size=12 ,text_format=text-commentaries", DEFAULTS)
+        self.assertEqual(target['format'], "html")
+        self.assertEqual(target['font_size'], 12)
+        self.assertEqual(target['text_format'], "text-commentaries")
+
+    def test_defaults_are_not_modified(self):
+        tb.parse_target_spec("output=other.pdf", DEFAULTS)
+        self.assertEqual(DEFAULTS['output'], "out.pdf")
+
+    def test_invalid_specs_raise(self):
+        for spec in ("color=red", "page_format", "format=docx", "text_format=columns", "font_size=big"):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                tb.parse_target_spec(spec, DEFAULTS)
+
+if __name__ == "__main__":
+    unittest.main()